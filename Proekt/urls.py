@@ -17,13 +17,25 @@ Including another URLconf
 # Proekt/urls.py
 
 from django.urls import path, include
-from logistics import views
+from logistics import api, async_views, views
 from logistics.custom_admin import admin_site
 
 urlpatterns = [
     path('admin/', admin_site.urls),
     path('', views.home, name='home'),
     path('send-reminder/', views.send_reminder_view, name='send_reminder'),
+    path('warehouses/occupancy/', views.warehouse_occupancy, name='warehouse_occupancy'),
+    path('containers/<int:pk>/cars/', views.container_cars, name='container_cars'),
+    path('clients/<int:pk>/balance/', views.client_balance, name='client_balance'),
+    path('clients/<int:pk>/statement/', views.client_statement, name='client_statement'),
+    path('cache/stats/', views.cache_stats, name='cache_stats'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('api/cars/', api.cars, name='api_cars'),
+    path('api/containers/', api.containers, name='api_containers'),
+    path('api/invoices/', api.invoices, name='api_invoices'),
+    path('api/dashboard/', async_views.dashboard, name='api_dashboard'),
+    path('api/containers/<str:number>/', async_views.container_detail, name='api_container_detail'),
+    path('api/cars/<str:vin>/', async_views.car_detail, name='api_car_detail'),
 ]
 
 
@@ -0,0 +1,87 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from .models import Car
+
+# Раскладка THS контейнера по его машинам. Стратегия (Container.ths_strategy) получает сумму и машины
+# контейнера и возвращает суммы в том же порядке; сумма частей всегда равна THS до копейки.
+# Новая стратегия — функция в STRATEGIES и строка в Container.THS_STRATEGY_CHOICES.
+
+CENT = Decimal('0.01')
+BATCH_SIZE = 1000
+CAR_FIELDS = ('pk', 'container_id', 'vin', 'ths', 'size_class', 'ths_fixed')
+
+
+def to_cents(amount):
+    return int(amount.quantize(CENT) / CENT)
+
+
+def distribute(total, weights):
+    # Метод наибольших остатков в целых копейках: каждому — пропорциональная доля с округлением вниз,
+    # оставшиеся копейки по одной тем, у кого отброшенная часть больше (при равенстве — раньше в списке)
+    if not weights:
+        return []
+    if not any(weights):
+        weights = [1] * len(weights)
+    cents, weight_sum = to_cents(total), sum(weights)
+    shares = [cents * weight // weight_sum for weight in weights]
+    leftover = cents - sum(shares)
+    order = sorted(range(len(weights)), key=lambda i: (-(cents * weights[i] % weight_sum), i))
+    for i in order[:leftover]:
+        shares[i] += 1
+    return [Decimal(share) * CENT for share in shares]
+
+
+def even(total, cars):
+    return distribute(total, [1] * len(cars))
+
+
+def weighted(total, cars):
+    return distribute(total, [Car.SIZE_WEIGHTS.get(car['size_class'], 1) for car in cars])
+
+
+def fixed(total, cars):
+    # Машины с ths_fixed получают свою сумму, остаток делится поровну между остальными. Если фиксированные
+    # суммы не сходятся с THS (больше него или остальных машин нет), THS делится пропорционально им.
+    fixed_cents = [to_cents(car['ths_fixed']) if car['ths_fixed'] is not None else None for car in cars]
+    flexible = [i for i, cents in enumerate(fixed_cents) if cents is None]
+    remainder = to_cents(total) - sum(cents for cents in fixed_cents if cents is not None)
+    if not flexible or remainder < 0:
+        return distribute(total, [cents or 0 for cents in fixed_cents])
+    amounts = [Decimal(cents or 0) * CENT for cents in fixed_cents]
+    for i, amount in zip(flexible, distribute(Decimal(remainder) * CENT, [1] * len(flexible))):
+        amounts[i] = amount
+    return amounts
+
+
+STRATEGIES = {
+    'even': even,
+    'weighted': weighted,
+    'fixed': fixed,
+}
+
+
+def allocate(containers):
+    # Машины всех контейнеров читаются одним запросом; возвращает {id контейнера: [(машина, новый THS)]}
+    containers = {c.pk: c for c in containers if c.pk and c.ths is not None}
+    cars_by_container = defaultdict(list)
+    for car in Car.objects.filter(container_id__in=containers).order_by('pk').values(*CAR_FIELDS):
+        cars_by_container[car['container_id']].append(car)
+    allocations = {}
+    for container_id, cars in cars_by_container.items():
+        container = containers[container_id]
+        amounts = STRATEGIES[container.ths_strategy](container.ths, cars)
+        allocations[container_id] = list(zip(cars, amounts))
+    return allocations
+
+
+def write_allocations(allocations):
+    # Пишутся только машины, у которых THS меняется, через bulk_update: один UPDATE ... CASE на пачку
+    cars = [
+        Car(pk=car['pk'], ths=amount)
+        for rows in allocations.values()
+        for car, amount in rows
+        if car['ths'] != amount
+    ]
+    Car.objects.bulk_update(cars, ['ths'], batch_size=BATCH_SIZE)
+    return len(cars)
@@ -0,0 +1,155 @@
+import hashlib
+from functools import wraps
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET
+
+from .models import Car, Container, Invoice
+from .search import search_cars
+
+MAX_LIMIT = 500
+DEFAULT_LIMIT = 100
+
+
+class Resource:
+    # fields: имя в ответе -> путь в ORM; связанные поля подтягиваются JOIN-ом через values()
+    def __init__(self, model, fields, default_fields, filters, search=None):
+        self.model = model
+        self.fields = fields
+        self.default_fields = default_fields
+        self.filters = filters
+        self.search = search
+
+    def queryset(self):
+        return self.model.objects.order_by('pk')
+
+    def related(self, fields):
+        # Связанные таблицы, из которых берутся запрошенные поля ('client__name' -> 'client')
+        return sorted({self.fields[name].rsplit('__', 1)[0] for name in fields if '__' in self.fields[name]})
+
+
+CARS = Resource(
+    Car,
+    fields={
+        'id': 'id', 'vin': 'vin', 'make': 'make', 'client': 'client__name', 'client_id': 'client_id',
+        'container': 'container__number', 'container_id': 'container_id', 'warehouse': 'warehouse__name',
+        'warehouse_id': 'warehouse_id', 'storage_status': 'storage_status', 'title': 'title',
+        'procedure': 'procedure', 'date_stored': 'date_stored', 'ths': 'ths', 'sklad': 'sklad',
+        'days_cost': 'days_cost', 'prof': 'prof', 'total': 'total', 'updated_at': 'updated_at',
+    },
+    default_fields=['id', 'vin', 'make', 'client', 'container', 'storage_status', 'date_stored', 'total'],
+    filters={'storage_status': 'storage_status', 'client_id': 'client_id', 'container': 'container__number',
+             'container_id': 'container_id', 'vin': 'vin'},
+    search=search_cars,
+)
+CONTAINERS = Resource(
+    Container,
+    fields={
+        'id': 'id', 'number': 'number', 'arrival_date': 'arrival_date', 'status': 'status',
+        'warehouse': 'warehouse__name', 'warehouse_id': 'warehouse_id', 'ths': 'ths', 'updated_at': 'updated_at',
+    },
+    default_fields=['id', 'number', 'arrival_date', 'status', 'warehouse'],
+    filters={'status': 'status', 'warehouse_id': 'warehouse_id', 'number': 'number'},
+)
+INVOICES = Resource(
+    Invoice,
+    fields={
+        'id': 'id', 'client': 'client__name', 'client_id': 'client_id', 'issue_date': 'issue_date',
+        'due_date': 'due_date', 'amount': 'amount', 'status': 'status', 'updated_at': 'updated_at',
+    },
+    default_fields=['id', 'client', 'issue_date', 'due_date', 'amount', 'status'],
+    filters={'status': 'status', 'client_id': 'client_id'},
+)
+
+
+class ApiError(Exception):
+    pass
+
+
+def api_view(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not (request.user.is_active and request.user.is_staff):
+            return JsonResponse({'error': "Требуется вход с правами сотрудника"}, status=403)
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    return require_GET(wrapper)
+
+
+def parse_int(request, name, default, maximum=None):
+    value = request.GET.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ApiError(f"Параметр {name} должен быть целым числом")
+    if value < 0:
+        raise ApiError(f"Параметр {name} не может быть отрицательным")
+    return min(value, maximum) if maximum else value
+
+
+def resource_list(resource):
+    @api_view
+    def view(request):
+        fields = request.GET.get('fields')
+        fields = fields.split(',') if fields else resource.default_fields
+        unknown = [name for name in fields if name not in resource.fields]
+        if unknown:
+            raise ApiError(f"Неизвестные поля: {', '.join(unknown)}")
+        after = parse_int(request, 'after', 0)
+        limit = parse_int(request, 'limit', DEFAULT_LIMIT, MAX_LIMIT) or DEFAULT_LIMIT
+
+        queryset = resource.queryset().filter(pk__gt=after)
+        for name, path in resource.filters.items():
+            if name in request.GET:
+                try:
+                    queryset = queryset.filter(**{path: request.GET[name]})
+                except (ValueError, ValidationError):
+                    raise ApiError(f"Недопустимое значение параметра {name}")
+        if request.GET.get('q') and resource.search:
+            queryset = resource.search(queryset, request.GET['q'])
+        page = queryset[:limit]
+
+        # Валидатор страницы одним агрегатом, без выборки строк: для опроса без изменений хватает 304.
+        # Имена из связанных таблиц (клиент, контейнер, склад) меняются без изменения строк страницы,
+        # поэтому в агрегат входят и их updated_at, и число связей (удалённый склад обнуляет ссылку)
+        related = resource.related(fields)
+        stamp = resource.model.objects.filter(pk__in=page.values('pk')).aggregate(
+            count=Count('pk'), last_id=Max('pk'), modified=Max('updated_at'),
+            **{f'{path}_count': Count(path) for path in related},
+            **{f'{path}_modified': Max(f'{path}__updated_at') for path in related},
+        )
+        modified = max((value for name, value in stamp.items() if name.endswith('modified') and value), default=None)
+        key = f"{request.path}|{sorted(request.GET.items())}|{sorted(stamp.items())}"
+        etag = f'"{hashlib.md5(key.encode()).hexdigest()}"'
+        last_modified = modified.timestamp() if modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            rows = list(page.values_list(*(resource.fields[name] for name in fields)))
+            next_url = None
+            if len(rows) == limit:
+                params = request.GET.copy()
+                params['after'] = stamp['last_id']
+                next_url = f"{request.path}?{params.urlencode()}"
+            response = JsonResponse({
+                'results': [dict(zip(fields, row)) for row in rows],
+                'next': next_url,
+            })
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+    return view
+
+
+cars = resource_list(CARS)
+containers = resource_list(CONTAINERS)
+invoices = resource_list(INVOICES)
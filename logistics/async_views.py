@@ -0,0 +1,189 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Count, Q, Sum
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_GET
+
+from .api import api_view
+from .models import Car, Container, Invoice, Payment, StatusEvent, Warehouse
+
+# Дашборд и карточки контейнера и машины: только чтение, каждый ответ — набор независимых запросов
+# (имя -> функция без аргументов, возвращающая готовые данные). Асинхронные view выполняют запросы
+# одновременно, синхронные двойники — по очереди; они подключаются только в loadtest (logistics/loadtest_urls.py).
+
+CAR_FIELDS = ('id', 'vin', 'make', 'client__name', 'storage_status', 'date_stored', 'total')
+HISTORY_FIELDS = ('status', 'warehouse_id', 'created_at')
+CONTAINER_FIELDS = ('id', 'number', 'arrival_date', 'status', 'warehouse__name', 'ths')
+CAR_DETAIL_FIELDS = (
+    'id', 'vin', 'make', 'client_id', 'client__name', 'container_id', 'container__number', 'container__status',
+    'warehouse__name', 'storage_status', 'title', 'procedure', 'date_stored', 'total',
+)
+
+
+def in_transaction():
+    return connection.in_atomic_block
+
+
+def persistent_connections():
+    return connection.settings_dict['CONN_MAX_AGE'] != 0
+
+
+executor = None
+
+
+def query_executor():
+    # Свой пул, а не общий пул sync_to_async: число потоков, а с ним и соединений, ограничено настройкой
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(settings.LOGISTICS_ASYNC_QUERY_THREADS, thread_name_prefix='logistics-query')
+    return executor
+
+
+def isolated(query):
+    # Запрос в потоке пула на его постоянном соединении; протухшие и сломанные соединения закрываются
+    # до и после запроса, как в начале и в конце обычного запроса Django
+    def run():
+        close_old_connections()
+        try:
+            return query()
+        finally:
+            close_old_connections()
+    return run
+
+
+async def run_concurrently(queries):
+    # Асинхронный ORM Django выполняет все запросы запроса в одном потоке, по очереди; одновременно они
+    # идут только в разных потоках с разными соединениями. Внутри транзакции (тесты, ATOMIC_REQUESTS)
+    # другие соединения не видят незакоммиченных данных, а без постоянных соединений (CONN_MAX_AGE=0)
+    # каждый запрос открывал бы новое соединение, поэтому там запросы идут по очереди в потоке запроса.
+    if await sync_to_async(in_transaction)() or not persistent_connections():
+        return await sync_to_async(run_sequentially)(queries)
+    # Контекст копируется, как в sync_to_async: в нём область запроса для маршрутизации на реплику
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(query_executor(), partial(contextvars.copy_context().run, isolated(query)))
+        for query in queries.values()
+    ))
+    return dict(zip(queries, results))
+
+
+def run_sequentially(queries):
+    return {name: query() for name, query in queries.items()}
+
+
+def async_api_view(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not (user.is_active and user.is_staff):
+            return JsonResponse({'error': "Требуется вход с правами сотрудника"}, status=403)
+        return await view(request, *args, **kwargs)
+    return require_GET(wrapper)
+
+
+def status_counts(queryset, field, choices):
+    counts = dict.fromkeys((status for status, _ in choices), 0)
+    counts.update(queryset.order_by().values_list(field).annotate(n=Count('pk')))
+    return counts
+
+
+def history(object_type, object_id):
+    return list(
+        StatusEvent.objects.filter(object_type=object_type, object_id=object_id)
+        .order_by('created_at', 'pk')
+        .values(*HISTORY_FIELDS)
+    )
+
+
+def dashboard_queries():
+    return {
+        'cars': lambda: status_counts(Car.objects.all(), 'storage_status', Car.STATUS_CHOICES),
+        'containers': lambda: status_counts(Container.objects.all(), 'status', Container.STATUS_CHOICES),
+        'warehouses': lambda: list(Warehouse.objects.order_by('name').values('id', 'name', 'capacity', 'occupied')),
+        'invoices': lambda: {
+            row.pop('status'): row
+            for row in Invoice.objects.order_by().values('status').annotate(count=Count('pk'), amount=Sum('amount'))
+        },
+        'payments': lambda: {
+            row.pop('status'): row
+            for row in Payment.objects.order_by().values('status').annotate(
+                count=Count('pk'), amount_due=Sum('amount_due'), amount_paid=Sum('amount_paid'),
+            )
+        },
+    }
+
+
+def container_queries(container_id):
+    cars = Car.objects.filter(container_id=container_id)
+    return {
+        'cars': lambda: list(cars.order_by('vin').values(*CAR_FIELDS)),
+        'car_statuses': lambda: status_counts(cars, 'storage_status', Car.STATUS_CHOICES),
+        'payments': lambda: Payment.objects.filter(Q(container_id=container_id) | Q(car__container_id=container_id))
+        .aggregate(amount_due=Sum('amount_due'), amount_paid=Sum('amount_paid')),
+        'history': lambda: history(StatusEvent.CONTAINER, container_id),
+    }
+
+
+def car_queries(car_id, container_id):
+    queries = {
+        'payments': lambda: list(
+            Payment.objects.filter(car_id=car_id).order_by('pk')
+            .values('id', 'payment_date', 'amount_due', 'amount_paid', 'status', 'payment_type')
+        ),
+        'invoices': lambda: list(
+            Invoice.objects.filter(cars=car_id).order_by('pk').values('id', 'issue_date', 'due_date', 'amount', 'status')
+        ),
+        'history': lambda: history(StatusEvent.CAR, car_id),
+    }
+    if container_id:
+        queries['container_history'] = lambda: history(StatusEvent.CONTAINER, container_id)
+    return queries
+
+
+@async_api_view
+async def dashboard(request):
+    return JsonResponse(await run_concurrently(dashboard_queries()))
+
+
+@async_api_view
+async def container_detail(request, number):
+    container = await Container.objects.filter(number=number).values(*CONTAINER_FIELDS).afirst()
+    if container is None:
+        raise Http404
+    return JsonResponse({**container, **await run_concurrently(container_queries(container['id']))})
+
+
+@async_api_view
+async def car_detail(request, vin):
+    # Карточка машины с историей статусов машины и её контейнера
+    car = await Car.objects.filter(vin=vin).values(*CAR_DETAIL_FIELDS).afirst()
+    if car is None:
+        raise Http404
+    return JsonResponse({**car, **await run_concurrently(car_queries(car['id'], car['container_id']))})
+
+
+@api_view
+def dashboard_sync(request):
+    return JsonResponse(run_sequentially(dashboard_queries()))
+
+
+@api_view
+def container_detail_sync(request, number):
+    container = Container.objects.filter(number=number).values(*CONTAINER_FIELDS).first()
+    if container is None:
+        raise Http404
+    return JsonResponse({**container, **run_sequentially(container_queries(container['id']))})
+
+
+@api_view
+def car_detail_sync(request, vin):
+    car = Car.objects.filter(vin=vin).values(*CAR_DETAIL_FIELDS).first()
+    if car is None:
+        raise Http404
+    return JsonResponse({**car, **run_sequentially(car_queries(car['id'], car['container_id']))})
@@ -0,0 +1,505 @@
+import asyncio
+import copy
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from celery import current_app
+from django.contrib.auth.models import User
+from django.core import mail
+from django.db import connection, connections, transaction
+from django.db.models import Count
+from django.test import AsyncClient as AsyncHttpClient, Client as HttpClient
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .billing import accrue_storage_charges
+from . import search
+from .cache import invalidate_all
+from .custom_admin import InvoiceCarInlineForm
+from .middleware import ReplicaMiddleware
+from .models import Car, Client, Container, Invoice, Payment, Warehouse, WarehouseRate
+from .reports import rollup_revenue
+from .routers import REPLICA
+from .services import recalculate_invoice_amounts, transition_containers
+from .tasks import send_payment_reminder
+
+SCENARIOS = {}
+
+
+def scenario(func):
+    SCENARIOS[func.__name__] = func
+    return func
+
+
+class Rollback(Exception):
+    pass
+
+
+def run(name, **options):
+    # Каждый сценарий откатывает свои изменения, чтобы прогоны не влияли друг на друга
+    result = {'scenario': name}
+    try:
+        with transaction.atomic():
+            SCENARIOS[name](result, **options)
+            raise Rollback
+    except Rollback:
+        pass
+    # В кэше могли остаться значения из откаченной транзакции
+    invalidate_all()
+    return result
+
+
+@contextmanager
+def measure(result):
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        yield
+        result['seconds'] = round(time.perf_counter() - started, 4)
+    result['queries'] = len(queries)
+
+
+def money(rng, low, high):
+    return Decimal(rng.randint(low * 100, high * 100)) / 100
+
+
+def generate(clients=1000, warehouses=5, containers=200, cars_per_container=20, invoices=1000, payments=2000,
+             seed=0, **options):
+    # Синтетические данные: всё через bulk_create, значения детерминированы seed
+    rng = random.Random(seed)
+    today = timezone.now().date()
+    batch = 2000
+
+    warehouse_objs = Warehouse.objects.bulk_create([
+        Warehouse(name=f'Склад {i}', location='-', capacity=containers * cars_per_container, free_days=5)
+        for i in range(warehouses)
+    ])
+    WarehouseRate.objects.bulk_create([
+        WarehouseRate(warehouse=w, from_day=from_day, daily_rate=rate)
+        for w in warehouse_objs for from_day, rate in ((1, Decimal('5')), (31, Decimal('10')))
+    ])
+    client_ids = [c.pk for c in Client.objects.bulk_create([
+        Client(name=f'Клиент {i}', email=f'client{i}@example.com', phone='-', address='-') for i in range(clients)
+    ], batch_size=batch)]
+
+    container_objs = Container.objects.bulk_create([
+        Container(
+            number=f'BENCH{i:07d}',
+            arrival_date=today - timedelta(days=rng.randint(0, 365)),
+            warehouse=rng.choice(warehouse_objs),
+            status=rng.choice(['sailing', 'arrived', 'unloaded', 'stored']),
+            ths=money(rng, 500, 3000),
+        )
+        for i in range(containers)
+    ], batch_size=batch)
+
+    cars = []
+    for container in container_objs:
+        for _ in range(cars_per_container):
+            cars.append(Car(
+                vin=f'BV{len(cars):015d}',
+                make=rng.choice(['Toyota', 'Honda', 'BMW', 'Ford', 'Audi']),
+                client_id=rng.choice(client_ids),
+                container=container,
+                warehouse_id=container.warehouse_id,
+                storage_status=rng.choice(['in_port', 'in_warehouse', 'in_warehouse', 'delivered', 'sailing']),
+                date_stored=today - timedelta(days=rng.randint(0, 180)),
+                procedure=rng.choice(['transit', 'reexport', 'import', 'export']),
+                ths=money(rng, 50, 300),
+                sklad=money(rng, 0, 200),
+                days_cost=money(rng, 0, 300),
+                prof=money(rng, 0, 150),
+            ))
+    Car.objects.bulk_create(cars, batch_size=batch)
+    search.index_cars(Car.objects.all())
+
+    cars_by_client = defaultdict(list)
+    for car_id, client_id in Car.objects.values_list('pk', 'client_id'):
+        cars_by_client[client_id].append(car_id)
+    owners = list(cars_by_client)
+    invoice_objs = Invoice.objects.bulk_create([
+        Invoice(
+            client_id=rng.choice(owners),
+            issue_date=today - timedelta(days=rng.randint(0, 90)),
+            due_date=today + timedelta(days=rng.randint(-60, 30)),
+            status=rng.choice(['unpaid', 'unpaid', 'paid', 'overdue']),
+        )
+        for _ in range(invoices)
+    ], batch_size=batch)
+    Invoice.cars.through.objects.bulk_create([
+        Invoice.cars.through(invoice_id=invoice.pk, car_id=car_id)
+        for invoice in invoice_objs
+        for car_id in rng.sample(cars_by_client[invoice.client_id], min(5, len(cars_by_client[invoice.client_id])))
+    ], batch_size=batch, ignore_conflicts=True)
+    recalculate_invoice_amounts(include_paid=True)
+
+    car_ids = [car.pk for car in cars]
+    payment_objs = []
+    for _ in range(payments):
+        amount_due = money(rng, 100, 2000)
+        amount_paid = rng.choice([Decimal('0'), amount_due / 2, amount_due])
+        payment_objs.append(Payment(
+            car_id=rng.choice(car_ids),
+            amount_due=amount_due,
+            amount_paid=amount_paid,
+            is_partial=amount_paid < amount_due,
+            status='paid' if amount_paid == amount_due else rng.choice(['pending', 'overdue']),
+            payment_type=rng.choice(['cash', 'transfer', 'mutual_settlement']),
+        ))
+    Payment.objects.bulk_create(payment_objs, batch_size=batch)
+
+    return {
+        'clients': clients, 'warehouses': warehouses, 'containers': containers, 'cars': len(cars),
+        'invoices': invoices, 'payments': payments, 'seed': seed,
+    }
+
+
+def admin_client():
+    http = HttpClient()
+    http.force_login(User.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark'))
+    return http
+
+
+def largest_container():
+    return Container.objects.annotate(n=Count('cars')).order_by('-n').first()
+
+
+def largest_invoice():
+    return Invoice.objects.annotate(n=Count('cars')).order_by('-n').first()
+
+
+@scenario
+def container_save(result, **options):
+    container = largest_container()
+    container.status = 'arrived'
+    with measure(result):
+        container.save()
+    result['cars'] = container.cars.count()
+
+
+@scenario
+def container_transition(result, **options):
+    containers = Container.objects.exclude(ths__isnull=True)
+    result['containers'] = containers.count()
+    with measure(result):
+        transition_containers(containers, 'arrived')
+
+
+@scenario
+def invoice_update_amount(result, **options):
+    invoice = largest_invoice()
+    with measure(result):
+        invoice.update_amount()
+    result['cars'] = invoice.cars.count()
+
+
+@scenario
+def invoice_car_inline_form_save(result, **options):
+    link = Invoice.cars.through.objects.select_related('car', 'invoice').first()
+    form = InvoiceCarInlineForm(
+        data={'car': link.car_id, 'ths': '100.00', 'sklad_combined': '250.00', 'days_cost': '30.00'},
+        instance=link,
+    )
+    form.is_valid()
+    with measure(result):
+        form.save()
+
+
+@scenario
+def car_changelist(result, **options):
+    http = admin_client()
+    with measure(result):
+        response = http.get('/admin/logistics/car/')
+    result['status_code'] = response.status_code
+
+
+@scenario
+def invoice_changelist(result, **options):
+    http = admin_client()
+    with measure(result):
+        response = http.get('/admin/logistics/invoice/')
+    result['status_code'] = response.status_code
+
+
+@scenario
+def invoice_change_page(result, **options):
+    # Размер страницы не должен зависеть от числа машин на складе
+    http = admin_client()
+    invoice = largest_invoice()
+    with measure(result):
+        response = http.get(f'/admin/logistics/invoice/{invoice.pk}/change/')
+    result['status_code'] = response.status_code
+    result['bytes'] = len(response.content)
+
+
+@scenario
+def invoice_car_autocomplete(result, **options):
+    http = admin_client()
+    invoice = largest_invoice()
+    with measure(result):
+        response = http.get('/admin/logistics/invoice/cars/autocomplete/', {'invoice': invoice.pk, 'term': 'BV0'})
+    result['status_code'] = response.status_code
+    result['bytes'] = len(response.content)
+
+
+def car_search(result, backend):
+    # Самый частый поиск — последние 6–8 символов VIN
+    term = Car.objects.order_by('-pk').values_list('vin', flat=True).first()[-7:]
+    with measure(result):
+        result['found'] = len(search.search_cars(Car.objects.all(), term, backend=backend).values_list('pk'))
+    result['backend'] = backend
+
+
+@scenario
+def car_search_icontains(result, **options):
+    car_search(result, 'icontains')
+
+
+@scenario
+def car_search_suffix(result, **options):
+    car_search(result, 'suffix')
+
+
+@scenario
+def car_changelist_search(result, **options):
+    http = admin_client()
+    term = Car.objects.order_by('-pk').values_list('vin', flat=True).first()[-7:]
+    with measure(result):
+        response = http.get('/admin/logistics/car/', {'q': term})
+    result['status_code'] = response.status_code
+
+
+@scenario
+def storage_billing(result, **options):
+    with measure(result):
+        result['updated'] = accrue_storage_charges()
+
+
+@scenario
+def reminders(result, debtors=10000, **options):
+    # Сценарий меряется на своих 10k должниках поверх общего набора, как при его появлении:
+    # у каждого по одному просроченному счёту; всё откатывается вместе со сценарием
+    today = timezone.now().date()
+    clients = Client.objects.bulk_create([
+        Client(name=f'Debtor {i}', email=f'debtor{i}@example.com', phone='-', address='-') for i in range(debtors)
+    ], batch_size=1000)
+    Invoice.objects.bulk_create([
+        Invoice(client=client, due_date=today - timedelta(days=1), amount=Decimal('100.00')) for client in clients
+    ], batch_size=1000)
+    result['debtors'] = debtors
+    mail.outbox = []
+    always_eager = current_app.conf.task_always_eager
+    current_app.conf.task_always_eager = True
+    try:
+        with measure(result):
+            send_payment_reminder()
+    finally:
+        current_app.conf.task_always_eager = always_eager
+    result['emails'] = len(mail.outbox)
+
+
+def compare(results, baseline, tolerance):
+    # Регрессия: запросов стало больше или время выросло сильнее допуска
+    previous = {item['scenario']: item for item in baseline}
+    regressions = []
+    for item in results:
+        before = previous.get(item['scenario'])
+        if not before:
+            continue
+        if item['queries'] > before['queries']:
+            regressions.append(f"{item['scenario']}: запросов {before['queries']} -> {item['queries']}")
+        if item['seconds'] > before['seconds'] * (1 + tolerance):
+            regressions.append(f"{item['scenario']}: время {before['seconds']} -> {item['seconds']} с")
+    return regressions
+
+
+# Нагрузочный прогон: одни и те же ответы через синхронные view (потоки, как gthread-воркер gunicorn)
+# и через асинхронные (задачи в одном цикле событий, как воркер uvicorn), с заданной параллельностью
+LOAD_TARGETS = {
+    'dashboard': ('api_dashboard', 'api_sync_dashboard'),
+    'container': ('api_container_detail', 'api_sync_container_detail'),
+    'car': ('api_car_detail', 'api_sync_car_detail'),
+}
+
+
+def load_urls(mode, requests, seed=0):
+    rng = random.Random(seed)
+    numbers = list(Container.objects.values_list('number', flat=True))
+    vins = list(Car.objects.values_list('vin', flat=True))
+    args = {'dashboard': lambda: [], 'container': lambda: [rng.choice(numbers)], 'car': lambda: [rng.choice(vins)]}
+    urls = []
+    for _ in range(requests):
+        for target, names in LOAD_TARGETS.items():
+            urls.append((target, reverse(names[mode == 'sync'], args=args[target]())))
+    return urls
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def load_report(timings, seconds):
+    report = {'requests': len(timings), 'rps': round(len(timings) / seconds, 1), 'targets': {}}
+    by_target = defaultdict(list)
+    for target, elapsed, status_code in timings:
+        by_target[target].append((elapsed, status_code))
+    for target, rows in sorted(by_target.items()):
+        elapsed = [value for value, _ in rows]
+        report['targets'][target] = {
+            'requests': len(rows),
+            'errors': sum(status_code != 200 for _, status_code in rows),
+            'p50_ms': round(percentile(elapsed, 0.5) * 1000, 2),
+            'p99_ms': round(percentile(elapsed, 0.99) * 1000, 2),
+        }
+    return report
+
+
+def load_sync(urls, concurrency, cookies):
+    def worker(chunk):
+        http = HttpClient()
+        http.cookies = copy.deepcopy(cookies)
+        timings = []
+        try:
+            for target, url in chunk:
+                started = time.perf_counter()
+                response = http.get(url)
+                timings.append((target, time.perf_counter() - started, response.status_code))
+        finally:
+            connections.close_all()
+        return timings
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        timings = [row for rows in pool.map(worker, [urls[i::concurrency] for i in range(concurrency)]) for row in rows]
+    return load_report(timings, time.perf_counter() - started)
+
+
+async def load_async(urls, concurrency, cookies):
+    pending = iter(urls)
+    timings = []
+
+    async def worker():
+        http = AsyncHttpClient()
+        http.cookies = copy.deepcopy(cookies)
+        for target, url in pending:
+            started = time.perf_counter()
+            response = await http.get(url)
+            timings.append((target, time.perf_counter() - started, response.status_code))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return load_report(timings, time.perf_counter() - started)
+
+
+def load_test(concurrency=20, requests=100, seed=0, **options):
+    # Данные должны быть закоммичены: запросы идут из разных потоков со своими соединениями
+    http = admin_client()
+    cookies = http.cookies
+    # Прогрев: соединения, пул потоков, шаблоны URL
+    load_sync(load_urls('sync', concurrency, seed), concurrency, cookies)
+    asyncio.run(load_async(load_urls('async', concurrency, seed), concurrency, cookies))
+    return {
+        'concurrency': concurrency,
+        'sync': load_sync(load_urls('sync', requests, seed), concurrency, cookies),
+        'async': asyncio.run(load_async(load_urls('async', requests, seed), concurrency, cookies)),
+    }
+
+
+# Нагрузка на основную базу с репликой и без: одинаковая смесь чтений (списки админки, API, выгрузка, отчёт)
+# с редкими записями; синхронный дашборд — из logistics/loadtest_urls.py. Без реплики — все запросы с cookie
+# закрепления, то есть на основную базу.
+REPLICA_READS = (
+    '/admin/logistics/car/',
+    '/admin/logistics/invoice/',
+    '/admin/logistics/container/',
+    '/api/cars/',
+    '/api/invoices/',
+    '/api/sync/dashboard/',
+    '/admin/logistics/car/export/csv/',
+    '/admin/reports/revenue/',
+)
+
+
+def replica_requests(rounds, write_every, seed=0):
+    rng = random.Random(seed)
+    containers = list(Container.objects.values_list('pk', 'number', 'arrival_date', 'status', 'ths', 'ths_strategy'))
+    requests = []
+    for i in range(rounds):
+        requests += [('get', url, None) for url in REPLICA_READS]
+        if write_every and i % write_every == 0:
+            pk, number, arrival_date, status, ths, strategy = rng.choice(containers)
+            requests.append(('post', f'/admin/logistics/container/{pk}/change/', {
+                'number': number, 'arrival_date': arrival_date + timedelta(days=rng.randint(0, 3)), 'status': status,
+                'ths': ths if ths is not None else '', 'ths_strategy': strategy, 'cars-TOTAL_FORMS': '0',
+                'cars-INITIAL_FORMS': '0', 'cars-MIN_NUM_FORMS': '0', 'cars-MAX_NUM_FORMS': '1000',
+            }))
+    return requests
+
+
+class AliasTimer:
+    # Запросы и время в базе по одному соединению; CaptureQueriesContext округляет время до миллисекунд
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - started
+
+
+def replica_pass(http, requests, pinned):
+    timers = {alias: AliasTimer() for alias in ('default', REPLICA)}
+    started = time.perf_counter()
+    with connections['default'].execute_wrapper(timers['default']), \
+            connections[REPLICA].execute_wrapper(timers[REPLICA]):
+        previous = None
+        for method, url, data in requests:
+            if pinned:
+                http.cookies[ReplicaMiddleware.cookie_name] = '1'
+            elif previous != 'post':
+                # Прогон сжат по времени: закрепление после записи действует только на следующий запрос,
+                # а не на все запросы в пределах LOGISTICS_REPLICA_PIN_SECONDS
+                http.cookies.pop(ReplicaMiddleware.cookie_name, None)
+            response = getattr(http, method)(url, data or {})
+            previous = method
+            if response.streaming:
+                b''.join(response.streaming_content)
+    return {
+        'seconds': round(time.perf_counter() - started, 2),
+        **{alias: {'queries': timer.queries, 'seconds': round(timer.seconds, 4)} for alias, timer in timers.items()},
+    }
+
+
+def replica_benchmark(http, rounds=20, write_every=5, seed=0, **options):
+    requests = replica_requests(rounds, write_every, seed)
+    primary_only = replica_pass(http, requests, pinned=True)
+    http.cookies.pop(ReplicaMiddleware.cookie_name, None)
+    routed = replica_pass(http, requests, pinned=False)
+    return {
+        'requests': len(requests),
+        'primary_only': primary_only,
+        'with_replica': routed,
+        'primary_queries_saved': round(1 - routed['default']['queries'] / primary_only['default']['queries'], 3),
+        'primary_db_seconds_saved': round(1 - routed['default']['seconds'] / primary_only['default']['seconds'], 3),
+    }
+
+
+def prepare_replica_benchmark():
+    # Всё, что пишет при первом показе (пользователь, сессия, тема админки, свёртки отчёта), — до снимка реплики.
+    # Прогрев закреплён за основной базой: реплики ещё нет
+    http = admin_client()
+    rollup_revenue()
+    http.cookies[ReplicaMiddleware.cookie_name] = '1'
+    http.get('/admin/')
+    http.cookies.pop(ReplicaMiddleware.cookie_name)
+    return http
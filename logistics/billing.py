@@ -0,0 +1,61 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, Value, When
+from django.utils import timezone
+
+from .allocation import CENT
+from .models import Car, Invoice, Warehouse, WarehouseRate
+from .services import recalculate_invoice_amounts
+
+
+def storage_charge(days, free_days, tiers):
+    # tiers — отсортированные пары (с какого дня, ставка); бесплатные дни не тарифицируются
+    charge = Decimal('0')
+    for i, (start, rate) in enumerate(tiers):
+        end = tiers[i + 1][0] - 1 if i + 1 < len(tiers) else days
+        start = max(start, free_days + 1)
+        end = min(end, days)
+        if end >= start:
+            charge += rate * (end - start + 1)
+    return charge.quantize(CENT)
+
+
+@transaction.atomic
+def accrue_storage_charges(today=None, chunk_size=500):
+    # Плата зависит только от склада и даты постановки, поэтому считаем её один раз на пару
+    # (склад, date_stored) и записываем одним UPDATE ... CASE на группу дат, а не по машинам.
+    today = today or timezone.now().date()
+    tiers = defaultdict(list)
+    for warehouse_id, from_day, rate in WarehouseRate.objects.order_by('warehouse_id', 'from_day').values_list(
+        'warehouse_id', 'from_day', 'daily_rate'
+    ):
+        tiers[warehouse_id].append((from_day, rate))
+    if not tiers:
+        return 0
+    free_days = dict(Warehouse.objects.filter(pk__in=tiers).values_list('id', 'free_days'))
+
+    cars = Car.objects.filter(storage_status='in_warehouse', warehouse_id__in=tiers, date_stored__isnull=False)
+    charges = defaultdict(dict)
+    for warehouse_id, date_stored in cars.order_by().values_list('warehouse_id', 'date_stored').distinct():
+        days = max((today - date_stored).days, 0)
+        charges[warehouse_id][date_stored] = storage_charge(days, free_days[warehouse_id], tiers[warehouse_id])
+
+    updated = 0
+    for warehouse_id, by_date in charges.items():
+        dates = list(by_date)
+        for i in range(0, len(dates), chunk_size):
+            chunk = dates[i:i + chunk_size]
+            days_cost = Case(
+                *[When(date_stored=d, then=Value(by_date[d])) for d in chunk],
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            )
+            # Машины с уже начисленной суммой не трогаем — повторный запуск ничего не пишет
+            updated += cars.filter(warehouse_id=warehouse_id, date_stored__in=chunk).exclude(
+                days_cost=days_cost
+            ).update(days_cost=days_cost)
+
+    if updated:
+        recalculate_invoice_amounts(Invoice.objects.filter(cars__in=cars))
+    return updated
@@ -0,0 +1,160 @@
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Car, Client, Invoice, Payment
+from .services import annotate_balances
+
+# Значения лежат под ключами, в которые входят номера версий: общий корень, версия пространства
+# и версия конкретного объекта (клиента, контейнера). Инвалидация — это увеличение версии,
+# старые ключи становятся недостижимыми и сами истекают по таймауту, ничего не удаляется.
+PREFIX = 'logistics'
+ROOT = 'root'
+
+CONTAINER_CAR_FIELDS = ('id', 'vin', 'make', 'client__name', 'storage_status', 'date_stored', 'total')
+
+# Какие поля при массовом update() делают пространство устаревшим целиком
+BULK_DEPENDENCIES = {
+    'car_status_counts': {Car: {'storage_status'}},
+    'container_cars': {
+        Car: {'container', 'container_id', 'vin', 'make', 'client', 'client_id', 'storage_status', 'date_stored',
+              *Car.COST_FIELDS},
+        Client: {'name'},
+    },
+    'client_balance': {
+        Car: {'client', 'client_id'},
+        Invoice: {'client', 'client_id', 'amount', 'status', 'due_date'},
+        Payment: {'car', 'car_id', 'amount_due', 'amount_paid', 'status'},
+    },
+}
+
+# Счётчики попаданий и промахов в пределах процесса
+stats = Counter()
+
+
+def timeout():
+    return getattr(settings, 'LOGISTICS_CACHE_TIMEOUT', 3600)
+
+
+def version_key(namespace, entity=None):
+    return f'{PREFIX}:v:{namespace}' if entity is None else f'{PREFIX}:v:{namespace}:{entity}'
+
+
+def versions(keys):
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        # Начальная версия — время, а не 1: если ключ версии вытеснили, старые данные не оживут
+        for key in missing:
+            cache.add(key, time.time_ns(), None)
+        found.update(cache.get_many(missing))
+    return found
+
+
+def bump(namespace, entity=None):
+    key = version_key(namespace, entity)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def invalidate(namespace, entities=None):
+    # Без entities устаревает всё пространство. Версия растёт сразу (для чтений внутри той же транзакции)
+    # и ещё раз после коммита, чтобы значение, прочитанное до коммита, не осталось актуальным.
+    if entities is not None:
+        entities = {entity for entity in entities if entity is not None}
+        if not entities:
+            return
+
+    def run():
+        for entity in entities or [None]:
+            bump(namespace, entity)
+    run()
+    transaction.on_commit(run)
+
+
+def invalidate_all():
+    invalidate(ROOT)
+
+
+def invalidate_fields(model, fields):
+    for namespace, dependencies in BULK_DEPENDENCIES.items():
+        if fields & dependencies.get(model, set()):
+            invalidate(namespace)
+
+
+def cached_many(namespace, entities, compute, variant=''):
+    # compute(список промахов) -> {entity: значение}; все попадания читаются двумя обращениями к кэшу
+    entities = list(entities)
+    keys = [version_key(ROOT), version_key(namespace)] + [version_key(namespace, entity) for entity in entities]
+    found = versions(keys)
+    base = f"{PREFIX}:{namespace}:{found[keys[0]]}.{found[keys[1]]}"
+    data_keys = {
+        entity: f"{base}.{found[version_key(namespace, entity)]}:{entity}:{variant}" for entity in entities
+    }
+    values = cache.get_many(data_keys.values())
+    result = {entity: values[key] for entity, key in data_keys.items() if key in values}
+    missing = [entity for entity in entities if entity not in result]
+    stats[f'{namespace}.hits'] += len(result)
+    stats[f'{namespace}.misses'] += len(missing)
+    if missing:
+        fresh = compute(missing)
+        cache.set_many({data_keys[entity]: fresh[entity] for entity in missing}, timeout())
+        result.update(fresh)
+    return result
+
+
+def cached(namespace, compute, variant=''):
+    # Значение без привязки к объекту: версия только у пространства
+    return cached_many(namespace, ['all'], lambda missing: {'all': compute()}, variant)['all']
+
+
+def cache_stats():
+    namespaces = sorted({key.rsplit('.', 1)[0] for key in stats})
+    result = {}
+    for namespace in namespaces:
+        hits, misses = stats[f'{namespace}.hits'], stats[f'{namespace}.misses']
+        result[namespace] = {'hits': hits, 'misses': misses, 'hit_rate': round(hits / (hits + misses), 3)}
+    return result
+
+
+def car_status_counts():
+    def compute():
+        counts = dict.fromkeys((status for status, _ in Car.STATUS_CHOICES), 0)
+        counts.update(Car.objects.order_by().values_list('storage_status').annotate(n=Count('pk')))
+        return counts
+    return cached('car_status_counts', compute)
+
+
+def client_balances(client_ids, today=None):
+    # Долг зависит от даты (просрочка по due_date), поэтому дата входит в ключ
+    today = today or timezone.now().date()
+
+    def compute(missing):
+        rows = annotate_balances(Client.objects.filter(pk__in=missing), today).values_list(
+            'pk', 'invoices_due', 'payments_due'
+        )
+        balances = {pk: {'invoices_due': invoices_due, 'payments_due': payments_due}
+                    for pk, invoices_due, payments_due in rows}
+        return {pk: balances.get(pk) for pk in missing}
+    return cached_many('client_balance', client_ids, compute, variant=today.isoformat())
+
+
+def client_balance(client_id, today=None):
+    return client_balances([client_id], today)[client_id]
+
+
+def container_cars(container_id):
+    def compute(missing):
+        cars = {container_id: [] for container_id in missing}
+        rows = Car.objects.filter(container_id__in=missing).order_by('vin').values('container_id', *CONTAINER_CAR_FIELDS)
+        for row in rows:
+            cars[row.pop('container_id')].append(row)
+        return cars
+    return cached_many('container_cars', [container_id], compute)[container_id]
@@ -1,13 +1,77 @@
-from django.contrib import admin
+from datetime import timedelta
+
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import transaction
+from django.db.models import Case, DateField, IntegerField, Value, When
+from django.http import Http404, JsonResponse
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from django.utils import timezone
 from django import forms
-from .models import Car, Payment, Warehouse, Container, Client, Invoice
+from .models import Car, Payment, Warehouse, WarehouseRate, Container, Client, Invoice
+from .allocation import allocate
+from .cache import car_status_counts, client_balances
+from .search import search_cars, search_payments
+from .expressions import DaysBetween
+from .exports import EXPORT_FORMATS, export_cars_response
+from .pdf import render_invoices, stream_zip, streaming_response
+from .reports import AMOUNT_FIELDS, DIMENSIONS, default_period, revenue_report
+from .services import mark_invoices_paid, recalculate_invoice_amounts, split_container_ths, transition_containers
 
 
 class LogisticsAdminSite(admin.AdminSite):
     site_header = "Логистическая система"
     site_title = "Админка логистики"
     index_title = "Управление модулями"
+    index_template = 'admin/logistics_index.html'
+
+    def index(self, request, extra_context=None):
+        # Занятость берётся из счётчиков складов, число машин по статусам — из кэша
+        counts = car_status_counts()
+        extra_context = {
+            **(extra_context or {}),
+            'warehouses': Warehouse.objects.order_by('name'),
+            'car_status_counts': [(label, counts[status]) for status, label in Car.STATUS_CHOICES],
+        }
+        return super().index(request, extra_context)
+
+    def get_urls(self):
+        urls = [
+            path('reports/revenue/', self.admin_view(self.revenue_report_view), name='logistics_revenue_report'),
+        ]
+        return urls + super().get_urls()
+
+    def revenue_report_view(self, request):
+        # Только таблица RevenueRollup (заполняется задачей rollup_revenue), машины не читаются
+        if not request.user.has_perm('logistics.view_car'):
+            raise PermissionDenied
+        start, end = default_period()
+        form = RevenueReportForm(request.GET or {'start': start, 'end': end, 'group_by': ['month', 'warehouse_id']},
+                                 admin_site=self)
+        rows = []
+        columns = []
+        if form.is_valid():
+            data = form.cleaned_data
+            columns = [DIMENSIONS[dimension] for dimension in DIMENSIONS if dimension in data['group_by']]
+            rows = revenue_report(
+                data['start'], data['end'], data['group_by'],
+                warehouse_id=data['warehouse'].pk if data['warehouse'] else None,
+                procedure=data['procedure'] or None,
+                client_id=data['client'].pk if data['client'] else None,
+            )
+        totals = {field: sum(row[field] for row in rows) for field in ('cars', *AMOUNT_FIELDS)}
+        context = {
+            **self.each_context(request),
+            'title': "Расходы по машинам",
+            'form': form,
+            'columns': columns,
+            'rows': rows,
+            'totals': totals,
+        }
+        return TemplateResponse(request, 'admin/revenue_report.html', context)
 
     def get_app_list(self, request):
         app_list = super().get_app_list(request)
@@ -21,13 +85,35 @@ class LogisticsAdminSite(admin.AdminSite):
         return app_list
 
 
+class RevenueReportForm(forms.Form):
+    start = forms.DateField(label="С месяца")
+    end = forms.DateField(label="По месяц")
+    group_by = forms.MultipleChoiceField(label="Группировать по", choices=DIMENSIONS.items(), required=False,
+                                         widget=forms.CheckboxSelectMultiple)
+    warehouse = forms.ModelChoiceField(label="Склад", queryset=Warehouse.objects.order_by('name'), required=False)
+    procedure = forms.ChoiceField(label="Процедура", choices=[('', "Все"), *Car.PROCEDURE_CHOICES], required=False)
+    client = forms.ModelChoiceField(label="Клиент", queryset=Client.objects.all(), required=False)
+
+    def __init__(self, *args, admin_site, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Клиентов много: поиск через автодополнение админки, как у поля клиента машины
+        client = self.fields['client']
+        client.widget = AutocompleteSelect(Car._meta.get_field('client'), admin_site, choices=client.choices)
+
+    def clean(self):
+        data = super().clean()
+        if data.get('start') and data.get('end') and data['start'] > data['end']:
+            raise ValidationError("Начало периода позже конца")
+        return data
+
+
 admin_site = LogisticsAdminSite(name='logistics_admin')
 
 
 class CarInline(admin.TabularInline):
     model = Car
     extra = 0
-    fields = ('vin', 'make', 'storage_status', 'client')
+    fields = ('vin', 'make', 'storage_status', 'client', 'size_class', 'ths_fixed')
 
 
 class InvoiceCarInlineForm(forms.ModelForm):
@@ -61,6 +147,25 @@ class InvoiceCarInlineForm(forms.ModelForm):
         return instance
 
 
+class InvoiceCarSelect(AutocompleteSelect):
+    # Вместо <select> со всеми машинами склада — поиск по VIN с подгрузкой страниц из InvoiceAdmin.car_autocomplete
+    def __init__(self, field, admin_site, invoice_id=None, **kwargs):
+        super().__init__(field, admin_site, **kwargs)
+        self.invoice_id = invoice_id
+
+    def get_url(self):
+        url = reverse(f'{self.admin_site.name}:logistics_invoice_car_autocomplete')
+        return f'{url}?invoice={self.invoice_id}' if self.invoice_id else url
+
+
+def invoice_cars(invoice_id=None):
+    # Клиент счёта берётся подзапросом, сам счёт отдельно не читается
+    cars = Car.objects.filter(storage_status='in_warehouse')
+    if invoice_id:
+        cars = cars.filter(client_id__in=Invoice.objects.filter(pk=invoice_id).values('client_id'))
+    return cars
+
+
 class InvoiceCarInline(admin.TabularInline):
     model = Invoice.cars.through
     form = InvoiceCarInlineForm
@@ -69,25 +174,56 @@ class InvoiceCarInline(admin.TabularInline):
     verbose_name_plural = "Автомобили"
     fields = ('car', 'ths', 'sklad_combined', 'days_cost')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('car')
+
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == 'car':
             invoice_id = request.resolver_match.kwargs.get('object_id')
-            if invoice_id:
-                invoice = Invoice.objects.get(id=invoice_id)
-                if invoice.client:
-                    kwargs['queryset'] = Car.objects.filter(
-                        client=invoice.client,
-                        storage_status='in_warehouse'
-                    )
-            else:
-                kwargs['queryset'] = Car.objects.filter(storage_status='in_warehouse')
+            kwargs['queryset'] = invoice_cars(invoice_id)
+            kwargs['widget'] = InvoiceCarSelect(db_field, self.admin_site, invoice_id=invoice_id)
+            field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+            # Подпись как в автодополнении; str(car) потянул бы клиента отдельным запросом
+            field.label_from_instance = lambda car: f"{car.vin} — {car.make}"
+            return field
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
+class DaysOnWarehouseFilter(admin.SimpleListFilter):
+    title = "Дней на складе"
+    parameter_name = 'days'
+    RANGES = {
+        '0-7': (0, 7),
+        '8-30': (8, 30),
+        '31-90': (31, 90),
+        '91-': (91, None),
+    }
+
+    def lookups(self, request, model_admin):
+        return [
+            ('0-7', "До недели"),
+            ('8-30', "8–30 дней"),
+            ('31-90', "31–90 дней"),
+            ('91-', "Больше 90 дней"),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.RANGES:
+            return queryset
+        # Фильтруем по date_stored, а не по вычисленному числу дней, чтобы условие шло по индексу
+        low, high = self.RANGES[self.value()]
+        today = timezone.now().date()
+        queryset = queryset.filter(storage_status='in_warehouse', date_stored__lte=today - timedelta(days=low))
+        if high is not None:
+            queryset = queryset.filter(date_stored__gte=today - timedelta(days=high))
+        return queryset
+
+
 class CarAdmin(admin.ModelAdmin):
     list_display = ('vin', 'make', 'days_on_warehouse_display', 'client', 'storage_status', 'title', 'container',
-                    'container_arrival_date')
-    list_filter = ('storage_status', 'container')
+                    'container_arrival_date', 'total')
+    list_filter = ('storage_status', DaysOnWarehouseFilter, 'container')
+    list_select_related = ('client', 'container')
     search_fields = ('vin', 'make', 'client__name')
 
     fieldsets = (
@@ -99,27 +235,102 @@ class CarAdmin(admin.ModelAdmin):
         }),
     )
     readonly_fields = ('total',)
+    actions = ['export_csv', 'export_xlsx']
+
+    def get_search_results(self, request, queryset, search_term):
+        # search_fields остаются для поля поиска, а сам поиск идёт через индексный бэкенд (logistics/search.py)
+        return search_cars(queryset, search_term), False
+
+    def get_urls(self):
+        urls = [
+            path('export/<str:fmt>/', self.admin_site.admin_view(self.export_view), name='logistics_car_export'),
+        ]
+        return urls + super().get_urls()
+
+    def export_view(self, request, fmt):
+        # Выгрузка всех машин (или с фильтром ?storage_status=) потоком, без пагинации по админке
+        if fmt not in EXPORT_FORMATS or not self.has_view_permission(request):
+            raise Http404
+        queryset = Car.objects.all()
+        if request.GET.get('storage_status'):
+            queryset = queryset.filter(storage_status=request.GET['storage_status'])
+        return export_cars_response(request, queryset, fmt)
+
+    def export_csv(self, request, queryset):
+        return export_cars_response(request, queryset, 'csv')
+
+    export_csv.short_description = "Выгрузить выбранные машины в CSV"
+
+    def export_xlsx(self, request, queryset):
+        return export_cars_response(request, queryset, 'xlsx')
+
+    export_xlsx.short_description = "Выгрузить выбранные машины в XLSX"
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            days_on_warehouse=Case(
+                When(
+                    storage_status='in_warehouse',
+                    date_stored__isnull=False,
+                    then=DaysBetween(Value(timezone.now().date(), output_field=DateField()), 'date_stored'),
+                ),
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
 
     def days_on_warehouse_display(self, obj):
-        if obj.storage_status == 'in_warehouse' and obj.date_stored:
-            return (timezone.now().date() - obj.date_stored).days
-        return 0
+        return obj.days_on_warehouse
 
     days_on_warehouse_display.short_description = "DAYS"
+    days_on_warehouse_display.admin_order_field = 'days_on_warehouse'
 
     def container_arrival_date(self, obj):
         return obj.container.arrival_date if obj.container else None
 
     container_arrival_date.short_description = 'ETA'
+    container_arrival_date.admin_order_field = 'container__arrival_date'
 
     def get_readonly_fields(self, request, obj=None):
         return self.readonly_fields
 
 
+class WarehouseRateInline(admin.TabularInline):
+    model = WarehouseRate
+    extra = 0
+    fields = ('from_day', 'daily_rate')
+
+
+class WarehouseAdmin(admin.ModelAdmin):
+    list_display = ('name', 'location', 'capacity', 'occupied', 'free_places', 'free_days')
+    readonly_fields = ('occupied',)
+    inlines = [WarehouseRateInline]
+
+    def free_places(self, obj):
+        return obj.free_places
+
+    free_places.short_description = "Свободно мест"
+
+
+def container_status_action(status, label):
+    def action(modeladmin, request, queryset):
+        try:
+            updated = transition_containers(queryset, status)
+        except ValidationError as e:
+            modeladmin.message_user(request, '; '.join(e.messages), level=messages.ERROR)
+            return
+        modeladmin.message_user(request, f"Обновлено контейнеров: {updated}")
+
+    action.__name__ = f'mark_as_{status}'
+    action.short_description = f"Перевести в статус «{label}»"
+    return action
+
+
 class ContainerAdmin(admin.ModelAdmin):
     list_display = ('number', 'arrival_date', 'status', 'warehouse')
     list_filter = ('status', 'warehouse')
     inlines = [CarInline]
+    actions = [container_status_action(status, label) for status, label in Container.STATUS_CHOICES] + ['preview_ths']
 
     fieldsets = (
         (None, {
@@ -129,13 +340,59 @@ class ContainerAdmin(admin.ModelAdmin):
                 'warehouse',
                 'status',
                 'ths',
+                'ths_strategy',
             )
         }),
     )
 
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        obj.save()
+    def preview_ths(self, request, queryset):
+        # Сначала страница с раскладкой без записи в базу, запись — только по кнопке на ней.
+        # Как и при смене статуса, THS раскладывается только по прибывшим контейнерам
+        skipped = list(queryset.exclude(status='arrived').order_by('number').values_list('number', flat=True))
+        if skipped:
+            self.message_user(request, f"THS раскладывается только по прибывшим контейнерам, пропущены: "
+                                       f"{', '.join(skipped)}", level=messages.WARNING)
+        containers = list(
+            queryset.filter(ths__isnull=False, status='arrived').only('id', 'number', 'ths', 'ths_strategy')
+        )
+        if request.POST.get('apply'):
+            with transaction.atomic():
+                updated = split_container_ths(containers)
+            self.message_user(request, f"THS разложен, изменено машин: {updated}")
+            return None
+        allocations = allocate(containers)
+        strategies = dict(Container.THS_STRATEGY_CHOICES)
+        preview = [
+            {
+                'container': container,
+                'strategy': strategies[container.ths_strategy],
+                'cars': [
+                    {'vin': car['vin'], 'ths': car['ths'], 'new_ths': amount, 'fixed': car['ths_fixed'],
+                     'size_class': car['size_class'], 'changed': car['ths'] != amount}
+                    for car, amount in allocations.get(container.pk, [])
+                ],
+            }
+            for container in containers
+        ]
+        context = {
+            **self.admin_site.each_context(request),
+            'title': "Раскладка THS",
+            'opts': self.model._meta,
+            'preview': preview,
+            'selected': [str(pk) for pk in queryset.values_list('pk', flat=True)],
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        }
+        return TemplateResponse(request, 'admin/ths_preview.html', context)
+
+    preview_ths.short_description = "Раскладка THS: предпросмотр"
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Машины из инлайна сохраняются после контейнера: если их состав поменялся у прибывшего контейнера,
+        # THS раскладывается заново уже на новый состав
+        container = form.instance
+        if container.status == 'arrived' and container.ths is not None and any(f.has_changed() for f in formsets):
+            split_container_ths([container])
 
 
 class PaymentAdmin(admin.ModelAdmin):
@@ -143,6 +400,9 @@ class PaymentAdmin(admin.ModelAdmin):
     list_filter = ('status', 'payment_type')
     search_fields = ('car__vin', 'container__number')
 
+    def get_search_results(self, request, queryset, search_term):
+        return search_payments(queryset, search_term), False
+
     fieldsets = (
         (None, {
             'fields': ('car', 'container', 'amount_due', 'amount_paid', 'status', 'payment_type')
@@ -159,25 +419,90 @@ class InvoiceAdmin(admin.ModelAdmin):
     readonly_fields = ('amount',)
     exclude = ('cars',)
 
-    actions = ['mark_as_paid']
-
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        obj.update_amount()
+    actions = ['mark_as_paid', 'download_pdfs']
+
+    CAR_PAGE_SIZE = 20
+
+    def get_urls(self):
+        urls = [
+            path('cars/autocomplete/', self.admin_site.admin_view(self.car_autocomplete),
+                 name='logistics_invoice_car_autocomplete'),
+        ]
+        return urls + super().get_urls()
+
+    def car_autocomplete(self, request):
+        # Ответ в формате select2: машины клиента счёта на складе, поиск по началу VIN, страницы по CAR_PAGE_SIZE
+        if not (self.has_change_permission(request) or self.has_add_permission(request)):
+            raise Http404
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        invoice_id = request.GET.get('invoice', '')
+        cars = invoice_cars(int(invoice_id) if invoice_id.isdigit() else None)
+        term = request.GET.get('term', '').strip().upper()
+        if term:
+            # Диапазон вместо LIKE: префиксный поиск идёт по уникальному индексу vin на любой БД
+            cars = cars.filter(vin__gte=term, vin__lt=term + '\uffff')
+        offset = (page - 1) * self.CAR_PAGE_SIZE
+        rows = list(cars.order_by('vin').values_list('pk', 'vin', 'make')[offset:offset + self.CAR_PAGE_SIZE + 1])
+        return JsonResponse({
+            'results': [{'id': str(pk), 'text': f"{vin} — {make}"} for pk, vin, make in rows[:self.CAR_PAGE_SIZE]],
+            'pagination': {'more': len(rows) > self.CAR_PAGE_SIZE},
+        })
 
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
-        form.instance.update_amount()
+        # Инлайн сохраняет строки связи напрямую, минуя m2m_changed, поэтому пересчитываем один раз здесь
+        recalculate_invoice_amounts(Invoice.objects.filter(pk=form.instance.pk))
 
     def mark_as_paid(self, request, queryset):
-        queryset.update(status='paid')
+        paid = mark_invoices_paid(queryset)
+        self.message_user(
+            request,
+            f"Оплачено счетов: {len(paid['invoices'])}, закрыто платежей по машинам: {len(paid['payments'])}",
+            messages.SUCCESS,
+        )
 
     mark_as_paid.short_description = "Пометить выбранные счета как оплаченные"
 
+    def download_pdfs(self, request, queryset):
+        paths = render_invoices(list(queryset.values_list('pk', flat=True)))
+        response = streaming_response(
+            request, stream_zip((f"invoice_{pk}.pdf", path) for pk, path in paths), 'application/zip',
+        )
+        response['Content-Disposition'] = f'attachment; filename="invoices_{timezone.now():%Y%m%d_%H%M}.zip"'
+        return response
+
+    download_pdfs.short_description = "Скачать PDF выбранных счетов (ZIP)"
+
+
+class ClientAdmin(admin.ModelAdmin):
+    list_display = ('name', 'email', 'phone', 'balance', 'invoices_due', 'payments_due')
+    search_fields = ('name', 'email')
+
+    def get_changelist_instance(self, request):
+        # Долги всей страницы — одним чтением из кэша, в базу идут только промахи
+        changelist = super().get_changelist_instance(request)
+        dues = client_balances([client.pk for client in changelist.result_list])
+        for client in changelist.result_list:
+            client.dues = dues[client.pk]
+        return changelist
+
+    def invoices_due(self, obj):
+        return obj.dues['invoices_due']
+
+    invoices_due.short_description = "Долг по счетам"
+
+    def payments_due(self, obj):
+        return obj.dues['payments_due']
+
+    payments_due.short_description = "Долг по платежам"
+
 
 admin_site.register(Car, CarAdmin)
 admin_site.register(Payment, PaymentAdmin)
-admin_site.register(Warehouse)
+admin_site.register(Warehouse, WarehouseAdmin)
 admin_site.register(Container, ContainerAdmin)
-admin_site.register(Client)
+admin_site.register(Client, ClientAdmin)
 admin_site.register(Invoice, InvoiceAdmin)
\ No newline at end of file
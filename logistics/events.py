@@ -0,0 +1,94 @@
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import DwellRollup, StatusEvent
+
+BATCH_SIZE = 2000
+
+
+def record_events(object_type, rows, at=None):
+    # rows: (id объекта, новый статус, склад); пишется пачками, число запросов не зависит от числа строк в пачке
+    at = at or timezone.now()
+    rows = iter(rows)
+    while batch := list(islice(rows, BATCH_SIZE)):
+        StatusEvent.objects.bulk_create([
+            StatusEvent(object_type=object_type, object_id=pk, status=status, warehouse_id=warehouse_id, created_at=at)
+            for pk, status, warehouse_id in batch
+        ])
+
+
+def record_car_events(cars, status, at=None):
+    # Вызывается до update(): в cars только машины, у которых статус действительно меняется
+    rows = list(cars.order_by().values_list('pk', 'warehouse_id'))
+    record_events(StatusEvent.CAR, ((pk, status, warehouse_id) for pk, warehouse_id in rows), at)
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+@transaction.atomic
+def rollup_dwell_times(day=None):
+    # Переходы за день: время в прошлом статусе до перехода, по складу из события перехода.
+    # Читается только история объектов, у которых за день были события (индекс status_event_object_idx).
+    day = day or timezone.localdate() - timedelta(days=1)
+    start, end = day_bounds(day)
+    totals = {}
+    for object_type, _ in StatusEvent.OBJECT_TYPE_CHOICES:
+        touched = StatusEvent.objects.filter(object_type=object_type, created_at__gte=start, created_at__lt=end)
+        events = (
+            StatusEvent.objects.filter(
+                object_type=object_type,
+                object_id__in=touched.values('object_id'),
+                created_at__lt=end,
+            )
+            .order_by('object_id', 'created_at', 'pk')
+            .values_list('object_id', 'status', 'warehouse_id', 'created_at')
+        )
+        current = None  # (объект, статус, с какого момента)
+        for object_id, status, warehouse_id, created_at in events.iterator(chunk_size=BATCH_SIZE):
+            if current is None or current[0] != object_id:
+                current = (object_id, status, created_at)
+                continue
+            if status == current[1]:
+                continue
+            if created_at >= start:
+                seconds = int((created_at - current[2]).total_seconds())
+                key = (warehouse_id, object_type, current[1], status)
+                transitions, total, longest = totals.get(key, (0, 0, 0))
+                totals[key] = (transitions + 1, total + seconds, max(longest, seconds))
+            current = (object_id, status, created_at)
+
+    # Повторный прогон за тот же день заменяет строки, а не дублирует их
+    DwellRollup.objects.filter(day=day).delete()
+    DwellRollup.objects.bulk_create([
+        DwellRollup(day=day, warehouse_id=warehouse_id, object_type=object_type, from_status=from_status,
+                    to_status=to_status, transitions=transitions, total_seconds=total, max_seconds=longest)
+        for (warehouse_id, object_type, from_status, to_status), (transitions, total, longest) in totals.items()
+    ])
+    return len(totals)
+
+
+def average_dwell(from_status, to_status, start_day, end_day, object_type=StatusEvent.CAR):
+    # Средняя задержка по складам за период — только по таблице агрегатов
+    rows = (
+        DwellRollup.objects.filter(
+            object_type=object_type, from_status=from_status, to_status=to_status,
+            day__gte=start_day, day__lte=end_day,
+        )
+        .values('warehouse_id')
+        .annotate(transitions=Sum('transitions'), total_seconds=Sum('total_seconds'))
+        .order_by('warehouse_id')
+    )
+    return {
+        row['warehouse_id']: {
+            'transitions': row['transitions'],
+            'average': timedelta(seconds=row['total_seconds'] / row['transitions']),
+        }
+        for row in rows
+    }
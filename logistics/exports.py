@@ -0,0 +1,128 @@
+import csv
+import zipfile
+from datetime import date
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.utils import timezone
+
+from .pdf import ZipStream, streaming_response
+from .routers import read_alias
+
+CAR_COLUMNS = (
+    ('VIN', 'vin'),
+    ('Марка', 'make'),
+    ('Клиент', 'client__name'),
+    ('Контейнер', 'container__number'),
+    ('Склад', 'warehouse__name'),
+    ('Статус', 'storage_status'),
+    ('Дата постановки', 'date_stored'),
+    ('THS', 'ths'),
+    ('SKLAD', 'sklad'),
+    ('DAYS', 'days_cost'),
+    ('PROF', 'prof'),
+    ('TOTAL', 'total'),
+)
+CHUNK_SIZE = 2000
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Cars" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def car_rows(queryset):
+    # values_list + iterator: строки не превращаются в модели и не копятся в памяти
+    return queryset.order_by('pk').values_list(*(path for _, path in CAR_COLUMNS)).iterator(chunk_size=CHUNK_SIZE)
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    yield '\ufeff' + writer.writerow([title for title, _ in CAR_COLUMNS])
+    for row in rows:
+        yield writer.writerow(['' if value is None else value for value in row])
+
+
+def xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, date):
+        value = value.isoformat()
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def stream_xlsx(rows):
+    # XLSX — это zip с XML; лист пишется построчно в потоковый zip, как и PDF-архивы счетов
+    buffer = ZipStream()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', XLSX_ROOT_RELS)
+        archive.writestr('xl/workbook.xml', XLSX_WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS)
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            header = ''.join(xlsx_cell(title) for title, _ in CAR_COLUMNS)
+            sheet.write(f'<row>{header}</row>'.encode())
+            yield buffer.pop()
+            for i, row in enumerate(rows, start=1):
+                sheet.write(f"<row>{''.join(xlsx_cell(value) for value in row)}</row>".encode())
+                if i % CHUNK_SIZE == 0:
+                    yield buffer.pop()
+            sheet.write(b'</sheetData></worksheet>')
+    yield buffer.pop()
+
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+def export_cars_response(request, queryset, fmt):
+    stream, content_type = EXPORT_FORMATS[fmt]
+    # Строки читаются уже после выхода из middleware, поэтому база выбирается здесь, пока известно,
+    # писал ли запрос
+    queryset = queryset.using(read_alias())
+    response = streaming_response(request, stream(car_rows(queryset)), content_type)
+    response['Content-Disposition'] = f'attachment; filename="cars_{timezone.now():%Y%m%d_%H%M}.{fmt}"'
+    return response
@@ -0,0 +1,16 @@
+from django.db.models import Func, IntegerField
+
+
+class DaysBetween(Func):
+    # Количество дней между датами (end - start), считается в базе, чтобы по нему можно было сортировать
+    function = 'DATEDIFF'
+    arity = 2
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        end, start = (compiler.compile(expression) for expression in self.get_source_expressions())
+        return f"CAST(julianday({end[0]}) - julianday({start[0]}) AS INTEGER)", (*end[1], *start[1])
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        end, start = (compiler.compile(expression) for expression in self.get_source_expressions())
+        return f"({end[0]})::date - ({start[0]})::date", (*end[1], *start[1])
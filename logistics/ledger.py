@@ -0,0 +1,155 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Client, Invoice, LedgerEntry, Payment
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+BALANCE_CHUNK_SIZE = 500
+
+
+def post_entries(entries):
+    # Записи и новые остатки клиентов в одной транзакции; строки клиентов блокируются,
+    # поэтому параллельные проводки по одному клиенту выстраиваются в очередь.
+    # Число запросов не зависит от числа записей.
+    entries = [entry for entry in entries if entry.amount]
+    if not entries:
+        return 0
+    with transaction.atomic():
+        return write_entries(entries)
+
+
+def write_entries(entries):
+    balances = dict(
+        Client.objects.select_for_update()
+        .filter(pk__in={entry.client_id for entry in entries})
+        .order_by('pk')
+        .values_list('pk', 'balance')
+    )
+    # Клиент мог быть удалён, пока запись ждала коммита
+    entries = sorted((entry for entry in entries if entry.client_id in balances), key=lambda entry: entry.client_id)
+    now = timezone.now()
+    for entry in entries:
+        balances[entry.client_id] += entry.amount
+        entry.balance = balances[entry.client_id]
+        entry.created_at = now
+    LedgerEntry.objects.bulk_create(entries, batch_size=2000)
+
+    touched = sorted({entry.client_id for entry in entries})
+    for i in range(0, len(touched), BALANCE_CHUNK_SIZE):
+        chunk = touched[i:i + BALANCE_CHUNK_SIZE]
+        Client.objects.filter(pk__in=chunk).update(balance=Case(
+            *[When(pk=pk, then=Value(balances[pk])) for pk in chunk], output_field=MONEY,
+        ))
+    return len(entries)
+
+
+def posted(field, client=None):
+    # Сумма проведённого по документу: по всем клиентам или только по текущему клиенту документа
+    entries = LedgerEntry.objects.filter(**{field: OuterRef('pk')})
+    if client:
+        entries = entries.filter(client_id=OuterRef(client))
+    entries = entries.order_by().values(field).annotate(total=Sum('amount')).values('total')
+    return Coalesce(Subquery(entries[:1]), Value(Decimal('0')), output_field=MONEY)
+
+
+def sync_documents(model, field, kind, candidates, targets):
+    # candidates — документы, где проведённое расходится с нужным (читается без блокировок, только отбор).
+    # Точная разница считается заново под блокировкой строк документов: параллельная сверка того же
+    # документа (сигнал и задача sync_ledger) ждёт коммита и видит уже проведённые записи.
+    # Проведённое считается по паре (документ, клиент): при смене клиента запись на старом сторнируется,
+    # на новом — проводится.
+    pks = list(candidates.order_by('pk').values_list('pk', flat=True))
+    posted_count = 0
+    for i in range(0, len(pks), BALANCE_CHUNK_SIZE):
+        with transaction.atomic():
+            chunk = pks[i:i + BALANCE_CHUNK_SIZE]
+            wanted, payment_types = targets(
+                model.objects.select_for_update(of=('self',)).filter(pk__in=chunk).order_by('pk')
+            )
+            already = {
+                (row[field], row['client_id']): row['total']
+                for row in LedgerEntry.objects.filter(**{f'{field}__in': chunk})
+                .values(field, 'client_id').annotate(total=Sum('amount')).order_by()
+            }
+            entries = [
+                LedgerEntry(client_id=client_id, kind=kind, payment_type=payment_types.get(pk, ''),
+                            amount=wanted.get((pk, client_id), 0) - already.get((pk, client_id), 0),
+                            **{f'{field}_id': pk})
+                for pk, client_id in sorted(wanted.keys() | already.keys())
+            ]
+            entries = [entry for entry in entries if entry.amount]
+            if entries:
+                posted_count += write_entries(entries)
+    return posted_count
+
+
+def invoice_targets(invoices):
+    # Начисление по счёту = его сумма, на клиента счёта
+    return {(pk, client_id): amount for pk, client_id, amount in invoices.values_list('pk', 'client_id', 'amount')}, {}
+
+
+def payment_targets(payments):
+    # Оплата (наличные, перевод, взаимозачёт) уменьшает долг клиента, за чью машину она внесена.
+    # Платежи только по контейнеру клиенту не приписать — они в журнал не попадают.
+    rows = list(payments.values_list('pk', 'car__client_id', 'payment_type', 'amount_paid'))
+    wanted = {(pk, client_id): -amount_paid for pk, client_id, _, amount_paid in rows if client_id is not None}
+    return wanted, {pk: payment_type for pk, _, payment_type, _ in rows}
+
+
+def sync_invoice_charges(invoices=None):
+    # При изменении суммы проводится только разница
+    candidates = (
+        (invoices if invoices is not None else Invoice.objects.all())
+        .annotate(posted=posted('invoice', 'client_id'), posted_all=posted('invoice'))
+        .exclude(amount=F('posted'), posted_all=F('posted'))
+    )
+    return sync_documents(Invoice, 'invoice', 'charge', candidates, invoice_targets)
+
+
+def sync_payment_credits(payments=None):
+    candidates = (
+        (payments if payments is not None else Payment.objects.all())
+        .annotate(
+            posted=posted('payment', 'car__client_id'),
+            posted_all=posted('payment'),
+            credit=Case(
+                When(car__client__isnull=True, then=Value(Decimal('0'))),
+                default=Value(Decimal('0')) - F('amount_paid'),
+                output_field=MONEY,
+            ),
+        )
+        .exclude(credit=F('posted'), posted_all=F('posted'))
+    )
+    return sync_documents(Payment, 'payment', 'credit', candidates, payment_targets)
+
+
+def sync_ledger():
+    return sync_invoice_charges() + sync_payment_credits()
+
+
+def balance_at(client_id, moment):
+    # Остаток последней записи до момента: один шаг по индексу ledger_client_time_idx
+    balance = (
+        LedgerEntry.objects.filter(client_id=client_id, created_at__lt=moment)
+        .order_by('-created_at', '-pk')
+        .values_list('balance', flat=True)
+        .first()
+    )
+    return balance if balance is not None else Decimal('0')
+
+
+def statement(client_id, start, end):
+    entries = (
+        LedgerEntry.objects.filter(client_id=client_id, created_at__gte=start, created_at__lt=end)
+        .order_by('created_at', 'pk')
+        .values('created_at', 'kind', 'amount', 'balance', 'invoice_id', 'payment_id', 'payment_type')
+    )
+    return {
+        'opening_balance': balance_at(client_id, start),
+        'entries': list(entries),
+        'closing_balance': balance_at(client_id, end),
+    }
@@ -0,0 +1,12 @@
+from django.urls import path
+
+from Proekt.urls import urlpatterns as project_urlpatterns
+
+from . import async_views
+
+# Синхронные двойники асинхронных view — только для manage.py loadtest и replicabench, в проде их нет
+urlpatterns = project_urlpatterns + [
+    path('api/sync/dashboard/', async_views.dashboard_sync, name='api_sync_dashboard'),
+    path('api/sync/containers/<str:number>/', async_views.container_detail_sync, name='api_sync_container_detail'),
+    path('api/sync/cars/<str:vin>/', async_views.car_detail_sync, name='api_sync_car_detail'),
+]
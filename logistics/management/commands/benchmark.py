@@ -0,0 +1,67 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from logistics.benchmarks import SCENARIOS, compare, generate, run
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет время и число запросов на горячих путях на синтетических данных. Работает на отдельной "
+        "тестовой базе (для локального прогона: DATABASE_URL=sqlite:///bench.sqlite3), locmem-почта, "
+        "Celery в eager-режиме. Результат печатается в JSON; --compare сравнивает с прошлым прогоном."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', metavar='scenario', help="По умолчанию все сценарии")
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--warehouses', type=int, default=5)
+        parser.add_argument('--containers', type=int, default=200)
+        parser.add_argument('--cars-per-container', type=int, default=20)
+        parser.add_argument('--invoices', type=int, default=1000)
+        parser.add_argument('--payments', type=int, default=2000)
+        parser.add_argument('--debtors', type=int, default=10000, help="Отдельные должники сценария reminders")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Записать результат в файл")
+        parser.add_argument('--compare', help="JSON прошлого прогона для поиска регрессий")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="Допустимый рост времени (доля)")
+
+    def handle(self, *args, scenarios, **options):
+        unknown = set(scenarios) - SCENARIOS.keys()
+        if unknown:
+            raise CommandError(f"Неизвестные сценарии: {', '.join(sorted(unknown))}. Доступны: {', '.join(SCENARIOS)}")
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)['results']
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # Админка рендерится без manifest-файла collectstatic
+            with override_settings(STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            }):
+                report = {
+                    'vendor': connection.vendor,
+                    'dataset': generate(**options),
+                    'results': [run(name, **options) for name in scenarios or SCENARIOS],
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+        self.stdout.write(output)
+
+        if baseline is not None:
+            regressions = compare(report['results'], baseline, options['tolerance'])
+            if regressions:
+                raise CommandError("Регрессии производительности:\n" + '\n'.join(regressions))
+            self.stderr.write("Регрессий нет")
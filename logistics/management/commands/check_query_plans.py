@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from logistics.query_plans import full_scans, key_querysets
+
+
+class Command(BaseCommand):
+    help = "Прогоняет EXPLAIN по ключевым запросам и падает, если какой-то из них читает таблицу целиком"
+
+    def handle(self, *args, **options):
+        scans = full_scans()
+        for name in key_querysets():
+            status = f"полный скан: {', '.join(scans[name])}" if name in scans else "индекс"
+            self.stdout.write(f"{name}: {status}")
+        if scans:
+            raise CommandError(f"Полный скан таблиц в запросах: {', '.join(scans)}")
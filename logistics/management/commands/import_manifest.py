@@ -0,0 +1,257 @@
+import csv
+import json
+import sys
+import time
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from logistics import cache, search
+from logistics.events import record_events
+from logistics.models import Car, Client, Container, Invoice, StatusEvent, Warehouse
+from logistics.services import recalculate_invoice_amounts, refresh_warehouse_occupancy
+
+COST_FIELDS = ('ths', 'sklad', 'days_cost', 'prof')
+CAR_CHOICE_FIELDS = {
+    'storage_status': dict(Car.STATUS_CHOICES),
+    'procedure': dict(Car.PROCEDURE_CHOICES),
+    'title': dict(Car.TITLE_CHOICES),
+}
+
+
+class RowError(ValueError):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Импорт манифеста (CSV или JSONL) с контейнерами и машинами. "
+        "Колонки: vin, make, client, container, arrival_date, container_status, warehouse, "
+        "storage_status, procedure, title, date_stored, ths, sklad, days_cost, prof."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Путь к файлу или '-' для stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="По умолчанию определяется по расширению")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--delimiter', default=',')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('jsonl' if options['path'].endswith(('.jsonl', '.json')) else 'csv')
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError("--chunk-size должен быть больше 0")
+
+        self.warehouses = dict(Warehouse.objects.values_list('name', 'id'))
+        self.clients = dict(Client.objects.values_list('name', 'id'))
+        self.today = timezone.now().date()
+
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8-sig')
+        try:
+            rows = self.read_csv(stream, options['delimiter']) if fmt == 'csv' else self.read_jsonl(stream)
+            self.run(rows, chunk_size)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+    def read_csv(self, stream, delimiter):
+        for line, row in enumerate(csv.DictReader(stream, delimiter=delimiter), start=2):
+            yield line, {key.strip(): (value or '').strip() for key, value in row.items() if key}
+
+    def read_jsonl(self, stream):
+        for line, raw in enumerate(stream, start=1):
+            if raw.strip():
+                try:
+                    yield line, json.loads(raw)
+                except json.JSONDecodeError as e:
+                    yield line, RowError(f"некорректный JSON: {e}")
+
+    def run(self, rows, chunk_size):
+        started = time.monotonic()
+        total = imported = 0
+        self.errors = 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            total += len(chunk)
+            imported += self.import_chunk(chunk)
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"{total} строк, {total / elapsed:.0f} строк/с")
+
+        # Машины могли заехать на склады или покинуть их; складов мало, пересчитываем все разом
+        refresh_warehouse_occupancy()
+        # bulk_create не шлёт сигналов, поэтому кэш сбрасываем целиком
+        cache.invalidate_all()
+        elapsed = time.monotonic() - started
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Импортировано машин: {imported}, ошибок: {self.errors}, {elapsed:.1f} с ({rate:.0f} строк/с)"
+        ))
+
+    @transaction.atomic
+    def import_chunk(self, chunk):
+        parsed = []
+        for line, row in chunk:
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                parsed.append(self.parse_row(row))
+            except RowError as e:
+                self.errors += 1
+                self.stderr.write(f"Строка {line}: {e}")
+        if not parsed:
+            return 0
+
+        self.create_missing_clients({row['client'] for row in parsed if row['client']})
+        containers = self.upsert_containers(parsed)
+
+        # Повторы VIN в чанке сливаются в одну машину: поля объединяются, при совпадении побеждает последняя
+        # строка. Иначе PostgreSQL отклонил бы ON CONFLICT DO UPDATE, затрагивающий одну строку дважды
+        merged = {}
+        for row in parsed:
+            car = merged.setdefault(row['vin'], {'fields': {}, 'container_warehouse_id': None})
+            fields = car['fields']
+            fields.update(row['fields'])
+            if row['client']:
+                fields['client_id'] = self.clients[row['client']]
+            container_id, container_warehouse_id = containers.get(row['container'], (None, None))
+            if container_id:
+                fields['container_id'] = container_id
+                car['container_warehouse_id'] = container_warehouse_id
+            if row['warehouse_id']:
+                fields['warehouse_id'] = row['warehouse_id']
+
+        # Обновляем только те поля, которые есть в строке, чтобы не затереть данные существующих машин
+        groups = {}
+        for vin, merged_car in merged.items():
+            fields = merged_car['fields']
+            car = Car(vin=vin, **fields)
+            # Как в Car.save(): склад контейнера подставляется только новым машинам без склада
+            if not car.warehouse_id:
+                car.warehouse_id = merged_car['container_warehouse_id']
+            groups.setdefault(tuple(sorted(fields)), []).append(car)
+
+        # Статусы до импорта: по ним пишем события только для новых машин и сменивших статус
+        vins = list(merged)
+        statuses = dict(Car.objects.filter(vin__in=vins).values_list('vin', 'storage_status'))
+        for keys, cars in groups.items():
+            for car in cars:
+                if not car.storage_status:
+                    car.storage_status = 'in_port'
+                if car.storage_status == 'in_warehouse' and not car.date_stored:
+                    car.date_stored = self.today
+            Car.objects.bulk_create(
+                cars,
+                update_conflicts=bool(keys),
+                ignore_conflicts=not keys,
+                unique_fields=['vin'] if keys else None,
+                update_fields=[*(key.removesuffix('_id') for key in keys), 'updated_at'] if keys else None,
+            )
+        record_events(StatusEvent.CAR, (
+            (pk, status, warehouse_id)
+            for vin, pk, status, warehouse_id in Car.objects.filter(vin__in=vins).values_list(
+                'vin', 'pk', 'storage_status', 'warehouse_id'
+            )
+            if statuses.get(vin) != status
+        ))
+        recalculate_invoice_amounts(Invoice.objects.filter(cars__vin__in=vins))
+        search.index_cars(Car.objects.filter(vin__in=vins))
+        return len(parsed)
+
+    def parse_row(self, row):
+        vin = (row.get('vin') or '').strip().upper()
+        if not vin or len(vin) > 17:
+            raise RowError(f"некорректный VIN: {vin!r}")
+        warehouse = (row.get('warehouse') or '').strip()
+        if warehouse and warehouse not in self.warehouses:
+            raise RowError(f"неизвестный склад: {warehouse!r}")
+        container_status = (row.get('container_status') or 'sailing').strip()
+        if container_status not in dict(Container.STATUS_CHOICES):
+            raise RowError(f"недопустимое значение container_status: {container_status!r}")
+
+        fields = {}
+        make = (row.get('make') or '').strip()
+        if make:
+            fields['make'] = make
+        date_stored = self.parse_date('date_stored', row.get('date_stored'))
+        if date_stored:
+            fields['date_stored'] = date_stored
+        for name, choices in CAR_CHOICE_FIELDS.items():
+            value = (row.get(name) or '').strip()
+            if value:
+                if value not in choices:
+                    raise RowError(f"недопустимое значение {name}: {value!r}")
+                fields[name] = value
+        for name in COST_FIELDS:
+            value = row.get(name)
+            if value not in (None, ''):
+                fields[name] = self.parse_decimal(name, value)
+
+        return {
+            'vin': vin,
+            'client': (row.get('client') or '').strip(),
+            'container': (row.get('container') or '').strip(),
+            'arrival_date': self.parse_date('arrival_date', row.get('arrival_date')),
+            'container_status': container_status,
+            'warehouse_id': self.warehouses.get(warehouse),
+            'fields': fields,
+        }
+
+    def parse_decimal(self, name, value):
+        try:
+            return Decimal(str(value).replace(',', '.')).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise RowError(f"некорректное число в {name}: {value!r}")
+
+    def parse_date(self, name, value):
+        if not value:
+            return None
+        try:
+            return date.fromisoformat(str(value).strip())
+        except ValueError:
+            raise RowError(f"некорректная дата в {name}: {value!r}")
+
+    def create_missing_clients(self, names):
+        missing = names - self.clients.keys()
+        if missing:
+            Client.objects.bulk_create([Client(name=name, email='', phone='', address='') for name in missing])
+            self.clients.update(Client.objects.filter(name__in=missing).values_list('name', 'id'))
+
+    def upsert_containers(self, parsed):
+        # Новые контейнеры создаём, у существующих обновляем дату прибытия и склад.
+        # Статус при импорте не меняется: его переводит transition_containers().
+        new = {}
+        for row in parsed:
+            number = row['container']
+            if number and row['arrival_date'] and number not in new:
+                new[number] = Container(
+                    number=number,
+                    arrival_date=row['arrival_date'],
+                    status=row['container_status'],
+                    warehouse_id=row['warehouse_id'],
+                )
+        for with_warehouse in (True, False):
+            batch = [c for c in new.values() if bool(c.warehouse_id) is with_warehouse]
+            if batch:
+                Container.objects.bulk_create(
+                    batch,
+                    update_conflicts=True,
+                    unique_fields=['number'],
+                    update_fields=['arrival_date', 'updated_at', *(['warehouse'] if with_warehouse else [])],
+                )
+        numbers = {row['container'] for row in parsed if row['container']}
+        containers = {
+            number: (pk, warehouse_id)
+            for number, pk, warehouse_id in Container.objects.filter(number__in=numbers).values_list(
+                'number', 'id', 'warehouse_id'
+            )
+        }
+        unknown = numbers - containers.keys()
+        if unknown:
+            self.stderr.write(f"Контейнеры не найдены и без даты прибытия: {', '.join(sorted(unknown))}")
+        return containers
@@ -0,0 +1,53 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from logistics.benchmarks import generate, load_test
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный прогон дашборда и карточек контейнера и машины: синхронные view против асинхронных "
+        "при одинаковой параллельности. Запросы идут через обработчики WSGI и ASGI внутри процесса, "
+        "на отдельной тестовой базе с синтетическими данными. Печатает p50/p99 и запросы в секунду в JSON. "
+        "Асинхронные view выполняют запросы параллельно только на постоянных соединениях (--conn-max-age)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=100, help="Запросов на каждый вид ответа")
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--warehouses', type=int, default=5)
+        parser.add_argument('--containers', type=int, default=200)
+        parser.add_argument('--cars-per-container', type=int, default=20)
+        parser.add_argument('--invoices', type=int, default=1000)
+        parser.add_argument('--payments', type=int, default=2000)
+        parser.add_argument('--conn-max-age', type=int, help="CONN_MAX_AGE на время прогона, по умолчанию из настроек")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Записать результат в файл")
+
+    def handle(self, *args, **options):
+        if options['conn_max_age'] is not None:
+            connection.settings_dict['CONN_MAX_AGE'] = options['conn_max_age']
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # Синхронные двойники есть только в URLconf для нагрузочных прогонов
+            with override_settings(ROOT_URLCONF='logistics.loadtest_urls'):
+                report = {
+                    'vendor': connection.vendor,
+                    'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+                    'dataset': generate(**options),
+                    'results': load_test(**options),
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+        self.stdout.write(output)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from logistics import search
+from logistics.models import Car
+
+
+class Command(BaseCommand):
+    help = "Перестраивает индекс поиска машин (для бэкенда suffix — таблицу суффиксов VIN и марки)"
+
+    def handle(self, *args, **options):
+        search.index_cars(Car.objects.all())
+        self.stdout.write(self.style.SUCCESS(f"Проиндексировано машин: {Car.objects.count()}"))
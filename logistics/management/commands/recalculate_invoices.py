@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from logistics.services import recalculate_invoice_amounts
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает суммы всех счетов по машинам одним запросом"
+
+    def handle(self, *args, **options):
+        updated = recalculate_invoice_amounts()
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано счетов: {updated}"))
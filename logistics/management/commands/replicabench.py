@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from logistics.benchmarks import generate, prepare_replica_benchmark, replica_benchmark
+from logistics.routers import REPLICA, copy_sqlite_replica, replica_configured
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает нагрузку на основную базу без реплики и с репликой на одной и той же смеси запросов: "
+        "списки админки, API, выгрузка, отчёт и редкие записи. Нужен REPLICA_DATABASE_URL; для SQLite реплика — "
+        "снимок тестовой базы во временном файле. Печатает число запросов и время в базе по каждой базе в JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=20, help="Повторов смеси запросов")
+        parser.add_argument('--write-every', type=int, default=5, help="Запись в каждом N-м повторе, 0 — без записей")
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--warehouses', type=int, default=5)
+        parser.add_argument('--containers', type=int, default=200)
+        parser.add_argument('--cars-per-container', type=int, default=20)
+        parser.add_argument('--invoices', type=int, default=1000)
+        parser.add_argument('--payments', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Записать результат в файл")
+
+    def handle(self, *args, **options):
+        if not replica_configured():
+            raise CommandError("Реплика не настроена: задайте REPLICA_DATABASE_URL")
+        primary, replica = connections['default'], connections[REPLICA]
+        setup_test_environment()
+        old_name = primary.creation.create_test_db(verbosity=0, autoclobber=True)
+        replica_file = None
+        try:
+            dataset = generate(**options)
+            http = prepare_replica_benchmark()
+            if primary.vendor == 'sqlite' and replica.vendor == 'sqlite':
+                replica_file = tempfile.mkstemp(suffix='.sqlite3')[1]
+                replica.settings_dict['NAME'] = replica_file
+                copy_sqlite_replica()
+            else:
+                replica.creation.set_as_test_mirror(primary.settings_dict)
+            with override_settings(ROOT_URLCONF='logistics.loadtest_urls'):
+                report = {
+                    'vendor': primary.vendor,
+                    'dataset': dataset,
+                    'results': replica_benchmark(http, **options),
+                }
+        finally:
+            replica.close()
+            if replica_file:
+                os.remove(replica_file)
+            primary.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+        self.stdout.write(output)
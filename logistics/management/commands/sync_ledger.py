@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from logistics.ledger import sync_ledger
+
+
+class Command(BaseCommand):
+    help = "Проводит в журнал расчётов недостающие начисления по счетам и оплаты (первичное заполнение и сверка)"
+
+    def handle(self, *args, **options):
+        posted = sync_ledger()
+        self.stdout.write(self.style.SUCCESS(f"Проведено записей: {posted}"))
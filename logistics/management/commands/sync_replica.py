@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from logistics.routers import REPLICA, copy_sqlite_replica, replica_configured
+
+
+class Command(BaseCommand):
+    help = (
+        "Копирует основную базу SQLite в файл реплики (REPLICA_DATABASE_URL) — локальная замена репликации "
+        "для проверки чтения с реплики"
+    )
+
+    def handle(self, *args, **options):
+        if not replica_configured():
+            raise CommandError("Реплика не настроена: задайте REPLICA_DATABASE_URL")
+        if connections[DEFAULT_DB_ALIAS].vendor != 'sqlite' or connections[REPLICA].vendor != 'sqlite':
+            raise CommandError("Копирование файла поддерживается только для SQLite; настоящую реплику ведёт сервер БД")
+        copy_sqlite_replica()
+        self.stdout.write(self.style.SUCCESS(f"Реплика обновлена: {connections[REPLICA].settings_dict['NAME']}"))
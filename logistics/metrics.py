@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Гистограммы времени и числа запросов к базе по view и задачам Celery. Наблюдения копятся в памяти
+# процесса и раз в LOGISTICS_METRICS_FLUSH_SECONDS сливаются приращениями в общий кэш: gunicorn-воркеры
+# и процессы Celery складываются в одни счётчики, а /metrics читает их одним get_many.
+PREFIX = 'logistics:metrics'
+SERIES_KEY = f'{PREFIX}:series'
+SCALE = 1_000_000  # суммы хранятся целыми микроединицами, чтобы работал cache.incr
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+HISTOGRAMS = {
+    'request_seconds': (SECONDS_BUCKETS, "Время ответа view, с"),
+    'request_queries': (QUERY_BUCKETS, "Запросов к базе за один ответ view"),
+    'request_db_seconds': (SECONDS_BUCKETS, "Время в базе за один ответ view, с"),
+    'task_seconds': (SECONDS_BUCKETS, "Время выполнения задачи Celery, с"),
+    'task_queries': (QUERY_BUCKETS, "Запросов к базе за одну задачу Celery"),
+    'task_db_seconds': (SECONDS_BUCKETS, "Время в базе за одну задачу Celery, с"),
+}
+
+SLOW_SQL_LENGTH = 300
+
+lock = threading.Lock()
+pending = Counter()
+series = set()
+last_flush = time.monotonic()
+
+current = ContextVar('logistics_metrics', default=None)
+
+
+class Collector:
+    # Запросы одного ответа или задачи; sync_to_async копирует контекст, поэтому сюда же попадают
+    # запросы, выполненные в потоках пула (async_views.run_concurrently)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = Counter()
+
+    def add(self, sql, seconds):
+        with self.lock:
+            self.queries += 1
+            self.db_seconds += seconds
+            self.statements[sql] += 1
+
+    def repeated(self, limit=3):
+        # Одинаковый текст SQL с разными параметрами много раз подряд — типичный N+1
+        return [(count, sql) for sql, count in self.statements.most_common(limit) if count > 1]
+
+
+def record_query(execute, sql, params, many, context):
+    collector = current.get()
+    if collector is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        collector.add(sql, time.perf_counter() - started)
+
+
+def install(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def collect():
+    collector = Collector()
+    token = current.set(collector)
+    try:
+        yield collector
+    finally:
+        current.reset(token)
+
+
+def labels_key(labels):
+    return ','.join(f'{name}={value}' for name, value in labels)
+
+
+def key(metric, labels, part):
+    return f'{PREFIX}:{metric}:{labels_key(labels)}:{part}'
+
+
+def observe(metric, labels, value):
+    buckets = HISTOGRAMS[metric][0]
+    labels = tuple(labels.items())
+    with lock:
+        pending[key(metric, labels, f'b{bisect_left(buckets, value)}')] += 1
+        pending[key(metric, labels, 'sum')] += int(value * SCALE)
+        pending[key(metric, labels, 'count')] += 1
+        series.add((metric, labels))
+
+
+def flush_interval():
+    return getattr(settings, 'LOGISTICS_METRICS_FLUSH_SECONDS', 10)
+
+
+def maybe_flush():
+    # Вызывается после отправки ответа (request_finished) и после задачи, а не из record(): слив — это
+    # по обращению к кэшу на каждый ключ, и ответ, попавший на границу интервала, не должен их ждать
+    if time.monotonic() - last_flush >= flush_interval():
+        flush()
+
+
+def flush():
+    global last_flush
+    with lock:
+        deltas = dict(pending)
+        pending.clear()
+        known = set(series)
+        last_flush = time.monotonic()
+    for name, amount in deltas.items():
+        try:
+            cache.incr(name, amount)
+        except ValueError:
+            if not cache.add(name, amount, None):
+                cache.incr(name, amount)
+    # Список рядов общий для всех процессов; если чужая запись затёрла наши ряды, они вернутся при следующем сливе
+    index = cache.get(SERIES_KEY) or set()
+    if not known <= index:
+        cache.set(SERIES_KEY, index | known, None)
+
+
+def slow_threshold():
+    return getattr(settings, 'LOGISTICS_SLOW_SECONDS', 1.0)
+
+
+def record(kind, labels, seconds, collector):
+    for part, value in (('seconds', seconds), ('queries', collector.queries), ('db_seconds', collector.db_seconds)):
+        observe(f'{kind}_{part}', labels, value)
+    if seconds >= slow_threshold():
+        repeated = ''.join(f"\n  {count}× {sql[:SLOW_SQL_LENGTH]}" for count, sql in collector.repeated())
+        logger.warning(
+            "Медленно: %s %s — %.2f с, запросов %d, в базе %.2f с%s",
+            kind, labels_key(labels.items()), seconds, collector.queries, collector.db_seconds, repeated,
+        )
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def label_text(labels, **extra):
+    return ','.join(f'{name}="{escape(value)}"' for name, value in [*labels, *extra.items()])
+
+
+def render():
+    # Текстовый формат Prometheus; корзины в кэше хранятся отдельно и суммируются здесь
+    flush()
+    index = sorted(cache.get(SERIES_KEY) or set())
+    by_metric = defaultdict(list)
+    for metric, labels in index:
+        if metric in HISTOGRAMS:
+            by_metric[metric].append(labels)
+    keys = [
+        key(metric, labels, part)
+        for metric, rows in by_metric.items()
+        for labels in rows
+        for part in [f'b{i}' for i in range(len(HISTOGRAMS[metric][0]) + 1)] + ['sum', 'count']
+    ]
+    values = cache.get_many(keys)
+    lines = []
+    for metric, rows in by_metric.items():
+        buckets, help_text = HISTOGRAMS[metric]
+        name = f'logistics_{metric}'
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for labels in rows:
+            total = 0
+            for i, bound in enumerate([*buckets, '+Inf']):
+                total += values.get(key(metric, labels, f'b{i}'), 0)
+                lines.append(f'{name}_bucket{{{label_text(labels, le=bound)}}} {total}')
+            lines.append(f'{name}_sum{{{label_text(labels)}}} {values.get(key(metric, labels, "sum"), 0) / SCALE}')
+            lines.append(f'{name}_count{{{label_text(labels)}}} {values.get(key(metric, labels, "count"), 0)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,72 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics, routers
+
+
+class MetricsMiddleware:
+    # Время ответа, число запросов и время в базе по имени view (а не по пути, чтобы рядов было конечное число)
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with metrics.collect() as collector:
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, collector)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with metrics.collect() as collector:
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, collector)
+        return response
+
+    def record(self, request, response, seconds, collector):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        status = f'{response.status_code // 100}xx'
+        metrics.record('request', {'view': view, 'method': request.method, 'status': status}, seconds, collector)
+
+
+class ReplicaMiddleware:
+    # Границы закрепления за основной базой (logistics/routers.py). Запрос, который писал, ставит cookie:
+    # следующие запросы (обычно редирект после POST) тоже читают основную базу, пока реплика догоняет
+    sync_capable = True
+    async_capable = True
+    cookie_name = 'logistics_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with routers.scope(pinned=self.cookie_name in request.COOKIES) as state:
+            response = self.get_response(request)
+        return self.pin(response, state)
+
+    async def __acall__(self, request):
+        with routers.scope(pinned=self.cookie_name in request.COOKIES) as state:
+            response = await self.get_response(request)
+        return self.pin(response, state)
+
+    def pin(self, response, state):
+        seconds = getattr(settings, 'LOGISTICS_REPLICA_PIN_SECONDS', 5)
+        if state.wrote and seconds and routers.replica_configured():
+            response.set_cookie(self.cookie_name, '1', max_age=seconds, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0009_payment_payment_type_alter_car_title'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='warehouse',
+            name='free_days',
+            field=models.PositiveIntegerField(default=0, verbose_name='Бесплатные дни хранения'),
+        ),
+        migrations.CreateModel(
+            name='WarehouseRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_day', models.PositiveIntegerField(verbose_name='С дня хранения')),
+                ('daily_rate', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Ставка в день')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rates', to='logistics.warehouse')),
+            ],
+            options={
+                'ordering': ['warehouse', 'from_day'],
+                'constraints': [models.UniqueConstraint(fields=('warehouse', 'from_day'), name='unique_warehouse_rate_from_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0010_warehouse_rates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['client', 'storage_status'], name='car_client_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(condition=models.Q(('storage_status', 'in_warehouse')), fields=['date_stored', 'warehouse'], name='car_in_warehouse_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='container',
+            index=models.Index(fields=['status', 'warehouse'], name='container_status_wh_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'due_date'], name='invoice_status_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('status', 'unpaid')), fields=['due_date'], name='invoice_unpaid_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status'], name='payment_status_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:13
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_occupied(apps, schema_editor):
+    Car = apps.get_model('logistics', 'Car')
+    Warehouse = apps.get_model('logistics', 'Warehouse')
+    occupied = (
+        Car.objects.filter(warehouse_id=OuterRef('pk'), storage_status='in_warehouse')
+        .order_by()
+        .values('warehouse_id')
+        .annotate(n=Count('id'))
+        .values('n')
+    )
+    Warehouse.objects.update(occupied=Coalesce(Subquery(occupied[:1]), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0011_access_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='warehouse',
+            name='occupied',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Занято мест'),
+        ),
+        migrations.RunPython(fill_occupied, migrations.RunPython.noop),
+    ]
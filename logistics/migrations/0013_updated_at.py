@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0012_warehouse_occupied'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='container',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
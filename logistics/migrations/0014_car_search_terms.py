@@ -0,0 +1,63 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+MIN_TERM_LENGTH = 3
+
+
+def fill_search_terms(apps, schema_editor):
+    Car = apps.get_model('logistics', 'Car')
+    CarSearchTerm = apps.get_model('logistics', 'CarSearchTerm')
+    last_pk = 0
+    while chunk := list(Car.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'vin', 'make')[:2000]):
+        last_pk = chunk[-1][0]
+        terms = []
+        for pk, vin, make in chunk:
+            values = {value[i:] for value in (vin.upper(), (make or '').upper())
+                      for i in range(len(value) - MIN_TERM_LENGTH + 1)}
+            terms.extend(CarSearchTerm(car_id=pk, term=term) for term in values)
+        CarSearchTerm.objects.bulk_create(terms, batch_size=5000)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Для бэкенда поиска trigram; выражение совпадает с тем, что Django строит для icontains
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS car_vin_trgm_idx ON logistics_car USING gin (UPPER("vin"::text) gin_trgm_ops)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS car_make_trgm_idx ON logistics_car USING gin (UPPER("make"::text) gin_trgm_ops)'
+    )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS car_vin_trgm_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS car_make_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0013_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CarSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=50)),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='logistics.car')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'car'], name='car_search_term_idx', opclasses=['varchar_pattern_ops', 'int8_ops'])],
+            },
+        ),
+        migrations.RunPython(fill_search_terms, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
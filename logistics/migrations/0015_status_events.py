@@ -0,0 +1,45 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:28
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0014_car_search_terms'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DwellRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('warehouse_id', models.BigIntegerField(blank=True, null=True)),
+                ('object_type', models.PositiveSmallIntegerField(choices=[(1, 'Контейнер'), (2, 'Машина')])),
+                ('from_status', models.CharField(max_length=20)),
+                ('to_status', models.CharField(max_length=20)),
+                ('transitions', models.PositiveIntegerField(default=0)),
+                ('total_seconds', models.BigIntegerField(default=0)),
+                ('max_seconds', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'object_type', 'from_status', 'to_status'], name='dwell_rollup_day_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StatusEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_type', models.PositiveSmallIntegerField(choices=[(1, 'Контейнер'), (2, 'Машина')])),
+                ('object_id', models.BigIntegerField()),
+                ('status', models.CharField(max_length=20)),
+                ('warehouse_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['object_type', 'object_id', 'created_at'], name='status_event_object_idx'), models.Index(fields=['created_at'], name='status_event_created_idx')],
+            },
+        ),
+    ]
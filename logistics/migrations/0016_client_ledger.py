@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0015_status_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='Баланс'),
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('kind', models.CharField(choices=[('charge', 'Начисление'), ('credit', 'Оплата')], max_length=10)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('payment_type', models.CharField(blank=True, choices=[('cash', 'Наличные'), ('transfer', 'Перевод'), ('mutual_settlement', 'Взаимозачёт')], max_length=20)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='logistics.client')),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='logistics.invoice')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='logistics.payment')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['client', 'created_at', 'id'], name='ledger_client_time_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:42
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0016_client_ledger'),
+    ]
+
+    # Обычный столбец нельзя превратить в вычисляемый: он удаляется и создаётся заново, значения считает база
+    operations = [
+        migrations.RemoveField(
+            model_name='car',
+            name='total',
+        ),
+        migrations.AddField(
+            model_name='car',
+            name='total',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('ths'), '+', models.F('sklad')), '+', models.F('days_cost')), '+', models.F('prof')), output_field=models.DecimalField(decimal_places=2, max_digits=10), verbose_name='TOTAL'),
+        ),
+    ]
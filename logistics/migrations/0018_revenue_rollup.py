@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:43
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0017_car_total_generated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('warehouse_id', models.BigIntegerField(blank=True, null=True)),
+                ('procedure', models.CharField(choices=[('transit', 'Транзит'), ('reexport', 'Реекспорт'), ('import', 'Импорт'), ('export', 'Экспорт')], max_length=10)),
+                ('client_id', models.BigIntegerField(blank=True, null=True)),
+                ('cars', models.PositiveIntegerField(default=0)),
+                ('ths', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('sklad', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('days_cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('prof', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('refreshed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['month', 'warehouse_id'], name='revenue_rollup_month_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0018_revenue_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='size_class',
+            field=models.CharField(choices=[('moto', 'Мотоцикл'), ('sedan', 'Легковой'), ('suv', 'Внедорожник / пикап'), ('oversize', 'Крупногабаритный')], default='sedan', max_length=10, verbose_name='Габарит'),
+        ),
+        migrations.AddField(
+            model_name='car',
+            name='ths_fixed',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Фиксированный THS'),
+        ),
+        migrations.AddField(
+            model_name='container',
+            name='ths_strategy',
+            field=models.CharField(choices=[('even', 'Поровну'), ('weighted', 'По габаритам машин'), ('fixed', 'Фиксированные суммы, остаток поровну')], default='even', max_length=10, verbose_name='Раскладка THS'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0019_ths_allocation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='warehouse',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
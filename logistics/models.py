@@ -1,12 +1,123 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import connections, models, transaction
+from django.db.models.sql import UpdateQuery
+from django.db.models import F, Subquery, Sum, Value
+from django.db.models.functions import Greatest
 from django.utils import timezone
-from django.core.exceptions import ValidationError
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.dispatch import Signal
+
+# queryset.update() не отправляет post_save; кэш узнаёт о массовых изменениях по этому сигналу
+queryset_updated = Signal()
+
+
+class NotifyingQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        queryset_updated.send(sender=self.model, fields=set(kwargs), queryset=self)
+        return rows
+
+    def update_returning(self, **kwargs):
+        # UPDATE ... RETURNING: меняет строки и возвращает их id одним запросом (PostgreSQL, SQLite >= 3.35)
+        connection = connections[self.db]
+        if not connection.features.can_return_columns_from_insert:
+            with transaction.atomic(using=self.db):
+                ids = list(self.select_for_update().values_list('pk', flat=True))
+                self.model._default_manager.filter(pk__in=ids).update(**kwargs)
+            return ids
+        query = self.query.chain(UpdateQuery)
+        query.add_update_values(kwargs)
+        try:
+            sql, params = query.get_compiler(self.db).as_sql()
+        except EmptyResultSet:
+            return []
+        pk_column = connection.ops.quote_name(self.model._meta.pk.column)
+        with transaction.mark_for_rollback_on_error(using=self.db), connection.cursor() as cursor:
+            cursor.execute(f'{sql} RETURNING {pk_column}', params)
+            ids = [row[0] for row in cursor.fetchall()]
+        queryset_updated.send(
+            sender=self.model, fields=set(kwargs), queryset=self.model._default_manager.filter(pk__in=ids)
+        )
+        return ids
+
+
+class TimestampedQuerySet(NotifyingQuerySet):
+    # queryset.update() не вызывает auto_now, поэтому updated_at проставляем сами —
+    # иначе массовые обновления не меняли бы Last-Modified/ETag в API
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())
+        return super().update(**kwargs)
+
+    def update_returning(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())
+        return super().update_returning(**kwargs)
+
+
+class ChangeTrackingMixin:
+    # Значения полей на момент загрузки из базы или последнего save(). По ним save() пишет только изменённые
+    # поля, а каскады и post_save-обработчики (они ещё видят старые значения) решают, есть ли им работа.
+    # Экземпляр, созданный конструктором, считается изменённым целиком.
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_values()
+        return instance
+
+    def remember_values(self, fields=None):
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (fields is None or field.attname in fields):
+                loaded[field.attname] = self.__dict__[field.attname]
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self.remember_values(None if fields is None else self.attnames(fields))
+
+    def original(self, attname, default=None):
+        return getattr(self, '_loaded_values', {}).get(attname, default)
+
+    def changed_fields(self, update_fields=None):
+        loaded = getattr(self, '_loaded_values', None)
+        changed = {
+            field.attname for field in self._meta.concrete_fields
+            if not field.generated and field.attname in self.__dict__ and (
+                loaded is None or field.attname not in loaded or loaded[field.attname] != self.__dict__[field.attname]
+            )
+        }
+        if update_fields is not None:
+            changed &= self.attnames(update_fields)
+        return changed
 
-class Client(models.Model):
+    def has_changed(self, *attnames):
+        return bool(self.changed_fields() & set(attnames))
+
+    def attnames(self, names):
+        return {self._meta.get_field(name).attname for name in names}
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if not self._state.adding and update_fields is None and hasattr(self, '_loaded_values'):
+            update_fields = self.changed_fields() - {self._meta.pk.attname}
+            # Пустой update_fields: Django не выполняет ни запроса, ни сигналов
+        if update_fields:
+            # updated_at (ETag и Last-Modified в API) меняется при любом сохранении, и с явным update_fields
+            update_fields = {*update_fields, *(
+                field.name for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)
+            )}
+        super().save(*args, update_fields=update_fields, **kwargs)
+        self.remember_values(None if update_fields is None else self.attnames(update_fields))
+
+class Client(ChangeTrackingMixin, models.Model):
     name = models.CharField(max_length=100)
     email = models.EmailField()
     phone = models.CharField(max_length=15)
     address = models.TextField()
+    # Текущий остаток по журналу LedgerEntry: меняется только вместе с записью в журнал
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False, verbose_name="Баланс")
+    # Имя клиента отдаётся в API машин и счетов: его изменение должно менять ETag их страниц
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TimestampedQuerySet.as_manager()
 
     def __str__(self):
         return self.name
@@ -15,11 +126,34 @@ class Warehouse(models.Model):
     name = models.CharField(max_length=100)
     location = models.TextField()
     capacity = models.IntegerField()
+    free_days = models.PositiveIntegerField(default=0, verbose_name="Бесплатные дни хранения")
+    occupied = models.PositiveIntegerField(default=0, editable=False, verbose_name="Занято мест")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TimestampedQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
-class Container(models.Model):
+    @property
+    def free_places(self):
+        return self.capacity - self.occupied
+
+class WarehouseRate(models.Model):
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name="rates")
+    from_day = models.PositiveIntegerField(verbose_name="С дня хранения")
+    daily_rate = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Ставка в день")
+
+    class Meta:
+        ordering = ['warehouse', 'from_day']
+        constraints = [
+            models.UniqueConstraint(fields=['warehouse', 'from_day'], name='unique_warehouse_rate_from_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.warehouse} с {self.from_day} дня: {self.daily_rate} USD"
+
+class Container(ChangeTrackingMixin, models.Model):
     STATUS_CHOICES = [
         ('arrived', 'Прибыл'),
         ('unloaded', 'Разгружен'),
@@ -27,12 +161,28 @@ class Container(models.Model):
         ('delivered', 'Передан клиенту'),
         ('sailing', 'Плывет'),
     ]
+    # Способы раскладки THS контейнера по машинам (logistics/allocation.py)
+    THS_STRATEGY_CHOICES = [
+        ('even', 'Поровну'),
+        ('weighted', 'По габаритам машин'),
+        ('fixed', 'Фиксированные суммы, остаток поровну'),
+    ]
 
     number = models.CharField(max_length=50, unique=True)
     arrival_date = models.DateField()
     warehouse = models.ForeignKey(Warehouse, on_delete=models.SET_NULL, null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES)
     ths = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="THS")
+    ths_strategy = models.CharField(max_length=10, choices=THS_STRATEGY_CHOICES, default='even',
+                                    verbose_name="Раскладка THS")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TimestampedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'warehouse'], name='container_status_wh_idx'),
+        ]
 
     def __str__(self):
         return self.number
@@ -42,21 +192,22 @@ class Container(models.Model):
             raise ValidationError("Поле THS обязательно для заполнения и должно быть больше 0 при статусе 'Прибыл'.")
 
     def save(self, *args, **kwargs):
-        self.full_clean()
+        adding = self._state.adding
+        changed = self.changed_fields(kwargs.get('update_fields'))
+        # Проверяются только изменённые поля: ссылка на склад и уникальность номера стоят запроса
+        unchanged = [field.name for field in self._meta.concrete_fields if field.attname not in changed]
+        self.full_clean(exclude=unchanged, validate_unique='number' in changed)
         super().save(*args, **kwargs)
-        if self.status == 'sailing':
-            self.cars.update(storage_status='sailing')
-        elif self.status != 'sailing':
-            self.cars.exclude(storage_status='delivered').update(storage_status=self.status)
-        if self.status == 'arrived' and self.ths is not None:
-            cars = self.cars.all()
-            if cars.exists():
-                ths_per_car = self.ths / cars.count()
-                for car in cars:
-                    car.ths = ths_per_car
-                    car.save()
-
-class Car(models.Model):
+        if 'status' in changed:
+            StatusEvent.objects.create(object_type=StatusEvent.CONTAINER, object_id=self.pk, status=self.status,
+                                       warehouse_id=self.warehouse_id)
+        # Статус переносится на машины, THS раскладывается при прибытии; у нового контейнера машин ещё нет
+        resplit = self.status == 'arrived' and changed & {'ths', 'ths_strategy', 'warehouse_id'}
+        if not adding and ('status' in changed or resplit):
+            from .services import propagate_container_status
+            propagate_container_status([self])
+
+class Car(ChangeTrackingMixin, models.Model):
     STATUS_CHOICES = [
         ('in_port', 'В порту'),
         ('in_warehouse', 'На складе'),
@@ -75,6 +226,14 @@ class Car(models.Model):
         ('delivered', 'Передан клиенту'),
         ('waiting_from_usa', 'Ждем из USA'),
     ]
+    SIZE_CLASS_CHOICES = [
+        ('moto', 'Мотоцикл'),
+        ('sedan', 'Легковой'),
+        ('suv', 'Внедорожник / пикап'),
+        ('oversize', 'Крупногабаритный'),
+    ]
+    # Вес машины при раскладке THS по габаритам
+    SIZE_WEIGHTS = {'moto': 1, 'sedan': 2, 'suv': 3, 'oversize': 4}
     vin = models.CharField(max_length=17, unique=True)
     make = models.CharField(max_length=50)
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name="cars", null=True)
@@ -87,8 +246,31 @@ class Car(models.Model):
     sklad = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, verbose_name="SKLAD")
     days_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, verbose_name="DAYS")
     prof = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, verbose_name="PROF")
-    total = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, editable=False, verbose_name="TOTAL")
+    size_class = models.CharField(max_length=10, choices=SIZE_CLASS_CHOICES, default='sedan', verbose_name="Габарит")
+    ths_fixed = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                    verbose_name="Фиксированный THS")
+    # Считается базой при любой записи, в том числе при queryset.update() расходов
+    total = models.GeneratedField(
+        expression=F('ths') + F('sklad') + F('days_cost') + F('prof'),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True,
+        verbose_name="TOTAL",
+    )
     warehouse = models.ForeignKey(Warehouse, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Склад")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TimestampedQuerySet.as_manager()
+
+    COST_FIELDS = ('ths', 'sklad', 'days_cost', 'prof')
+
+    class Meta:
+        indexes = [
+            # Выбор машин клиента на складе в InvoiceCarInline
+            models.Index(fields=['client', 'storage_status'], name='car_client_status_idx'),
+            # Машины на складе: начисление хранения и фильтр по дням хранения
+            models.Index(fields=['date_stored', 'warehouse'], name='car_in_warehouse_idx',
+                         condition=models.Q(storage_status='in_warehouse')),
+        ]
 
     def __str__(self):
         client_name = self.client.name if self.client else "Без клиента"
@@ -103,12 +285,54 @@ class Car(models.Model):
     def save(self, *args, **kwargs):
         if self.storage_status == 'in_warehouse' and not self.date_stored:
             self.date_stored = timezone.now().date()
-        if self.container and not self.warehouse:
-            self.warehouse = self.container.warehouse
-        self.total = self.ths + self.sklad + self.days_cost + self.prof
+        # Контейнер читается, только если склад надо подставить, а не при каждом сохранении
+        if self.container_id and not self.warehouse_id:
+            self.warehouse_id = self.container.warehouse_id
+        adding = self._state.adding
+        changed = self.changed_fields(kwargs.get('update_fields'))
+        loaded = dict(getattr(self, '_loaded_values', {}))  # после save() там уже новые значения
         super().save(*args, **kwargs)
+        if changed & set(self.COST_FIELDS) and not adding:
+            # total после UPDATE в экземпляре устарел: поле перечитается из базы при первом обращении
+            self.__dict__.pop('total', None)
+            self._loaded_values.pop('total', None)
+            # Счета, в которые входит машина, получают только разницу в одном запросе; новая сумма — из базы,
+            # старая — из загруженных расходов (total загруженным может и не быть: only(), прошлый save())
+            invoices = Invoice.objects.filter(cars=self).exclude(status='paid')
+            if all(loaded.get(field) is not None for field in self.COST_FIELDS):
+                old_total = sum(Decimal(str(loaded[field])) for field in self.COST_FIELDS)
+                invoices.update(
+                    amount=F('amount') + Subquery(Car.objects.filter(pk=self.pk).values('total')) - old_total
+                )
+            else:
+                from .services import recalculate_invoice_amounts
+                recalculate_invoice_amounts(invoices)
+        # Счётчик занятых мест: машина заехала на склад, уехала или сменила склад
+        if changed & {'storage_status', 'warehouse_id'}:
+            old_place = loaded.get('warehouse_id') if loaded.get('storage_status') == 'in_warehouse' else None
+            new_place = self.warehouse_id if self.storage_status == 'in_warehouse' else None
+            if old_place != new_place:
+                if old_place:
+                    Warehouse.objects.filter(pk=old_place).update(occupied=Greatest(F('occupied') - 1, Value(0)))
+                if new_place:
+                    Warehouse.objects.filter(pk=new_place).update(occupied=F('occupied') + 1)
+        if 'storage_status' in changed:
+            StatusEvent.objects.create(object_type=StatusEvent.CAR, object_id=self.pk, status=self.storage_status,
+                                       warehouse_id=self.warehouse_id)
+
+class CarSearchTerm(models.Model):
+    # Суффиксы VIN и марки: поиск подстроки сводится к поиску по началу строки, а он идёт по индексу
+    car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=50)
+
+    class Meta:
+        indexes = [
+            # varchar_pattern_ops нужен PostgreSQL для LIKE 'ABC%' по индексу, другие базы opclasses не используют
+            models.Index(fields=['term', 'car'], name='car_search_term_idx', opclasses=['varchar_pattern_ops', 'int8_ops']),
+        ]
 
-class Payment(models.Model):
+
+class Payment(ChangeTrackingMixin, models.Model):
     PAYMENT_TYPE_CHOICES = [
         ('cash', 'Наличные'),
         ('transfer', 'Перевод'),
@@ -124,6 +348,13 @@ class Payment(models.Model):
     is_partial = models.BooleanField(default=False)
     payment_type = models.CharField(max_length=20, choices=PAYMENT_TYPE_CHOICES, default='cash')  # Новое поле
 
+    objects = NotifyingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status'], name='payment_status_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if self.amount_paid < self.amount_due:
             self.is_partial = True
@@ -137,29 +368,118 @@ class Payment(models.Model):
     def __str__(self):
         return f"Payment for {self.car if self.car else 'Container'} - {self.amount_paid} / {self.amount_due} USD ({self.status}) - {self.get_payment_type_display()}"
 
-class Invoice(models.Model):
+class Invoice(ChangeTrackingMixin, models.Model):
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name="invoices")
     issue_date = models.DateField(default=timezone.now)
     due_date = models.DateField()
     amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     status = models.CharField(max_length=20, choices=[('unpaid', 'Не оплачен'), ('paid', 'Оплачен'), ('overdue', 'Просрочен')], default='unpaid')
     cars = models.ManyToManyField(Car, related_name="invoices", blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TimestampedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'due_date'], name='invoice_status_due_idx'),
+            # Проверка просрочки: только неоплаченные счета
+            models.Index(fields=['due_date'], name='invoice_unpaid_due_idx', condition=models.Q(status='unpaid')),
+        ]
 
     def update_amount(self):
-        self.amount = sum(car.total for car in self.cars.all())
-        self.save(update_fields=['amount'])
+        self.amount = self.cars.aggregate(amount=Sum('total'))['amount'] or 0
+        self.save(update_fields=['amount', 'updated_at'])
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
 
     def mark_as_paid(self):
+        from .services import mark_invoices_paid
+        mark_invoices_paid(Invoice.objects.filter(pk=self.pk))
         self.status = 'paid'
-        self.save()
 
     def check_overdue(self):
         if self.status == 'unpaid' and self.due_date < timezone.now().date():
             self.status = 'overdue'
-            self.save()
+            self.save(update_fields=['status', 'updated_at'])
 
     def __str__(self):
-        return f"Invoice #{self.id} - {self.client.name} - {self.amount} USD ({self.status})"
\ No newline at end of file
+        return f"Invoice #{self.id} - {self.client.name} - {self.amount} USD ({self.status})"
+
+
+class StatusEvent(models.Model):
+    # Журнал смен статусов контейнеров и машин: только добавление, без внешних ключей,
+    # чтобы записи переживали удаление объектов и писались пачками
+    CONTAINER = 1
+    CAR = 2
+    OBJECT_TYPE_CHOICES = [(CONTAINER, 'Контейнер'), (CAR, 'Машина')]
+
+    object_type = models.PositiveSmallIntegerField(choices=OBJECT_TYPE_CHOICES)
+    object_id = models.BigIntegerField()
+    status = models.CharField(max_length=20)
+    warehouse_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['object_type', 'object_id', 'created_at'], name='status_event_object_idx'),
+            models.Index(fields=['created_at'], name='status_event_created_idx'),
+        ]
+
+
+class DwellRollup(models.Model):
+    # Сколько объекты пробыли в статусе from_status до перехода в to_status: суммы по дню перехода и складу
+    day = models.DateField()
+    warehouse_id = models.BigIntegerField(null=True, blank=True)
+    object_type = models.PositiveSmallIntegerField(choices=StatusEvent.OBJECT_TYPE_CHOICES)
+    from_status = models.CharField(max_length=20)
+    to_status = models.CharField(max_length=20)
+    transitions = models.PositiveIntegerField(default=0)
+    total_seconds = models.BigIntegerField(default=0)
+    max_seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['day', 'object_type', 'from_status', 'to_status'], name='dwell_rollup_day_idx'),
+        ]
+
+
+class RevenueRollup(models.Model):
+    # Расходы по машинам за месяц (date_stored, иначе дата прибытия контейнера) в разрезе склада,
+    # процедуры и клиента; отчёт в админке читает только эту таблицу (logistics/reports.py)
+    month = models.DateField()
+    warehouse_id = models.BigIntegerField(null=True, blank=True)
+    procedure = models.CharField(max_length=10, choices=Car.PROCEDURE_CHOICES)
+    client_id = models.BigIntegerField(null=True, blank=True)
+    cars = models.PositiveIntegerField(default=0)
+    ths = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    sklad = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    days_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    prof = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    refreshed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['month', 'warehouse_id'], name='revenue_rollup_month_idx'),
+        ]
+
+
+class LedgerEntry(models.Model):
+    # Журнал расчётов с клиентом: начисления по счетам (+) и оплаты (−). balance — остаток после записи,
+    # поэтому баланс на любой момент — одна запись по индексу (client, created_at)
+    KIND_CHOICES = [('charge', 'Начисление'), ('credit', 'Оплата')]
+
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='ledger_entries')
+    created_at = models.DateTimeField(default=timezone.now)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    invoice = models.ForeignKey(Invoice, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    payment_type = models.CharField(max_length=20, choices=Payment.PAYMENT_TYPE_CHOICES, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['client', 'created_at', 'id'], name='ledger_client_time_idx'),
+        ]
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from .models import Car, Invoice
+
+# Меняется при любом изменении вёрстки, чтобы старые файлы из кэша не отдавались
+LAYOUT_VERSION = 1
+CAR_COLUMNS = (
+    ('VIN', 40), ('Марка', 150), ('THS', 250), ('SKLAD', 310), ('DAYS', 370), ('PROF', 430), ('TOTAL', 490),
+)
+
+
+def cache_dir():
+    path = Path(getattr(settings, 'INVOICE_PDF_CACHE_DIR', Path(tempfile.gettempdir()) / 'invoice_pdf_cache'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def invoice_documents(invoice_ids):
+    # Все данные для печати двумя запросами; результат — простые словари, которые можно передать в другой процесс
+    invoices = (
+        Invoice.objects.filter(pk__in=invoice_ids)
+        .select_related('client')
+        .prefetch_related(Prefetch(
+            'cars',
+            queryset=Car.objects.order_by('vin').only('vin', 'make', 'ths', 'sklad', 'days_cost', 'prof', 'total'),
+        ))
+        .order_by('pk')
+    )
+    for invoice in invoices:
+        yield {
+            'id': invoice.pk,
+            'client': invoice.client.name,
+            'issue_date': str(invoice.issue_date),
+            'due_date': str(invoice.due_date),
+            'amount': str(invoice.amount),
+            'status': invoice.get_status_display(),
+            'cars': [
+                [car.vin, car.make, str(car.ths), str(car.sklad), str(car.days_cost), str(car.prof), str(car.total)]
+                for car in invoice.cars.all()
+            ],
+        }
+
+
+def document_hash(document):
+    payload = json.dumps([LAYOUT_VERSION, document], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def render_invoice_pdf(document):
+    buffer = BytesIO()
+    p = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+
+    y = height - 50
+    for line in (
+        f"Счет #{document['id']}",
+        f"Клиент: {document['client']}",
+        f"Сумма: {document['amount']} USD",
+        f"Дата выставления: {document['issue_date']}",
+        f"Срок оплаты: {document['due_date']}",
+        f"Статус: {document['status']}",
+    ):
+        p.drawString(40, y, line)
+        y -= 20
+
+    def header(y):
+        for title, x in CAR_COLUMNS:
+            p.drawString(x, y, title)
+        return y - 18
+
+    y = header(y - 10)
+    for row in document['cars']:
+        if y < 50:
+            p.showPage()
+            y = header(height - 50)
+        for value, (_, x) in zip(row, CAR_COLUMNS):
+            p.drawString(x, y, value)
+        y -= 16
+
+    p.showPage()
+    p.save()
+    return buffer.getvalue()
+
+
+def render_to_file(document, path):
+    # Запускается в процессе пула: пишем сразу на диск, чтобы готовые PDF не копились в памяти
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(render_invoice_pdf(document))
+    os.replace(tmp_path, path)
+    return path
+
+
+def render_invoices(invoice_ids, workers=None):
+    # Пары (id счета, путь к PDF); неизменившиеся счета берутся из кэша по хэшу содержимого,
+    # остальные рендерятся параллельно в пуле процессов
+    directory = cache_dir()
+    paths, missing = [], []
+    for document in invoice_documents(invoice_ids):
+        path = directory / f"{document_hash(document)}.pdf"
+        paths.append((document['id'], path))
+        if not path.exists():
+            missing.append((document, path))
+
+    if len(missing) > 1:
+        workers = workers or getattr(settings, 'INVOICE_PDF_WORKERS', None)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(render_to_file, *zip(*missing)))
+    elif missing:
+        render_to_file(*missing[0])
+    return paths
+
+
+class ZipStream:
+    # Файлоподобный буфер без seek: zipfile пишет в него, а мы по кусочкам отдаём байты в ответ
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(files, chunk_size=64 * 1024):
+    buffer = ZipStream()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, path in files:
+            with open(path, 'rb') as src, archive.open(name, 'w') as dst:
+                while data := src.read(chunk_size):
+                    dst.write(data)
+                    yield buffer.pop()
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+async def iterate_in_thread(chunks):
+    # Каждый следующий кусок синхронного генератора — в основном синхронном потоке (thread_sensitive):
+    # курсор iterator() остаётся в том же потоке и соединении, а в памяти не больше одного куска
+    chunks = iter(chunks)
+    done = object()
+    try:
+        while (chunk := await sync_to_async(next)(chunks, done)) is not done:
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            await sync_to_async(chunks.close)()
+
+
+def streaming_response(request, chunks, content_type):
+    # Под ASGI Django 5.1 отдаёт синхронный генератор только целиком (sync_to_async(list)), поэтому там
+    # он оборачивается в асинхронный; под WSGI, наоборот, асинхронный собирался бы целиком
+    if isinstance(request, ASGIRequest):
+        chunks = iterate_in_thread(chunks)
+    return StreamingHttpResponse(chunks, content_type=content_type)
@@ -0,0 +1,56 @@
+import re
+from datetime import timedelta
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Car, Container, Invoice, Payment
+
+SQLITE_FULL_SCAN = re.compile(r'\bSCAN (\w+)\s*$')
+POSTGRES_FULL_SCAN = re.compile(r'\bSeq Scan on (\w+)')
+
+
+def key_querysets():
+    # Запросы горячих путей с типовыми параметрами; значения не важны, важен план
+    today = timezone.now().date()
+    return {
+        'invoice_car_picker': Car.objects.filter(client_id=1, storage_status='in_warehouse'),
+        'container_cars': Car.objects.filter(container_id=1),
+        'cars_by_days_on_warehouse': Car.objects.filter(
+            storage_status='in_warehouse', date_stored__gte=today - timedelta(days=30), date_stored__lte=today
+        ),
+        'storage_billing': Car.objects.filter(
+            storage_status='in_warehouse', warehouse_id__in=[1, 2], date_stored__isnull=False
+        ),
+        'containers_by_status': Container.objects.filter(status='arrived'),
+        'containers_by_status_and_warehouse': Container.objects.filter(status='stored', warehouse_id=1),
+        'payments_by_status': Payment.objects.filter(status='pending'),
+        'invoices_by_status': Invoice.objects.filter(status='paid'),
+        'overdue_invoices': Invoice.objects.filter(status='unpaid', due_date__lt=today),
+        'client_due_invoices': Invoice.objects.filter(
+            client_id=1, status__in=['unpaid', 'overdue'], due_date__lte=today
+        ),
+    }
+
+
+def full_scans(querysets=None):
+    # Имя запроса -> таблицы приложения, которые он читает целиком
+    tables = {model._meta.db_table for model in apps.get_app_config('logistics').get_models()}
+    tables.add(Invoice.cars.through._meta.db_table)
+    pattern = POSTGRES_FULL_SCAN if connection.vendor == 'postgresql' else SQLITE_FULL_SCAN
+    found = {}
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # На маленьких таблицах Postgres выбирает Seq Scan даже при наличии индекса
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        for name, queryset in (querysets or key_querysets()).items():
+            scanned = {
+                match.group(1)
+                for line in queryset.explain().splitlines()
+                if (match := pattern.search(line)) and match.group(1) in tables
+            }
+            if scanned:
+                found[name] = sorted(scanned)
+    return found
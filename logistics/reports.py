@@ -0,0 +1,123 @@
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from .models import Car, Client, RevenueRollup, Warehouse
+
+BATCH_SIZE = 2000
+AMOUNT_FIELDS = ('ths', 'sklad', 'days_cost', 'prof', 'total')
+DIMENSIONS = {
+    'month': "Месяц",
+    'warehouse_id': "Склад",
+    'procedure': "Процедура",
+    'client_id': "Клиент",
+}
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def cars_by_month():
+    # Машина относится к месяцу постановки на склад, а до неё — к месяцу прибытия контейнера
+    return Car.objects.annotate(
+        month=TruncMonth(Coalesce('date_stored', 'container__arrival_date'))
+    ).filter(month__isnull=False)
+
+
+def dirty_months(since):
+    # Месяцы, где с прошлой свёртки менялись машины (в том числе queryset.update(), он тоже ставит updated_at)
+    # или их контейнеры. Машина, ушедшая в другой месяц, и удалённые машины остаются в старом месяце
+    # до полной пересборки (задача rebuild_revenue_rollups раз в месяц).
+    return set(
+        cars_by_month()
+        .filter(Q(updated_at__gte=since) | Q(container__updated_at__gte=since))
+        .order_by()
+        .values_list('month', flat=True)
+        .distinct()
+    )
+
+
+@transaction.atomic
+def rollup_revenue(months=None, now=None):
+    # Суммы считает база одним группирующим запросом; months=None — пересборка всей таблицы
+    now = now or timezone.now()
+    cars = cars_by_month()
+    existing = RevenueRollup.objects.all()
+    if months is not None:
+        months = sorted(months)
+        cars = cars.filter(month__in=months)
+        existing = existing.filter(month__in=months)
+    rows = (
+        cars.order_by()
+        .values('month', 'warehouse_id', 'procedure', 'client_id')
+        .annotate(cars_count=Count('pk'), **{field: Sum(field) for field in AMOUNT_FIELDS})
+    )
+    existing.delete()
+    rollups = [
+        RevenueRollup(refreshed_at=now, cars=row.pop('cars_count'), **row)
+        for row in rows.iterator(chunk_size=BATCH_SIZE)
+    ]
+    RevenueRollup.objects.bulk_create(rollups, batch_size=BATCH_SIZE)
+    return len(rollups)
+
+
+def refresh_revenue_rollups(now=None):
+    # Ночная свёртка: текущий месяц и месяцы с изменениями после прошлого прогона.
+    # Время прогона берётся до чтения машин, поэтому изменения во время прогона попадут в следующий.
+    now = now or timezone.now()
+    since = RevenueRollup.objects.aggregate(since=Max('refreshed_at'))['since']
+    if since is None:
+        return rollup_revenue(now=now)
+    months = dirty_months(since) | {month_start(timezone.localdate(now))}
+    return rollup_revenue(months, now=now)
+
+
+def revenue_report(start, end, group_by, warehouse_id=None, procedure=None, client_id=None):
+    # Месяцы с start по end включительно; группировка по любым измерениям из DIMENSIONS
+    rows = RevenueRollup.objects.filter(month__gte=month_start(start), month__lte=month_start(end))
+    if warehouse_id is not None:
+        rows = rows.filter(warehouse_id=warehouse_id)
+    if procedure:
+        rows = rows.filter(procedure=procedure)
+    if client_id is not None:
+        rows = rows.filter(client_id=client_id)
+    group_by = [dimension for dimension in DIMENSIONS if dimension in group_by]
+    rows = list(
+        rows.values(*group_by)
+        .annotate(cars_count=Sum('cars'), **{field: Sum(field) for field in AMOUNT_FIELDS})
+        .order_by(*group_by)
+    )
+    return label_rows(rows)
+
+
+def label_rows(rows):
+    # Названия складов и клиентов — одним запросом на измерение, только для попавших в отчёт id
+    names = {}
+    for dimension, model in (('warehouse_id', Warehouse), ('client_id', Client)):
+        ids = {row[dimension] for row in rows if row.get(dimension) is not None}
+        names[dimension] = dict(model.objects.filter(pk__in=ids).values_list('pk', 'name')) if ids else {}
+    procedures = dict(Car.PROCEDURE_CHOICES)
+    for row in rows:
+        row['cars'] = row.pop('cars_count')
+        labels = []
+        for dimension in DIMENSIONS:
+            if dimension not in row:
+                continue
+            value = row[dimension]
+            if dimension == 'month':
+                labels.append(value.strftime('%m.%Y'))
+            elif dimension == 'procedure':
+                labels.append(procedures.get(value, value))
+            else:
+                labels.append(names[dimension].get(value, '—' if value is None else f'#{value}'))
+        row['labels'] = labels
+    return rows
+
+
+def default_period(today=None):
+    today = today or timezone.localdate()
+    return date(today.year, 1, 1), today
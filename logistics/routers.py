@@ -0,0 +1,92 @@
+import sqlite3
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Чтение в запросах (списки админки, API, выгрузки, отчёты) идёт на реплику, запись — всегда на основную базу.
+# После первой записи запрос закреплён за основной базой до конца: реплика могла ещё не получить изменения.
+# Вне запроса (задачи Celery, команды) и внутри транзакции всё идёт на основную базу.
+REPLICA = 'replica'
+# Всё остальное считается записью. Границы транзакций сами ничего не пишут: SQLite выполняет BEGIN
+# в каждом atomic(), и без них read-only транзакция закрепляла бы пользователя за основной базой
+READ_PREFIXES = (
+    'SELECT', 'SAVEPOINT', 'RELEASE', 'ROLLBACK', 'EXPLAIN', 'SHOW', 'SET', 'PRAGMA',
+    'BEGIN', 'COMMIT', 'START TRANSACTION', 'END',
+)
+
+
+class Scope:
+    # Изменяемый объект, а не флаг в ContextVar: sync_to_async копирует контекст в потоки пула,
+    # и запись в потоке должна закрепить весь запрос
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+current = ContextVar('logistics_db_scope', default=None)
+
+
+@contextmanager
+def scope(pinned=False):
+    state = Scope(pinned)
+    token = current.set(state)
+    try:
+        yield state
+    finally:
+        current.reset(token)
+
+
+def replica_configured():
+    return REPLICA in connections.settings
+
+
+def read_alias():
+    state = current.get()
+    if state is None or state.pinned or not replica_configured():
+        return DEFAULT_DB_ALIAS
+    # Чтение внутри транзакции должно видеть её незакоммиченные записи
+    if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+    return REPLICA
+
+
+def track_writes(execute, sql, params, many, context):
+    state = current.get()
+    if state is not None and not state.wrote and not sql.lstrip().upper().startswith(READ_PREFIXES):
+        state.wrote = state.pinned = True
+    return execute(sql, params, many, context)
+
+
+def install(connection):
+    if connection.alias == DEFAULT_DB_ALIAS and track_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(track_writes)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика — копия основной базы, связи между объектами из обеих допустимы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплики приходит с репликацией
+        return db != REPLICA
+
+
+def copy_sqlite_replica(source=DEFAULT_DB_ALIAS, target=REPLICA):
+    # Локальная «репликация» для двух файлов SQLite: снимок основной базы через backup API.
+    # Между снимками реплика отстаёт так же, как настоящая
+    source, target = connections[source], connections[target]
+    source.ensure_connection()
+    target.close()
+    replica = sqlite3.connect(target.settings_dict['NAME'])
+    try:
+        source.connection.backup(replica)
+    finally:
+        replica.close()
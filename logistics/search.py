@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Car, CarSearchTerm, Client, Container
+
+# Поиск машин по VIN, марке и клиенту. Бэкенд выбирается настройкой LOGISTICS_SEARCH_BACKEND:
+#   icontains — прежнее поведение админки (LIKE '%...%' по таблицам с JOIN), оставлен для сравнения;
+#   suffix    — таблица суффиксов VIN и марки (CarSearchTerm), работает на любой базе;
+#   trigram   — PostgreSQL: те же icontains, но по GIN-индексам pg_trgm из миграции 0014.
+# Клиенты ищутся подзапросом по небольшой таблице клиентов и дальше по индексу car.client_id.
+
+MIN_TERM_LENGTH = 3
+INDEX_CHUNK_SIZE = 2000
+
+
+def car_terms(vin, make):
+    # Все суффиксы от MIN_TERM_LENGTH символов: любая подстрока — начало одного из них
+    terms = set()
+    for value in (vin.upper(), (make or '').upper()):
+        terms.update(value[i:] for i in range(len(value) - MIN_TERM_LENGTH + 1))
+    return terms
+
+
+def prefix_q(field, prefix):
+    if connection.vendor == 'postgresql':
+        # LIKE 'ABC%' по индексу с varchar_pattern_ops
+        return Q(**{f'{field}__startswith': prefix})
+    # В SQLite LIKE регистронезависим и индекс не использует, а диапазон — использует
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + '\uffff'})
+
+
+def client_ids(term):
+    return Client.objects.filter(name__icontains=term).values('pk')
+
+
+class IcontainsBackend:
+    def vin_car_ids(self, term):
+        return Car.objects.filter(vin__icontains=term).values('pk')
+
+    def car_ids(self, term):
+        return Car.objects.filter(Q(vin__icontains=term) | Q(make__icontains=term) | Q(client__name__icontains=term)).values('pk')
+
+    def index_cars(self, cars):
+        pass
+
+
+class TrigramBackend(IcontainsBackend):
+    # Запросы те же, что у icontains: UPPER(vin::text) LIKE UPPER('%...%') подхватывает GIN-индекс
+    def car_ids(self, term):
+        return Car.objects.filter(
+            Q(vin__icontains=term) | Q(make__icontains=term) | Q(client_id__in=client_ids(term))
+        ).values('pk')
+
+
+class SuffixBackend:
+    def term_car_ids(self, term):
+        return CarSearchTerm.objects.filter(prefix_q('term', term.upper())).values('car_id')
+
+    def vin_car_ids(self, term):
+        if len(term) < MIN_TERM_LENGTH:
+            return IcontainsBackend().vin_car_ids(term)
+        # Совпадение по суффиксу марки отсеивается проверкой самого VIN у найденных машин
+        return Car.objects.filter(pk__in=self.term_car_ids(term), vin__icontains=term).values('pk')
+
+    def car_ids(self, term):
+        if len(term) < MIN_TERM_LENGTH:
+            return IcontainsBackend().car_ids(term)
+        return Car.objects.filter(Q(pk__in=self.term_car_ids(term)) | Q(client_id__in=client_ids(term))).values('pk')
+
+    def index_cars(self, cars):
+        last_pk = 0
+        while chunk := list(cars.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'vin', 'make')[:INDEX_CHUNK_SIZE]):
+            last_pk = chunk[-1][0]
+            CarSearchTerm.objects.filter(car_id__in=[pk for pk, _, _ in chunk]).delete()
+            CarSearchTerm.objects.bulk_create(
+                [CarSearchTerm(car_id=pk, term=term) for pk, vin, make in chunk for term in car_terms(vin, make)],
+                batch_size=5000,
+            )
+
+
+BACKENDS = {
+    'icontains': IcontainsBackend,
+    'suffix': SuffixBackend,
+    'trigram': TrigramBackend,
+}
+
+
+def get_backend(name=None):
+    return BACKENDS[name or getattr(settings, 'LOGISTICS_SEARCH_BACKEND', 'suffix')]()
+
+
+def search_cars(queryset, term, backend=None):
+    term = term.strip()
+    if not term:
+        return queryset
+    return queryset.filter(pk__in=get_backend(backend).car_ids(term))
+
+
+def search_payments(queryset, term, backend=None):
+    term = term.strip()
+    if not term:
+        return queryset
+    return queryset.filter(
+        Q(car_id__in=get_backend(backend).vin_car_ids(term))
+        | Q(container_id__in=Container.objects.filter(number__icontains=term).values('pk'))
+    )
+
+
+def index_cars(cars):
+    get_backend().index_cars(cars)
@@ -0,0 +1,182 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .allocation import allocate, write_allocations
+from .events import record_car_events, record_events
+from .models import Car, Client, Container, Invoice, Payment, StatusEvent, Warehouse
+
+
+def propagate_container_status(containers):
+    # Переносим статус контейнеров на их машины и раскладываем THS.
+    # Число запросов не зависит от количества контейнеров и машин.
+    containers = [c for c in containers if c.pk]
+    if not containers:
+        return
+
+    ids_by_status = defaultdict(list)
+    for container in containers:
+        ids_by_status[container.status].append(container.pk)
+
+    # Склады, с которых статус контейнера снимет машины со статусом «На складе»
+    emptied = set(
+        Car.objects.filter(container_id__in=[c.pk for c in containers], storage_status='in_warehouse')
+        .exclude(warehouse__isnull=True)
+        .values_list('warehouse_id', flat=True)
+        .distinct()
+    )
+    now = timezone.now()
+    for status, ids in ids_by_status.items():
+        # Машины, которые уже в этом статусе, не трогаем: ни UPDATE, ни события
+        cars = Car.objects.filter(container_id__in=ids).exclude(storage_status=status)
+        if status != 'sailing':
+            cars = cars.exclude(storage_status='delivered')
+        record_car_events(cars, status, now)
+        cars.update(storage_status=status)
+    if emptied:
+        refresh_warehouse_occupancy(Warehouse.objects.filter(pk__in=emptied))
+
+    arrived = [c for c in containers if c.status == 'arrived' and c.ths is not None]
+    if arrived:
+        split_container_ths(arrived)
+
+
+def split_container_ths(containers):
+    # Раскладка по стратегиям контейнеров (logistics/allocation.py) и запись одним bulk_update
+    allocations = allocate(containers)
+    if not allocations:
+        return 0
+    updated = write_allocations(allocations)
+    recalculate_invoice_amounts(Invoice.objects.filter(cars__container_id__in=allocations))
+    # Car.save() подставляет склад контейнера, если у машины он не указан
+    Car.objects.filter(container_id__in=allocations, warehouse__isnull=True).update(
+        warehouse_id=Subquery(Container.objects.filter(pk=OuterRef('container_id')).values('warehouse_id')[:1])
+    )
+    return updated
+
+
+@transaction.atomic
+def transition_containers(containers, status):
+    containers = list(containers.select_for_update().only('id', 'number', 'status', 'ths', 'ths_strategy', 'warehouse_id'))
+    if status == 'arrived':
+        missing = [c.number for c in containers if c.ths is None or c.ths <= 0]
+        if missing:
+            raise ValidationError(
+                f"Поле THS обязательно для заполнения и должно быть больше 0 при статусе 'Прибыл': {', '.join(missing)}"
+            )
+
+    record_events(StatusEvent.CONTAINER, ((c.pk, status, c.warehouse_id) for c in containers if c.status != status))
+    Container.objects.filter(pk__in=[c.pk for c in containers]).update(status=status)
+    for container in containers:
+        container.status = status
+    propagate_container_status(containers)
+    return len(containers)
+
+
+def invoice_amount_expression():
+    amounts = (
+        Invoice.cars.through.objects.filter(invoice_id=OuterRef('pk'))
+        .order_by()
+        .values('invoice_id')
+        .annotate(amount=Sum('car__total'))
+        .values('amount')
+    )
+    return Coalesce(
+        Subquery(amounts[:1]),
+        Value(Decimal('0.00')),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+def recalculate_invoice_amounts(invoices=None, include_paid=False):
+    # Пересчёт суммы счетов одним UPDATE с подзапросом, без загрузки машин в Python.
+    # Оплаченные счета заморожены: их сумма и начисление в журнале закрыты оплатой
+    if invoices is None:
+        invoices = Invoice.objects.all()
+    invoices = Invoice.objects.filter(pk__in=invoices.values('pk'))
+    if not include_paid:
+        invoices = invoices.exclude(status='paid')
+    return invoices.update(amount=invoice_amount_expression())
+
+
+def annotate_balances(clients, today=None):
+    # Долг клиента по просроченным неоплаченным счетам и по неоплаченным платежам за его машины — одним запросом
+    today = today or timezone.now().date()
+    money = DecimalField(max_digits=12, decimal_places=2)
+    invoices = (
+        Invoice.objects.filter(client=OuterRef('pk'), status__in=['unpaid', 'overdue'], due_date__lte=today)
+        .order_by()
+        .values('client')
+        .annotate(due=Sum('amount'))
+        .values('due')
+    )
+    payments = (
+        Payment.objects.filter(car__client=OuterRef('pk'), status__in=['pending', 'overdue'])
+        .order_by()
+        .values('car__client')
+        .annotate(due=Sum(F('amount_due') - F('amount_paid')))
+        .values('due')
+    )
+    return clients.annotate(
+        invoices_due=Coalesce(Subquery(invoices[:1]), Value(Decimal('0')), output_field=money),
+        payments_due=Coalesce(Subquery(payments[:1]), Value(Decimal('0')), output_field=money),
+    )
+
+
+def outstanding_balances(today=None):
+    return (
+        annotate_balances(Client.objects.all(), today)
+        .filter(Q(invoices_due__gt=0) | Q(payments_due__gt=0))
+        .exclude(email='')
+    )
+
+
+@transaction.atomic
+def sweep_overdue(today=None):
+    # Перевод в просрочку одним UPDATE на таблицу; число запросов не зависит от размера таблиц.
+    # Счёт просрочен после due_date, платёж — через PAYMENT_DUE_DAYS дней после выставления.
+    today = today or timezone.now().date()
+    payment_deadline = today - timedelta(days=getattr(settings, 'PAYMENT_DUE_DAYS', 30))
+    invoices = Invoice.objects.filter(status='unpaid', due_date__lt=today).update_returning(status='overdue')
+    payments = (
+        Payment.objects.filter(status='pending', payment_date__lt=payment_deadline, amount_paid__lt=F('amount_due'))
+        .update_returning(status='overdue')
+    )
+    return {'invoices': invoices, 'payments': payments}
+
+
+@transaction.atomic
+def mark_invoices_paid(invoices):
+    # Оплата счетов закрывает и неоплаченные платежи за машины из этих счетов
+    invoice_ids = invoices.exclude(status='paid').update_returning(status='paid')
+    payment_ids = (
+        Payment.objects.filter(car__invoices__in=invoice_ids, status__in=['pending', 'overdue'])
+        .update_returning(status='paid', amount_paid=F('amount_due'), is_partial=False)
+    ) if invoice_ids else []
+    return {'invoices': invoice_ids, 'payments': payment_ids}
+
+
+def warehouse_occupancy_expression():
+    occupied = (
+        Car.objects.filter(warehouse_id=OuterRef('pk'), storage_status='in_warehouse')
+        .order_by()
+        .values('warehouse_id')
+        .annotate(n=Count('id'))
+        .values('n')
+    )
+    return Coalesce(Subquery(occupied[:1]), Value(0))
+
+
+def refresh_warehouse_occupancy(warehouses=None):
+    # Пересчёт счётчиков занятых мест одним UPDATE; возвращает число складов, где счётчик разошёлся с фактом
+    if warehouses is None:
+        warehouses = Warehouse.objects.all()
+    drifted = warehouses.annotate(actual=warehouse_occupancy_expression()).exclude(occupied=F('actual'))
+    return Warehouse.objects.filter(pk__in=drifted.values('pk')).update(occupied=warehouse_occupancy_expression())
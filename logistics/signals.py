@@ -0,0 +1,220 @@
+import time
+from decimal import Decimal
+
+from celery.signals import task_postrun, task_prerun
+from django.db.models import DecimalField, F, Func, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db import transaction
+from django.core.signals import request_finished
+from django.db.backends.signals import connection_created
+from django.db.models import Sum
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import cache, ledger, metrics, routers, search
+from .models import Car, Client, Container, Invoice, LedgerEntry, Payment, Warehouse, queryset_updated
+from .services import recalculate_invoice_amounts
+
+
+def cars_total(pk_set):
+    # SUM без GROUP BY, чтобы разница считалась прямо внутри UPDATE
+    totals = Car.objects.filter(pk__in=pk_set).order_by().values(s=Func(F('total'), function='SUM'))
+    return Coalesce(Subquery(totals), Value(Decimal('0.00')), output_field=DecimalField(max_digits=10, decimal_places=2))
+
+
+@receiver(m2m_changed, sender=Invoice.cars.through)
+def invoice_cars_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Оплаченные счета заморожены, как и в recalculate_invoice_amounts
+    if action == 'post_add' and pk_set:
+        # В pk_set приходят только действительно добавленные связи
+        if reverse:
+            Invoice.objects.filter(pk__in=pk_set).exclude(status='paid').update(
+                amount=F('amount') + cars_total([instance.pk])
+            )
+        else:
+            Invoice.objects.filter(pk=instance.pk).exclude(status='paid').update(amount=F('amount') + cars_total(pk_set))
+    elif action == 'post_remove' and pk_set:
+        # В pk_set могут быть id, которых не было в счёте, поэтому пересчитываем затронутые счета
+        if reverse:
+            recalculate_invoice_amounts(Invoice.objects.filter(pk__in=pk_set))
+        else:
+            recalculate_invoice_amounts(Invoice.objects.filter(pk=instance.pk))
+    elif action == 'pre_clear' and reverse:
+        instance._cleared_invoice_ids = list(instance.invoices.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        if reverse:
+            recalculate_invoice_amounts(Invoice.objects.filter(pk__in=getattr(instance, '_cleared_invoice_ids', [])))
+        else:
+            Invoice.objects.filter(pk=instance.pk).exclude(status='paid').update(amount=0)
+
+
+@receiver(pre_delete, sender=Car)
+def car_deleting_invoices(sender, instance, **kwargs):
+    # Связи со счетами удаляются каскадом без m2m_changed: запоминаем счета, пока связи ещё есть
+    instance._deleted_invoice_ids = list(Invoice.objects.filter(cars=instance).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Car)
+def car_deleted_invoices(sender, instance, **kwargs):
+    invoice_ids = getattr(instance, '_deleted_invoice_ids', None)
+    if invoice_ids:
+        recalculate_invoice_amounts(Invoice.objects.filter(pk__in=invoice_ids))
+
+
+@receiver(post_delete, sender=Car)
+def car_deleted(sender, instance, **kwargs):
+    if instance.storage_status == 'in_warehouse' and instance.warehouse_id:
+        Warehouse.objects.filter(pk=instance.warehouse_id).update(occupied=Greatest(F('occupied') - 1, Value(0)))
+
+
+# Инвалидация кэша: одиночные изменения сбрасывают версии конкретных клиентов и контейнеров,
+# массовые update() — пространства, зависящие от изменённых полей
+
+@receiver(post_save, sender=Car)
+def car_saved_cache(sender, instance, created, **kwargs):
+    # post_save приходит до того, как save() запомнит новые значения: has_changed() сравнивает со старыми
+    if created or instance.has_changed('storage_status'):
+        cache.invalidate('car_status_counts')
+    if created or instance.has_changed('container_id', 'vin', 'make', 'client_id', 'storage_status', 'date_stored',
+                                       *Car.COST_FIELDS):
+        cache.invalidate('container_cars', [instance.container_id, instance.original('container_id')])
+    if instance.has_changed('client_id'):
+        cache.invalidate('client_balance', [instance.client_id, instance.original('client_id')])
+
+
+@receiver(post_delete, sender=Car)
+def car_deleted_cache(sender, instance, **kwargs):
+    cache.invalidate('car_status_counts')
+    cache.invalidate('container_cars', [instance.container_id])
+    cache.invalidate('client_balance', [instance.client_id])
+
+
+@receiver(post_save, sender=Container)
+@receiver(post_delete, sender=Container)
+def container_changed_cache(sender, instance, **kwargs):
+    cache.invalidate('container_cars', [instance.pk])
+
+
+@receiver(post_save, sender=Client)
+def client_saved_cache(sender, instance, created, **kwargs):
+    # Имя клиента лежит в кэше машин контейнера
+    if not created and instance.has_changed('name'):
+        cache.invalidate('container_cars', Car.objects.filter(client=instance).values_list('container_id', flat=True))
+
+
+@receiver(post_save, sender=Invoice)
+def invoice_saved_cache(sender, instance, created, **kwargs):
+    if created or instance.has_changed('client_id', 'amount', 'status', 'due_date'):
+        cache.invalidate('client_balance', [instance.client_id, instance.original('client_id')])
+
+
+@receiver(post_delete, sender=Invoice)
+def invoice_deleted_cache(sender, instance, **kwargs):
+    cache.invalidate('client_balance', [instance.client_id])
+
+
+def invalidate_payment_clients(car_ids):
+    car_ids = [car_id for car_id in car_ids if car_id]
+    if car_ids:
+        cache.invalidate('client_balance', Car.objects.filter(pk__in=car_ids).values_list('client_id', flat=True))
+
+
+@receiver(post_save, sender=Payment)
+def payment_saved_cache(sender, instance, created, **kwargs):
+    if created or instance.has_changed('car_id', 'amount_due', 'amount_paid', 'status'):
+        invalidate_payment_clients({instance.car_id, instance.original('car_id')})
+
+
+@receiver(post_delete, sender=Payment)
+def payment_deleted_cache(sender, instance, **kwargs):
+    invalidate_payment_clients([instance.car_id])
+
+
+@receiver(m2m_changed, sender=Invoice.cars.through)
+def invoice_cars_changed_cache(sender, instance, action, reverse, **kwargs):
+    # Сумма счёта меняется через update() и уже инвалидирует долги; здесь — точечно, если клиент известен
+    if action.startswith('post_') and not reverse:
+        cache.invalidate('client_balance', [instance.client_id])
+
+
+@receiver(queryset_updated)
+def queryset_updated_cache(sender, fields, **kwargs):
+    cache.invalidate_fields(sender, fields)
+
+
+@receiver(post_save, sender=Car)
+def car_saved_search(sender, instance, created, **kwargs):
+    if created or instance.has_changed('vin', 'make'):
+        search.index_cars(Car.objects.filter(pk=instance.pk))
+
+
+# Журнал расчётов: начисления по счетам и оплаты подтягиваются при каждом изменении суммы
+
+@receiver(post_save, sender=Invoice)
+def invoice_saved_ledger(sender, instance, created, **kwargs):
+    if created or instance.has_changed('amount', 'client_id'):
+        ledger.sync_invoice_charges(Invoice.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Payment)
+def payment_saved_ledger(sender, instance, created, **kwargs):
+    if created or instance.has_changed('amount_paid', 'car_id'):
+        ledger.sync_payment_credits(Payment.objects.filter(pk=instance.pk))
+
+
+@receiver(queryset_updated)
+def queryset_updated_ledger(sender, fields, queryset, **kwargs):
+    if sender is Invoice and fields & {'amount', 'client', 'client_id'}:
+        ledger.sync_invoice_charges(queryset)
+    elif sender is Payment and fields & {'amount_paid', 'car', 'car_id'}:
+        ledger.sync_payment_credits(queryset)
+
+
+@receiver(pre_delete, sender=Invoice)
+@receiver(pre_delete, sender=Payment)
+def document_deleted_ledger(sender, instance, **kwargs):
+    # Сторно проводится после коммита: если вместе с документом удаляют и клиента, сторнировать некому
+    field = 'invoice' if sender is Invoice else 'payment'
+    totals = list(
+        LedgerEntry.objects.filter(**{field: instance}).values('client_id', 'kind', 'payment_type')
+        .annotate(total=Sum('amount')).order_by()
+    )
+    if totals:
+        transaction.on_commit(lambda: ledger.post_entries([
+            LedgerEntry(client_id=row['client_id'], kind=row['kind'], payment_type=row['payment_type'],
+                        amount=-row['total'])
+            for row in totals
+        ]))
+
+
+@receiver(connection_created)
+def connection_created_metrics(sender, connection, **kwargs):
+    metrics.install(connection)
+    routers.install(connection)
+
+
+# task_id -> (токен контекста, сборщик, время старта); prerun и postrun приходят в том же потоке, что и задача
+running_tasks = {}
+
+
+@task_prerun.connect
+def task_started_metrics(task_id, task, **kwargs):
+    collector = metrics.Collector()
+    running_tasks[task_id] = (metrics.current.set(collector), collector, time.perf_counter())
+
+
+@task_postrun.connect
+def task_finished_metrics(task_id, task, state=None, **kwargs):
+    started = running_tasks.pop(task_id, None)
+    if started is None:
+        return
+    token, collector, started_at = started
+    metrics.current.reset(token)
+    metrics.record('task', {'task': task.name, 'state': state or 'UNKNOWN'}, time.perf_counter() - started_at, collector)
+    metrics.maybe_flush()
+
+
+@receiver(request_finished)
+def request_finished_metrics(sender, **kwargs):
+    # request_finished приходит, когда ответ уже отдан клиенту
+    metrics.maybe_flush()
@@ -1,24 +1,84 @@
-from datetime import datetime# logistics/tasks.py
-from celery import shared_task
-from django.core.mail import send_mail
-from .models import Client, Payment
+# logistics/tasks.py
+from decimal import Decimal
+
+from celery import group, shared_task
+from django.core.mail import get_connection, send_mass_mail
+
+from . import billing, events, ledger, reports
+from .services import outstanding_balances, refresh_warehouse_occupancy, sweep_overdue
+
+REMINDER_CHUNK_SIZE = 500
+
 
 @shared_task
 def send_payment_reminder():
-    # Получаем всех клиентов, у которых есть неоплаченные счета
-    clients_with_due_payments = Client.objects.filter(
-        payments__status='unpaid',
-        payments__due_date__lte=datetime.now()
-    ).distinct()
+    # Один агрегирующий запрос по всем должникам, дальше рассылка пачками в отдельных задачах
+    balances = [
+        [client_id, email, str(invoices_due), str(payments_due)]
+        for client_id, email, invoices_due, payments_due in outstanding_balances()
+        .order_by('pk')
+        .values_list('pk', 'email', 'invoices_due', 'payments_due')
+    ]
+    chunks = [balances[i:i + REMINDER_CHUNK_SIZE] for i in range(0, len(balances), REMINDER_CHUNK_SIZE)]
+    if chunks:
+        group(send_payment_reminder_chunk.s(chunk) for chunk in chunks).apply_async()
+    return len(balances)
 
-    for client in clients_with_due_payments:
-        unpaid_payments = Payment.objects.filter(client=client, status='unpaid')
 
-        # Отправляем напоминание клиенту
-        send_mail(
+@shared_task
+def send_payment_reminder_chunk(balances):
+    messages = []
+    for client_id, email, invoices_due, payments_due in balances:
+        invoices_due, payments_due = Decimal(invoices_due), Decimal(payments_due)
+        messages.append((
             'Напоминание о неоплаченных счетах',
-            f'У вас есть неоплаченные счета на сумму: {sum([payment.amount for payment in unpaid_payments])}. Пожалуйста, оплатите их как можно скорее.',
+            f'У вас есть неоплаченные счета на сумму: {invoices_due + payments_due} USD '
+            f'(по счетам: {invoices_due}, по платежам: {payments_due}). '
+            f'Пожалуйста, оплатите их как можно скорее.',
             'no-reply@yourapp.com',
-            [client.email],
-            fail_silently=False,
-        )
\ No newline at end of file
+            [email],
+        ))
+    # Одно SMTP-соединение на всю пачку
+    return send_mass_mail(messages, fail_silently=False, connection=get_connection())
+
+
+@shared_task
+def accrue_storage_charges():
+    # Ночное начисление DAYS по тарифам складов
+    return billing.accrue_storage_charges()
+
+
+@shared_task
+def reconcile_warehouse_occupancy():
+    # Исправляет расхождения счётчиков занятых мест с фактическим числом машин
+    return refresh_warehouse_occupancy()
+
+
+@shared_task
+def sweep_overdue_accounts():
+    # id просроченных счетов и платежей возвращаются для последующих уведомлений
+    return sweep_overdue()
+
+
+@shared_task
+def rollup_status_events():
+    # Ночная свёртка журнала статусов за вчерашний день в DwellRollup
+    return events.rollup_dwell_times()
+
+
+@shared_task
+def sync_ledger():
+    # Страховка для изменений в обход сигналов (raw SQL, bulk_create): проводит недостающие разницы
+    return ledger.sync_ledger()
+
+
+@shared_task
+def rollup_revenue():
+    # Свёртка расходов по машинам за текущий месяц и за месяцы, где что-то менялось
+    return reports.refresh_revenue_rollups()
+
+
+@shared_task
+def rebuild_revenue_rollups():
+    # Полная пересборка: подбирает удалённые машины и машины, перешедшие в другой месяц
+    return reports.rollup_revenue()
@@ -1,3 +1,1443 @@
-from django.test import TestCase
+import csv
+import os
+import tempfile
+import threading
+import zipfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+from xml.etree import ElementTree
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache as django_cache
+from django.core.exceptions import ValidationError
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import Sum
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import async_views, cache, metrics, routers, search
+from .allocation import allocate, distribute
+from .async_views import dashboard_queries, run_concurrently, run_sequentially
+from .billing import accrue_storage_charges, storage_charge
+from .events import average_dwell, rollup_dwell_times
+from .ledger import balance_at, statement, sync_ledger
+from .middleware import ReplicaMiddleware
+from .pdf import render_invoices
+from .query_plans import full_scans
+from .reports import refresh_revenue_rollups, revenue_report, rollup_revenue
+from .models import (
+    Car, Client, Container, DwellRollup, Invoice, LedgerEntry, Payment, RevenueRollup, StatusEvent, Warehouse,
+    WarehouseRate,
+)
+from .services import (
+    mark_invoices_paid, outstanding_balances, refresh_warehouse_occupancy, split_container_ths, sweep_overdue,
+    transition_containers,
+)
+from .tasks import reconcile_warehouse_occupancy, send_payment_reminder_chunk
+
+# Админка в тестах рендерится без manifest-файла collectstatic
+plain_static_storage = override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+
+
+def make_client(name='Client', email='c@example.com'):
+    return Client.objects.create(name=name, email=email, phone='1', address='-')
+
+
+def make_admin():
+    return User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+
+def make_staff():
+    return User.objects.create_user('staff', password='password', is_staff=True)
+
+
+def make_container(number, cars=0, client=None, warehouse=None, **kwargs):
+    kwargs.setdefault('status', 'sailing')
+    container = Container.objects.create(number=number, arrival_date=date(2025, 3, 1), warehouse=warehouse, **kwargs)
+    Car.objects.bulk_create([
+        Car(vin=f'{number}-{i}', make='Toyota', client=client, container=container, storage_status='sailing')
+        for i in range(cars)
+    ])
+    return container
+
+
+class ContainerTransitionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj = make_client()
+        cls.warehouse = Warehouse.objects.create(name='W1', location='-', capacity=100)
+
+    def test_arrival_splits_ths_and_recomputes_total(self):
+        container = make_container('C1', cars=3, client=self.client_obj, warehouse=self.warehouse, ths=Decimal('300'))
+        Car.objects.filter(container=container).update(sklad=Decimal('10'))
+
+        transition_containers(Container.objects.filter(pk=container.pk), 'arrived')
+
+        container.refresh_from_db()
+        self.assertEqual(container.status, 'arrived')
+        for car in container.cars.all():
+            self.assertEqual(car.storage_status, 'arrived')
+            self.assertEqual(car.ths, Decimal('100.00'))
+            self.assertEqual(car.total, Decimal('110.00'))
+            self.assertEqual(car.warehouse, self.warehouse)
+
+    def test_delivered_cars_keep_status(self):
+        container = make_container('C1', cars=2, ths=Decimal('100'))
+        delivered = container.cars.first()
+        Car.objects.filter(pk=delivered.pk).update(storage_status='delivered')
+
+        transition_containers(Container.objects.filter(pk=container.pk), 'unloaded')
+
+        delivered.refresh_from_db()
+        self.assertEqual(delivered.storage_status, 'delivered')
+        self.assertEqual(container.cars.filter(storage_status='unloaded').count(), 1)
+
+    def test_arrival_requires_ths(self):
+        container = make_container('C1', cars=1)
+        with self.assertRaises(ValidationError):
+            transition_containers(Container.objects.filter(pk=container.pk), 'arrived')
+        container.refresh_from_db()
+        self.assertEqual(container.status, 'sailing')
+
+    def test_query_count_does_not_grow_with_containers(self):
+        for i in range(2):
+            make_container(f'A{i}', cars=2, ths=Decimal('50'))
+        with CaptureQueriesContext(connection) as small:
+            transition_containers(Container.objects.filter(number__startswith='A'), 'arrived')
+
+        for i in range(20):
+            make_container(f'B{i}', cars=5, ths=Decimal('50'))
+        with CaptureQueriesContext(connection) as large:
+            transition_containers(Container.objects.filter(number__startswith='B'), 'arrived')
+
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(Car.objects.filter(container__number__startswith='B', ths=Decimal('10')).count(), 100)
+
+
+class ImportManifestTests(TestCase):
+    def import_file(self, content, suffix='.csv'):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, encoding='utf-8') as f:
+            f.write(content)
+        self.addCleanup(os.unlink, f.name)
+        call_command('import_manifest', f.name, stdout=StringIO(), stderr=StringIO())
+
+    def test_creates_and_updates_cars(self):
+        warehouse = Warehouse.objects.create(name='W1', location='-', capacity=10)
+        self.import_file(
+            'vin,make,client,container,arrival_date,warehouse,ths,sklad\n'
+            'VIN1,Toyota,Acme,CONT1,2025-03-01,W1,10,5\n'
+            'VIN2,Honda,Acme,CONT1,2025-03-01,,1,1\n'
+        )
+        self.import_file('{"vin": "VIN1", "prof": "2.5"}\n', suffix='.jsonl')
+
+        car = Car.objects.get(vin='VIN1')
+        self.assertEqual((car.ths, car.prof, car.total), (Decimal('10'), Decimal('2.5'), Decimal('17.5')))
+        self.assertEqual(car.client.name, 'Acme')
+        self.assertEqual(car.container.number, 'CONT1')
+        self.assertEqual(Car.objects.get(vin='VIN2').warehouse, warehouse)
+        self.assertEqual(Client.objects.count(), 1)
+
+    def test_repeated_vin_in_chunk_is_merged(self):
+        # В одном UPSERT каждая машина должна встречаться один раз
+        with patch.object(Car.objects, 'bulk_create', side_effect=Car.objects.bulk_create) as bulk_create:
+            self.import_file(
+                'vin,make,client,container,arrival_date,ths,prof\n'
+                'VIN1,Toyota,Acme,CONT1,2025-03-01,10,\n'
+                'vin1,Honda,,,,,2\n'
+                'VIN2,Honda,Acme,CONT1,2025-03-01,1,1\n'
+                'VIN1,,,,,3,\n'
+            )
+        vins = [car.vin for call in bulk_create.call_args_list for car in call.args[0]]
+        self.assertEqual(sorted(vins), ['VIN1', 'VIN2'])
+
+        car = Car.objects.get(vin='VIN1')
+        self.assertEqual((car.make, car.ths, car.prof), ('Honda', Decimal('3'), Decimal('2')))
+        self.assertEqual((car.client.name, car.container.number), ('Acme', 'CONT1'))
+
+
+class InvoiceAmountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj = make_client()
+        cls.invoice = Invoice.objects.create(client=cls.client_obj, due_date=date(2025, 4, 1))
+        cls.cars = [
+            Car.objects.create(vin=f'VIN{i}', make='Toyota', client=cls.client_obj, storage_status='in_port',
+                               ths=Decimal('10'), sklad=Decimal(i), days_cost=Decimal('0'), prof=Decimal('0'))
+            for i in range(3)
+        ]
+
+    def amount(self):
+        self.invoice.refresh_from_db(fields=['amount'])
+        return self.invoice.amount
+
+    def test_m2m_changes_apply_deltas(self):
+        self.invoice.cars.add(*self.cars[:2])
+        self.assertEqual(self.amount(), Decimal('21'))
+        self.cars[2].invoices.add(self.invoice)
+        self.assertEqual(self.amount(), Decimal('33'))
+        self.invoice.cars.remove(self.cars[0])
+        self.assertEqual(self.amount(), Decimal('23'))
+        self.cars[1].invoices.clear()
+        self.assertEqual(self.amount(), Decimal('12'))
+        self.invoice.cars.clear()
+        self.assertEqual(self.amount(), Decimal('0'))
+
+    def test_reverse_add_uses_stored_total(self):
+        # Сумма машины в памяти устарела: в счёт идёт сумма из базы
+        Car.objects.filter(pk=self.cars[0].pk).update(prof=Decimal('5'))
+        self.cars[0].invoices.add(self.invoice)
+        self.assertEqual(self.amount(), Decimal('15'))
+
+    def test_paid_invoices_are_frozen(self):
+        container = make_container('C1', ths=Decimal('100'))
+        Car.objects.filter(pk__in=[car.pk for car in self.cars]).update(container=container)
+        paid = Invoice.objects.create(client=self.client_obj, due_date=date(2025, 4, 1))
+        paid.cars.add(*self.cars)
+        Invoice.objects.filter(pk=paid.pk).update(status='paid')
+        self.invoice.cars.add(*self.cars)
+        balance = Client.objects.get(pk=self.client_obj.pk).balance
+
+        # Раскладка THS при прибытии, правка расходов машины и изменение состава счёта
+        transition_containers(Container.objects.filter(pk=container.pk), 'arrived')
+        car = Car.objects.get(pk=self.cars[0].pk)
+        car.prof = Decimal('5')
+        car.save()
+        self.cars[1].invoices.remove(paid)
+        paid.cars.add(self.cars[1])
+
+        paid.refresh_from_db()
+        self.assertEqual((paid.amount, paid.status), (Decimal('33'), 'paid'))
+        self.assertEqual(self.amount(), Decimal('108'))
+        self.assertEqual(Client.objects.get(pk=self.client_obj.pk).balance, balance + Decimal('108') - Decimal('33'))
+
+    def test_deleting_cars_recalculates_invoices(self):
+        other = Invoice.objects.create(client=self.client_obj, due_date=date(2025, 4, 1))
+        self.invoice.cars.add(*self.cars)
+        other.cars.add(self.cars[0])
+        self.cars[0].delete()
+        self.assertEqual(self.amount(), Decimal('23'))
+        other.refresh_from_db()
+        self.assertEqual(other.amount, Decimal('0'))
+        Car.objects.filter(pk=self.cars[1].pk).delete()
+        self.assertEqual(self.amount(), Decimal('12'))
+
+    def test_car_total_change_updates_every_invoice(self):
+        others = [Invoice.objects.create(client=self.client_obj, due_date=date(2025, 4, 1)) for _ in range(4)]
+        self.invoice.cars.add(*self.cars)
+        for other in others:
+            other.cars.add(self.cars[0])
+
+        def edit(car, prof):
+            car = Car.objects.get(pk=car.pk)
+            car.prof = prof
+            with CaptureQueriesContext(connection) as queries:
+                car.save()
+            return car, len(queries)
+
+        # Число запросов не растёт с числом счетов машины: одна машина в одном счёте, другая — в пяти
+        _, single = edit(self.cars[1], Decimal('1'))
+        car, many = edit(self.cars[0], Decimal('5'))
+        self.assertEqual(many, single)
+
+        self.assertEqual(self.amount(), Decimal('39'))
+        for other in others:
+            other.refresh_from_db()
+            self.assertEqual(other.amount, Decimal('15'))
+        self.assertEqual(Client.objects.get(pk=self.client_obj.pk).balance, Decimal('39') + 4 * Decimal('15'))
+        # total считает база; устаревшее значение в экземпляре перечитывается при обращении
+        self.assertEqual(car.total, Decimal('15'))
+
+    def test_consecutive_cost_edits_update_invoice(self):
+        self.invoice.cars.add(self.cars[0])
+        car = Car.objects.get(pk=self.cars[0].pk)
+        car.ths = Decimal('20')
+        car.save()
+        self.assertEqual(self.amount(), Decimal('20'))
+        car.prof = Decimal('5')
+        car.save()
+        self.assertEqual(self.amount(), Decimal('25'))
+
+        car = Car.objects.defer('total').get(pk=self.cars[0].pk)
+        car.sklad = Decimal('1')
+        car.save()
+        self.assertEqual(self.amount(), Decimal('26'))
+
+        car = Car.objects.only('vin').get(pk=self.cars[0].pk)
+        car.prof = Decimal('0')
+        car.save(update_fields=['prof'])
+        self.assertEqual(self.amount(), Decimal('21'))
+
+    def test_total_follows_bulk_cost_updates(self):
+        Car.objects.filter(pk__in=[car.pk for car in self.cars]).update(prof=Decimal('1'))
+        self.assertEqual(
+            list(Car.objects.order_by('-total').values_list('vin', 'total')),
+            [('VIN2', Decimal('13')), ('VIN1', Decimal('12')), ('VIN0', Decimal('11'))],
+        )
+
+    def test_recalculate_command_repairs_drift(self):
+        self.invoice.cars.add(*self.cars)
+        Invoice.objects.update(amount=0)
+        call_command('recalculate_invoices', stdout=StringIO())
+        self.assertEqual(self.amount(), Decimal('33'))
+
+
+class StorageBillingTests(TestCase):
+    def test_storage_charge_tiers(self):
+        tiers = [(1, Decimal('5')), (11, Decimal('10'))]
+        self.assertEqual(storage_charge(3, 3, tiers), Decimal('0'))
+        self.assertEqual(storage_charge(15, 3, tiers), Decimal('85'))
+        self.assertEqual(storage_charge(15, 12, tiers), Decimal('30'))
+
+    def test_accrual_updates_cars_and_invoices_idempotently(self):
+        today = date(2025, 3, 20)
+        warehouse = Warehouse.objects.create(name='W1', location='-', capacity=10, free_days=3)
+        WarehouseRate.objects.bulk_create([
+            WarehouseRate(warehouse=warehouse, from_day=1, daily_rate=Decimal('5')),
+            WarehouseRate(warehouse=warehouse, from_day=11, daily_rate=Decimal('10')),
+        ])
+        client = make_client()
+        costs = dict(ths=Decimal('1'), sklad=Decimal('0'), days_cost=Decimal('0'), prof=Decimal('0'))
+        stored = Car.objects.create(vin='VIN1', make='Toyota', client=client, warehouse=warehouse,
+                                    storage_status='in_warehouse', date_stored=today - timedelta(days=15), **costs)
+        Car.objects.create(vin='VIN2', make='Toyota', client=client, warehouse=warehouse,
+                           storage_status='delivered', date_stored=today - timedelta(days=15), **costs)
+        invoice = Invoice.objects.create(client=client, due_date=today)
+        invoice.cars.add(stored)
+        paid = Invoice.objects.create(client=client, due_date=today)
+        paid.cars.add(stored)
+        Invoice.objects.filter(pk=paid.pk).update(status='paid')
+
+        self.assertEqual(accrue_storage_charges(today), 1)
+        self.assertEqual(accrue_storage_charges(today), 0)
+
+        stored.refresh_from_db()
+        invoice.refresh_from_db()
+        self.assertEqual((stored.days_cost, stored.total), (Decimal('85'), Decimal('86')))
+        self.assertEqual(invoice.amount, Decimal('86'))
+        # Оплаченный счёт и его начисление в журнале остаются прежними
+        paid.refresh_from_db()
+        self.assertEqual(paid.amount, Decimal('1'))
+        self.assertEqual(LedgerEntry.objects.filter(invoice=paid).aggregate(total=Sum('amount'))['total'], Decimal('1'))
+        self.assertEqual(Car.objects.get(vin='VIN2').days_cost, Decimal('0'))
+
+
+@plain_static_storage
+class CarChangelistTests(TestCase):
+    url = '/admin/logistics/car/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_admin()
+        cls.clients = Client.objects.bulk_create([
+            Client(name=f'Client {i}', email='c@example.com', phone='1', address='-') for i in range(10)
+        ])
+        cls.containers = Container.objects.bulk_create([
+            Container(number=f'C{i}', arrival_date=date(2025, 3, 1), status='stored') for i in range(10)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def create_cars(self, count, offset=0):
+        today = timezone.now().date()
+        Car.objects.bulk_create([
+            Car(vin=f'VIN{offset + i}', make='Toyota', client=self.clients[i % 10], container=self.containers[i % 10],
+                storage_status='in_warehouse', date_stored=today - timedelta(days=i % 120))
+            for i in range(count)
+        ], batch_size=1000)
+
+    def changelist_queries(self, params=''):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url + params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_is_constant(self):
+        self.create_cars(10)
+        _, small = self.changelist_queries()
+        self.create_cars(9990, offset=10)
+        _, large = self.changelist_queries()
+        self.assertEqual(small, large)
+
+    def test_days_are_sortable_and_filterable(self):
+        self.create_cars(40)
+        response, _ = self.changelist_queries('?o=3')
+        days = [car.days_on_warehouse for car in response.context['cl'].result_list]
+        self.assertEqual(days, sorted(days))
+        self.assertEqual(days[:3], [0, 1, 2])
+
+        response, _ = self.changelist_queries('?days=8-30')
+        days = {car.days_on_warehouse for car in response.context['cl'].result_list}
+        self.assertEqual(days, set(range(8, 31)))
+
+
+class PaymentReminderTests(TestCase):
+    def test_outstanding_balances_and_batched_mail(self):
+        today = date(2025, 3, 20)
+        debtor, payer, paid = Client.objects.bulk_create([
+            Client(name=name, email=f'{name}@example.com', phone='1', address='-') for name in ('debtor', 'payer', 'paid')
+        ])
+        Invoice.objects.bulk_create([
+            Invoice(client=debtor, due_date=today, amount=Decimal('100')),
+            Invoice(client=debtor, due_date=today + timedelta(days=1), amount=Decimal('50')),
+            Invoice(client=paid, due_date=today, amount=Decimal('70'), status='paid'),
+        ])
+        car = Car.objects.create(vin='VIN1', make='Toyota', client=payer, storage_status='in_port',
+                                 ths=Decimal('0'), sklad=Decimal('0'), days_cost=Decimal('0'), prof=Decimal('0'))
+        Payment.objects.create(car=car, amount_due=Decimal('80'), amount_paid=Decimal('30'), status='pending')
+
+        with self.assertNumQueries(1):
+            balances = list(outstanding_balances(today).order_by('name').values_list('email', 'invoices_due', 'payments_due'))
+        self.assertEqual(balances, [
+            ('debtor@example.com', Decimal('100'), Decimal('0')),
+            ('payer@example.com', Decimal('0'), Decimal('50')),
+        ])
+
+        sent = send_payment_reminder_chunk([[0, email, str(i), str(p)] for email, i, p in balances])
+        self.assertEqual(sent, 2)
+        self.assertEqual([m.to for m in mail.outbox], [['debtor@example.com'], ['payer@example.com']])
+        self.assertIn('100', mail.outbox[0].body)
+
+
+@plain_static_storage
+class InvoicePdfTests(TestCase):
+    def setUp(self):
+        cache = tempfile.TemporaryDirectory()
+        self.addCleanup(cache.cleanup)
+        self.enterContext(override_settings(INVOICE_PDF_CACHE_DIR=cache.name))
+        self.cache_dir = cache.name
+
+        client = make_client()
+        self.invoices = Invoice.objects.bulk_create([
+            Invoice(client=client, due_date=date(2025, 4, 1)) for _ in range(3)
+        ])
+        cars = Car.objects.bulk_create([
+            Car(vin=f'VIN{i}', make='Toyota', client=client, storage_status='in_warehouse', ths=Decimal('10'))
+            for i in range(80)
+        ])
+        self.invoices[0].cars.add(*cars)
+
+    def test_renders_in_pool_and_reuses_cache(self):
+        ids = [invoice.pk for invoice in self.invoices]
+        with self.assertNumQueries(2):
+            paths = render_invoices(ids, workers=2)
+        self.assertEqual([pk for pk, _ in paths], ids)
+        self.assertTrue(all(path.read_bytes().startswith(b'%PDF') for _, path in paths))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3)
+
+        Car.objects.filter(vin='VIN0').update(prof=Decimal('1'))
+        render_invoices(ids)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 4)
+
+    def test_admin_action_streams_zip(self):
+        self.client.force_login(make_admin())
+        response = self.client.post('/admin/logistics/invoice/', {
+            'action': 'download_pdfs',
+            '_selected_action': [invoice.pk for invoice in self.invoices],
+        })
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(sorted(archive.namelist()), sorted(f'invoice_{invoice.pk}.pdf' for invoice in self.invoices))
+
+
+class QueryPlanTests(TestCase):
+    def test_key_querysets_use_indexes(self):
+        self.assertEqual(full_scans(), {})
+
+    def test_detects_full_scan(self):
+        self.assertEqual(full_scans({'by_make': Car.objects.filter(make='Toyota')}), {'by_make': ['logistics_car']})
+
+
+@plain_static_storage
+class WarehouseOccupancyTests(TestCase):
+    def setUp(self):
+        self.w1, self.w2 = Warehouse.objects.bulk_create([
+            Warehouse(name=f'W{i}', location='-', capacity=10) for i in (1, 2)
+        ])
+
+    def occupied(self):
+        return list(Warehouse.objects.order_by('name').values_list('occupied', flat=True))
+
+    def create_car(self, vin, **kwargs):
+        return Car.objects.create(vin=vin, make='Toyota', ths=Decimal('0'), sklad=Decimal('0'),
+                                  days_cost=Decimal('0'), prof=Decimal('0'), **kwargs)
+
+    def test_counters_follow_cars(self):
+        car = self.create_car('VIN1', storage_status='in_warehouse', warehouse=self.w1)
+        self.create_car('VIN2', storage_status='in_port', warehouse=self.w1)
+        self.assertEqual(self.occupied(), [1, 0])
+
+        car = Car.objects.get(pk=car.pk)
+        car.warehouse = self.w2
+        car.save()
+        self.assertEqual(self.occupied(), [0, 1])
+
+        car.storage_status = 'delivered'
+        car.save()
+        self.assertEqual(self.occupied(), [0, 0])
+
+        car.storage_status = 'in_warehouse'
+        car.save()
+        car.delete()
+        self.assertEqual(self.occupied(), [0, 0])
+
+    def test_container_status_releases_places(self):
+        container = make_container('C1', warehouse=self.w1, status='stored')
+        self.create_car('VIN1', storage_status='in_warehouse', warehouse=self.w1, container=container)
+        transition_containers(Container.objects.filter(pk=container.pk), 'delivered')
+        self.assertEqual(self.occupied(), [0, 0])
+
+    def test_reconcile_fixes_drift(self):
+        self.create_car('VIN1', storage_status='in_warehouse', warehouse=self.w1)
+        Warehouse.objects.update(occupied=5)
+        self.assertEqual(refresh_warehouse_occupancy(), 2)
+        self.assertEqual(self.occupied(), [1, 0])
+        self.assertEqual(refresh_warehouse_occupancy(), 0)
+
+    def test_dashboard_and_endpoint_read_counters(self):
+        Warehouse.objects.filter(pk=self.w1.pk).update(occupied=4)
+        self.client.force_login(make_admin())
+        with self.assertNumQueries(3):
+            response = self.client.get('/warehouses/occupancy/')
+        self.assertEqual(response.json()['warehouses'][0], {
+            'id': self.w1.pk, 'name': 'W1', 'capacity': 10, 'occupied': 4, 'free': 6,
+        })
+        self.assertContains(self.client.get('/admin/'), 'Занятость складов')
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_staff()
+        client = make_client('Acme')
+        container = Container.objects.create(number='C1', arrival_date=date(2025, 3, 1), status='stored')
+        Car.objects.bulk_create([
+            Car(vin=f'VIN{i:03d}', make='Toyota', client=client, container=container, storage_status='in_warehouse')
+            for i in range(25)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_keyset_pagination_and_fields(self):
+        seen = []
+        url = '/api/cars/?limit=10&fields=id,vin,client,container'
+        while url:
+            with self.assertNumQueries(4):
+                data = self.client.get(url).json()
+            seen += data['results']
+            url = data['next']
+        self.assertEqual([car['vin'] for car in seen], [f'VIN{i:03d}' for i in range(25)])
+        self.assertEqual(seen[0].keys(), {'id', 'vin', 'client', 'container'})
+        self.assertEqual((seen[0]['client'], seen[0]['container']), ('Acme', 'C1'))
+
+    def test_conditional_get(self):
+        first = self.client.get('/api/cars/?limit=10')
+        etag = first['ETag']
+        self.assertEqual(self.client.get('/api/cars/?limit=10', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Car.objects.filter(vin='VIN003').update(make='Honda')
+        changed = self.client.get('/api/cars/?limit=10', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+
+    def test_etag_follows_related_names(self):
+        # Строки машин не меняются, меняется имя клиента в них
+        etag = self.client.get('/api/cars/?limit=10')['ETag']
+        client = Client.objects.get()
+        client.name = 'Acme Ltd'
+        client.save()
+        response = self.client.get('/api/cars/?limit=10', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['client'], 'Acme Ltd')
+        etag = response['ETag']
+        Client.objects.update(name='Acme Inc')
+        self.assertEqual(self.client.get('/api/cars/?limit=10', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        # Без связанных полей чужие изменения страницу не сбрасывают
+        etag = self.client.get('/api/cars/?limit=10&fields=id,vin')['ETag']
+        Client.objects.update(name='Acme')
+        self.assertEqual(self.client.get('/api/cars/?limit=10&fields=id,vin', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        warehouse = Warehouse.objects.create(name='W1', location='-', capacity=10)
+        Container.objects.update(warehouse=warehouse)
+        etag = self.client.get('/api/containers/')['ETag']
+        warehouse.delete()
+        response = self.client.get('/api/containers/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['results'][0]['warehouse'])
+
+    def test_rejects_unknown_fields_and_anonymous(self):
+        self.assertEqual(self.client.get('/api/containers/?fields=secret').status_code, 400)
+        self.assertEqual(self.client.get('/api/invoices/?after=x').status_code, 400)
+        self.assertEqual(self.client.get('/api/cars/?client_id=abc').status_code, 400)
+        self.assertEqual(self.client.get('/api/cars/?container_id=x').status_code, 400)
+        self.assertEqual(self.client.get('/api/containers/?warehouse_id=zz').status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/cars/').status_code, 403)
+
+
+@plain_static_storage
+class CarExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_admin()
+        client = make_client('Acme & Co')
+        Car.objects.bulk_create([
+            Car(vin=f'VIN{i}', make='Toyota', client=client, storage_status='in_warehouse' if i % 2 else 'delivered',
+                ths=Decimal('10.50'))
+            for i in range(5)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_csv_export_url(self):
+        response = self.client.get('/admin/logistics/car/export/csv/?storage_status=in_warehouse')
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()))
+        self.assertEqual(rows[0][:2], ['VIN', 'Марка'])
+        self.assertEqual([row[0] for row in rows[1:]], ['VIN1', 'VIN3'])
+        self.assertEqual(rows[1][2], 'Acme & Co')
+        self.assertEqual(rows[1][-1], '10.50')
+
+    async def test_csv_export_streams_under_asgi(self):
+        # Под ASGI ответ должен быть асинхронным потоком, иначе Django собрал бы его в память целиком
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get('/admin/logistics/car/export/csv/')
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8-sig')
+        self.assertEqual([row[0] for row in csv.reader(content.splitlines())][1:],
+                         ['VIN0', 'VIN1', 'VIN2', 'VIN3', 'VIN4'])
+
+    def test_xlsx_export_action(self):
+        response = self.client.post('/admin/logistics/car/', {
+            'action': 'export_xlsx',
+            '_selected_action': list(Car.objects.values_list('pk', flat=True)),
+        })
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        sheet = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+        ns = {'s': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+        rows = sheet.findall('s:sheetData/s:row', ns)
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1].find('s:c/s:is/s:t', ns).text, 'VIN0')
+        self.assertEqual(rows[1].findall('s:c', ns)[-1].find('s:v', ns).text, '10.50')
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get('/admin/logistics/car/export/pdf/').status_code, 404)
+
+
+@plain_static_storage
+class CacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj = make_client()
+
+    def setUp(self):
+        django_cache.clear()
+        cache.stats.clear()
+
+    def create_car(self, vin, **kwargs):
+        return Car.objects.create(vin=vin, make='Toyota', client=self.client_obj, ths=Decimal('0'), sklad=Decimal('0'),
+                                  days_cost=Decimal('0'), prof=Decimal('10'), **kwargs)
+
+    def test_status_counts_cached_and_invalidated(self):
+        car = self.create_car('VIN1', storage_status='in_port')
+        self.assertEqual(cache.car_status_counts()['in_port'], 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.car_status_counts()['in_port'], 1)
+
+        car.storage_status = 'in_warehouse'
+        car.save()
+        self.assertEqual(cache.car_status_counts()['in_warehouse'], 1)
+
+        # Массовое обновление идёт мимо post_save, но тоже сбрасывает версию
+        container = make_container('C1', cars=2, status='stored')
+        transition_containers(Container.objects.filter(pk=container.pk), 'delivered')
+        self.assertEqual(cache.car_status_counts()['delivered'], 2)
+        self.assertEqual(cache.cache_stats()['car_status_counts'], {'hits': 1, 'misses': 3, 'hit_rate': 0.25})
+
+    def test_client_balance(self):
+        today = timezone.now().date()
+        car = self.create_car('VIN1', storage_status='in_port')
+        self.assertEqual(cache.client_balance(self.client_obj.pk)['invoices_due'], Decimal('0'))
+
+        invoice = Invoice.objects.create(client=self.client_obj, due_date=today)
+        invoice.cars.add(car)
+        self.assertEqual(cache.client_balance(self.client_obj.pk)['invoices_due'], Decimal('10'))
+
+        Payment.objects.create(car=car, amount_due=Decimal('30'), amount_paid=Decimal('5'), status='pending')
+        self.assertEqual(cache.client_balance(self.client_obj.pk)['payments_due'], Decimal('25'))
+
+        Invoice.objects.filter(pk=invoice.pk).update(status='paid')
+        with self.assertNumQueries(1):
+            self.assertEqual(cache.client_balance(self.client_obj.pk)['invoices_due'], Decimal('0'))
+
+    def test_container_cars(self):
+        container = make_container('C1', client=self.client_obj)
+        car = self.create_car('VIN1', storage_status='sailing', container=container)
+        self.assertEqual([row['vin'] for row in cache.container_cars(container.pk)], ['VIN1'])
+
+        other = make_container('C2')
+        car.container = other
+        car.save()
+        self.assertEqual(cache.container_cars(container.pk), [])
+        self.assertEqual([row['vin'] for row in cache.container_cars(other.pk)], ['VIN1'])
+
+    def test_container_cars_follow_client_name(self):
+        container = make_container('C1')
+        self.create_car('VIN1', storage_status='sailing', container=container)
+        self.assertEqual(cache.container_cars(container.pk)[0]['client__name'], 'Client')
+
+        self.client_obj.name = 'Renamed'
+        self.client_obj.save()
+        self.assertEqual(cache.container_cars(container.pk)[0]['client__name'], 'Renamed')
+        Client.objects.filter(pk=self.client_obj.pk).update(name='Bulk')
+        self.assertEqual(cache.container_cars(container.pk)[0]['client__name'], 'Bulk')
+        # Прочие изменения клиента (баланс, телефон) кэш машин не трогают
+        Client.objects.update(phone='2')
+        with self.assertNumQueries(0):
+            cache.container_cars(container.pk)
+
+    def test_hot_pages_read_cache(self):
+        staff = make_admin()
+        self.client.force_login(staff)
+        self.create_car('VIN1', storage_status='in_port')
+        self.client.get('/')
+        response = self.client.get('/admin/')
+        self.assertContains(response, 'Машины по статусам')
+        self.assertEqual(cache.cache_stats()['car_status_counts']['hits'], 1)
+        stats = self.client.get('/cache/stats/').json()['stats']
+        self.assertEqual(stats['car_status_counts']['misses'], 1)
+        response = self.client.get('/admin/logistics/client/')
+        self.assertContains(response, 'Долг по счетам')
+        # Колонка баланса — значение из журнала, а не словарь долгов из кэша
+        self.assertContains(response, '<td class="field-balance">0.00</td>', html=True)
+        self.assertEqual(cache.cache_stats()['client_balance']['misses'], 1)
+
+
+class OverdueSweepTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj = make_client()
+        cls.car = Car.objects.create(vin='VIN1', make='Toyota', client=cls.client_obj, storage_status='in_port',
+                                     ths=Decimal('0'), sklad=Decimal('0'), days_cost=Decimal('0'), prof=Decimal('10'))
+
+    def setUp(self):
+        self.today = timezone.now().date()
+
+    def payment(self, days_ago, **kwargs):
+        payment = Payment.objects.create(car=self.car, amount_due=Decimal('100'), **kwargs)
+        Payment.objects.filter(pk=payment.pk).update(payment_date=self.today - timedelta(days=days_ago))
+        return payment
+
+    def test_sweep_marks_overdue_in_constant_queries(self):
+        late = Invoice.objects.create(client=self.client_obj, due_date=self.today - timedelta(days=1))
+        Invoice.objects.create(client=self.client_obj, due_date=self.today)
+        Invoice.objects.create(client=self.client_obj, due_date=self.today - timedelta(days=1), status='paid')
+        late_payment = self.payment(31, status='pending')
+        self.payment(5, status='pending')
+        self.payment(31, status='pending', amount_paid=Decimal('100'))
+
+        with self.assertNumQueries(4):
+            swept = sweep_overdue(self.today)
+
+        self.assertEqual(swept, {'invoices': [late.pk], 'payments': [late_payment.pk]})
+        self.assertEqual(Invoice.objects.filter(status='overdue').count(), 1)
+        self.assertEqual(Payment.objects.get(pk=late_payment.pk).status, 'overdue')
+        self.assertEqual(sweep_overdue(self.today), {'invoices': [], 'payments': []})
+
+    def test_mark_paid_reconciles_payments(self):
+        invoice = Invoice.objects.create(client=self.client_obj, due_date=self.today, status='overdue')
+        invoice.cars.add(self.car)
+        payment = self.payment(40, status='overdue', amount_paid=Decimal('20'))
+
+        paid = mark_invoices_paid(Invoice.objects.filter(pk=invoice.pk))
+
+        self.assertEqual(paid, {'invoices': [invoice.pk], 'payments': [payment.pk]})
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.amount_paid, payment.is_partial), ('paid', Decimal('100'), False))
+        self.assertEqual(Invoice.objects.get(pk=invoice.pk).status, 'paid')
+
+
+@plain_static_storage
+class InvoiceCarPickerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_admin()
+        cls.owner = make_client('Owner', 'o@example.com')
+        other = make_client('Other', 'x@example.com')
+        costs = dict(ths=Decimal('0'), sklad=Decimal('0'), days_cost=Decimal('0'), prof=Decimal('0'))
+        Car.objects.bulk_create(
+            [Car(vin=f'AB{i:03d}', make='Toyota', client=cls.owner, storage_status='in_warehouse', **costs)
+             for i in range(25)]
+            + [Car(vin='AB999', make='Honda', client=cls.owner, storage_status='delivered', **costs),
+               Car(vin='AB998', make='Ford', client=other, storage_status='in_warehouse', **costs)]
+        )
+        cls.invoice = Invoice.objects.create(client=cls.owner, due_date=date(2025, 4, 1))
+        cls.invoice.cars.add(Car.objects.get(vin='AB000'))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def autocomplete(self, **params):
+        return self.client.get('/admin/logistics/invoice/cars/autocomplete/', {'invoice': self.invoice.pk, **params}).json()
+
+    def test_change_page_renders_only_selected_cars(self):
+        response = self.client.get(f'/admin/logistics/invoice/{self.invoice.pk}/change/')
+        self.assertContains(response, 'AB000 — Toyota')
+        self.assertNotContains(response, 'AB001')
+        self.assertContains(response, f'/admin/logistics/invoice/cars/autocomplete/?invoice={self.invoice.pk}')
+
+    def test_autocomplete_is_scoped_and_paginated(self):
+        first = self.autocomplete()
+        self.assertEqual(len(first['results']), 20)
+        self.assertTrue(first['pagination']['more'])
+        second = self.autocomplete(page=2)
+        self.assertEqual([row['text'] for row in second['results']][-1], 'AB024 — Toyota')
+        self.assertFalse(second['pagination']['more'])
+
+        self.assertEqual([row['text'] for row in self.autocomplete(term='ab01')['results']][:2],
+                         ['AB010 — Toyota', 'AB011 — Toyota'])
+        self.assertEqual(self.autocomplete(term='AB99')['results'], [])
+
+    def test_add_car_through_inline(self):
+        link = Invoice.cars.through.objects.get(invoice=self.invoice)
+        car = Car.objects.get(vin='AB001')
+        response = self.client.post(f'/admin/logistics/invoice/{self.invoice.pk}/change/', {
+            'client': self.owner.pk, 'issue_date': '2025-03-01', 'due_date': '2025-04-01', 'status': 'unpaid',
+            'Invoice_cars-TOTAL_FORMS': 2, 'Invoice_cars-INITIAL_FORMS': 1,
+            'Invoice_cars-0-id': link.pk, 'Invoice_cars-0-invoice': self.invoice.pk, 'Invoice_cars-0-car': link.car_id,
+            'Invoice_cars-0-ths': '10', 'Invoice_cars-0-sklad_combined': '0', 'Invoice_cars-0-days_cost': '0',
+            'Invoice_cars-1-invoice': self.invoice.pk, 'Invoice_cars-1-car': car.pk,
+            'Invoice_cars-1-ths': '5', 'Invoice_cars-1-sklad_combined': '0', 'Invoice_cars-1-days_cost': '0',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.amount, Decimal('15.00'))
+
+
+@plain_static_storage
+class CarSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_admin()
+        acme = make_client('Acme Logistics', 'a@example.com')
+        costs = dict(ths=Decimal('0'), sklad=Decimal('0'), days_cost=Decimal('0'), prof=Decimal('0'))
+        cls.toyota = Car.objects.create(vin='JTDBR32E720012345', make='Toyota', client=acme, storage_status='in_port',
+                                        **costs)
+        cls.honda = Car.objects.create(vin='1HGCM82633A004352', make='Honda', storage_status='in_port', **costs)
+        container = make_container('MSCU1234567')
+        Payment.objects.create(car=cls.honda, amount_due=Decimal('10'), status='pending')
+        Payment.objects.create(container=container, amount_due=Decimal('10'), status='pending')
+
+    def found(self, term, backend=None):
+        return set(search.search_cars(Car.objects.all(), term, backend).values_list('vin', flat=True))
+
+    def test_backends_agree(self):
+        for backend in ('icontains', 'suffix'):
+            with self.subTest(backend=backend):
+                self.assertEqual(self.found('a004352', backend), {'1HGCM82633A004352'})
+                self.assertEqual(self.found('yot', backend), {'JTDBR32E720012345'})
+                self.assertEqual(self.found('acme', backend), {'JTDBR32E720012345'})
+                self.assertEqual(self.found('12', backend), {'JTDBR32E720012345'})
+
+    def test_index_follows_vin_changes(self):
+        car = Car.objects.get(pk=self.honda.pk)
+        car.vin = 'WBA3A5C50CF256651'
+        car.save()
+        self.assertEqual(self.found('256651'), {'WBA3A5C50CF256651'})
+        self.assertEqual(self.found('004352'), set())
+
+    def test_admin_and_api_use_backend(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/admin/logistics/car/', {'q': '0012345'})
+        self.assertContains(response, 'JTDBR32E720012345')
+        self.assertNotContains(response, '1HGCM82633A004352')
+
+        payments = self.client.get('/admin/logistics/payment/', {'q': '1234567'})
+        self.assertEqual(payments.context['cl'].result_count, 1)
+        self.assertEqual(self.client.get('/admin/logistics/payment/', {'q': '82633'}).context['cl'].result_count, 1)
+
+        results = self.client.get('/api/cars/', {'q': 'honda', 'fields': 'vin'}).json()['results']
+        self.assertEqual(results, [{'vin': '1HGCM82633A004352'}])
+
+
+class StatusEventTests(TestCase):
+    def setUp(self):
+        self.warehouse = Warehouse.objects.create(name='W1', location='-', capacity=100)
+
+    def events(self, object_type):
+        return list(StatusEvent.objects.filter(object_type=object_type).order_by('pk').values_list('status', flat=True))
+
+    def test_transition_writes_events_in_bulk(self):
+        container = make_container('C1', cars=3, warehouse=self.warehouse, ths=Decimal('30'))
+        Car.objects.filter(pk=container.cars.first().pk).update(storage_status='arrived')
+        StatusEvent.objects.all().delete()
+
+        with self.assertNumQueries(14):
+            transition_containers(Container.objects.filter(pk=container.pk), 'arrived')
+
+        self.assertEqual(self.events(StatusEvent.CONTAINER), ['arrived'])
+        self.assertEqual(self.events(StatusEvent.CAR), ['arrived', 'arrived'])
+
+        transition_containers(Container.objects.filter(pk=container.pk), 'arrived')
+        self.assertEqual(StatusEvent.objects.count(), 3)
+
+    def test_car_save_records_status_change(self):
+        car = Car.objects.create(vin='VIN1', make='Toyota', storage_status='in_port', ths=Decimal('0'),
+                                 sklad=Decimal('0'), days_cost=Decimal('0'), prof=Decimal('0'))
+        car.make = 'Honda'
+        car.save()
+        car.storage_status = 'in_warehouse'
+        car.warehouse = self.warehouse
+        car.save()
+        self.assertEqual(self.events(StatusEvent.CAR), ['in_port', 'in_warehouse'])
+
+    def test_rollup_dwell_times(self):
+        day = date(2025, 3, 10)
+        at = lambda d, h: timezone.make_aware(datetime(2025, 3, d, h))
+        StatusEvent.objects.bulk_create([
+            StatusEvent(object_type=StatusEvent.CAR, object_id=1, status='in_port', created_at=at(8, 12)),
+            StatusEvent(object_type=StatusEvent.CAR, object_id=1, status='in_warehouse', warehouse_id=self.warehouse.pk,
+                        created_at=at(10, 12)),
+            StatusEvent(object_type=StatusEvent.CAR, object_id=2, status='in_port', created_at=at(9, 0)),
+            StatusEvent(object_type=StatusEvent.CAR, object_id=2, status='in_port', created_at=at(9, 6)),
+            StatusEvent(object_type=StatusEvent.CAR, object_id=2, status='in_warehouse', warehouse_id=self.warehouse.pk,
+                        created_at=at(10, 0)),
+            # Переход на следующий день в свёртку за 10-е не попадает
+            StatusEvent(object_type=StatusEvent.CAR, object_id=2, status='delivered', created_at=at(11, 1)),
+        ])
+
+        self.assertEqual(rollup_dwell_times(day), 1)
+        self.assertEqual(rollup_dwell_times(day), 1)
+        rollup = DwellRollup.objects.get()
+        self.assertEqual((rollup.transitions, rollup.max_seconds), (2, 2 * 86400))
+
+        with self.assertNumQueries(1):
+            report = average_dwell('in_port', 'in_warehouse', date(2025, 1, 1), date(2025, 3, 31))
+        self.assertEqual(report[self.warehouse.pk]['average'], timedelta(days=1, hours=12))
+
+
+class LedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj = make_client()
+        cls.car = Car.objects.create(vin='VIN1', make='Toyota', client=cls.client_obj, storage_status='in_port',
+                                     ths=Decimal('100'), sklad=Decimal('0'), days_cost=Decimal('0'), prof=Decimal('0'))
+
+    def balance(self):
+        return Client.objects.get(pk=self.client_obj.pk).balance
+
+    def test_charges_and_credits_keep_running_balance(self):
+        invoice = Invoice.objects.create(client=self.client_obj, due_date=date(2025, 4, 1))
+        invoice.cars.add(self.car)
+        self.assertEqual(self.balance(), Decimal('100'))
+
+        car = Car.objects.get(pk=self.car.pk)
+        car.prof = Decimal('20')
+        car.save()
+        self.assertEqual(self.balance(), Decimal('120'))
+
+        payment = Payment.objects.create(car=self.car, amount_due=Decimal('120'), amount_paid=Decimal('50'),
+                                         status='pending', payment_type='transfer')
+        Payment.objects.filter(pk=payment.pk).update(amount_paid=Decimal('70'))
+        self.assertEqual(self.balance(), Decimal('50'))
+
+        entries = list(LedgerEntry.objects.order_by('pk').values_list('kind', 'amount', 'balance', 'payment_type'))
+        self.assertEqual(entries, [
+            ('charge', Decimal('100'), Decimal('100'), ''),
+            ('charge', Decimal('20'), Decimal('120'), ''),
+            ('credit', Decimal('-50'), Decimal('70'), 'transfer'),
+            ('credit', Decimal('-20'), Decimal('50'), 'transfer'),
+        ])
+        self.assertEqual(sync_ledger(), 0)
+
+    def test_moving_documents_between_clients(self):
+        other = make_client('Other', 'o@example.com')
+        invoice = Invoice.objects.create(client=self.client_obj, due_date=date(2025, 4, 1))
+        invoice.cars.add(self.car)
+        invoice = Invoice.objects.get(pk=invoice.pk)
+        invoice.client = other
+        invoice.save()
+        self.assertEqual(self.balance(), Decimal('0'))
+        self.assertEqual(Client.objects.get(pk=other.pk).balance, Decimal('100'))
+
+        other_car = Car.objects.create(vin='VIN2', make='Toyota', client=other, storage_status='in_port',
+                                       ths=Decimal('0'), sklad=Decimal('0'), days_cost=Decimal('0'), prof=Decimal('0'))
+        payment = Payment.objects.create(car=self.car, amount_due=Decimal('100'), amount_paid=Decimal('40'),
+                                         status='pending')
+        Payment.objects.filter(pk=payment.pk).update(car=other_car)
+        self.assertEqual(self.balance(), Decimal('0'))
+        self.assertEqual(Client.objects.get(pk=other.pk).balance, Decimal('60'))
+        self.assertEqual(sync_ledger(), 0)
+
+    def test_sync_repairs_client_change_made_in_sql(self):
+        other = make_client('Other', 'o@example.com')
+        invoice = Invoice.objects.create(client=self.client_obj, due_date=date(2025, 4, 1))
+        invoice.cars.add(self.car)
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE logistics_invoice SET client_id = %s WHERE id = %s', [other.pk, invoice.pk])
+
+        self.assertEqual(sync_ledger(), 2)
+        self.assertEqual(self.balance(), Decimal('0'))
+        self.assertEqual(Client.objects.get(pk=other.pk).balance, Decimal('100'))
+        self.assertEqual(sync_ledger(), 0)
+
+    def test_point_in_time_statement(self):
+        invoice = Invoice.objects.create(client=self.client_obj, due_date=date(2025, 4, 1))
+        invoice.cars.add(self.car)
+        LedgerEntry.objects.update(created_at=timezone.make_aware(datetime(2025, 1, 15)))
+        Payment.objects.create(car=self.car, amount_due=Decimal('100'), amount_paid=Decimal('30'), status='pending')
+        LedgerEntry.objects.filter(kind='credit').update(created_at=timezone.make_aware(datetime(2025, 2, 10)))
+
+        february = statement(self.client_obj.pk, timezone.make_aware(datetime(2025, 2, 1)),
+                             timezone.make_aware(datetime(2025, 3, 1)))
+        self.assertEqual(february['opening_balance'], Decimal('100'))
+        self.assertEqual([entry['amount'] for entry in february['entries']], [Decimal('-30')])
+        self.assertEqual(february['closing_balance'], Decimal('70'))
+        with self.assertNumQueries(1):
+            self.assertEqual(balance_at(self.client_obj.pk, timezone.make_aware(datetime(2025, 1, 1))), Decimal('0'))
+
+    def test_deleted_invoice_is_reversed(self):
+        invoice = Invoice.objects.create(client=self.client_obj, due_date=date(2025, 4, 1))
+        invoice.cars.add(self.car)
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice.delete()
+        self.assertEqual(self.balance(), Decimal('0'))
+        self.assertEqual(LedgerEntry.objects.count(), 2)
+
+    def test_balance_view(self):
+        self.client.force_login(make_admin())
+        Invoice.objects.create(client=self.client_obj, due_date=date(2025, 4, 1)).cars.add(self.car)
+        self.assertEqual(self.client.get(f'/clients/{self.client_obj.pk}/balance/').json()['balance'], '100.00')
+        response = self.client.get(f'/clients/{self.client_obj.pk}/statement/', {'start': '2000-01-01'})
+        self.assertEqual(response.json()['closing_balance'], '100.00')
+        self.assertEqual(self.client.get(f'/clients/{self.client_obj.pk}/statement/', {'start': 'x'}).status_code, 400)
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_staff()
+        client = make_client('Acme')
+        container = Container.objects.create(number='C1', arrival_date=date(2025, 3, 1), status='stored')
+        cls.car = Car.objects.create(vin='VIN1', make='Toyota', client=client, container=container,
+                                     storage_status='in_port', ths=0, sklad=0, days_cost=0, prof=Decimal('10'))
+        Car.objects.create(vin='VIN2', make='Honda', client=client, container=container,
+                           storage_status='in_warehouse', ths=0, sklad=0, days_cost=0, prof=0)
+        Payment.objects.create(car=cls.car, amount_due=Decimal('100'), amount_paid=Decimal('40'), status='pending')
+        cls.car.storage_status = 'in_warehouse'
+        cls.car.save()
+
+    @override_settings(ROOT_URLCONF='logistics.loadtest_urls')
+    async def test_dashboard_matches_sync_view(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get('/api/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['cars']['in_warehouse'], 2)
+        self.assertEqual(data['containers']['stored'], 1)
+        self.assertEqual(data['payments']['pending']['count'], 1)
+        self.assertEqual(data, (await self.async_client.get('/api/sync/dashboard/')).json())
+
+    async def test_car_and_container_detail(self):
+        await self.async_client.aforce_login(self.user)
+        car = (await self.async_client.get('/api/cars/VIN1/')).json()
+        self.assertEqual((car['client__name'], car['container__number']), ('Acme', 'C1'))
+        self.assertEqual([event['status'] for event in car['history']], ['in_port', 'in_warehouse'])
+        self.assertEqual([event['status'] for event in car['container_history']], ['stored'])
+        self.assertEqual(len(car['payments']), 1)
+
+        container = (await self.async_client.get('/api/containers/C1/')).json()
+        self.assertEqual([row['vin'] for row in container['cars']], ['VIN1', 'VIN2'])
+        self.assertEqual(Decimal(container['payments']['amount_paid']), Decimal('40'))
+        self.assertEqual((await self.async_client.get('/api/cars/NOPE/')).status_code, 404)
+
+    async def test_requires_staff(self):
+        self.assertEqual((await self.async_client.get('/api/dashboard/')).status_code, 403)
+
+    async def test_sync_twins_only_in_loadtest_urls(self):
+        await self.async_client.aforce_login(self.user)
+        self.assertEqual((await self.async_client.get('/api/sync/dashboard/')).status_code, 404)
+
+
+class ConcurrentQueriesTests(TransactionTestCase):
+    def test_queries_run_on_separate_connections(self):
+        # Вне транзакции каждый запрос выполняется в своём потоке, результат тот же, что и по очереди
+        Container.objects.create(number='C1', arrival_date=date(2025, 3, 1), status='stored')
+        queries = dashboard_queries()
+        with patch.object(async_views, 'executor', None), patch.dict(connection.settings_dict, CONN_MAX_AGE=60):
+            self.assertEqual(async_to_sync(run_concurrently)(queries), run_sequentially(queries))
+            async_views.executor.shutdown()
+
+    @override_settings(LOGISTICS_ASYNC_QUERY_THREADS=2)
+    def test_fan_out_is_capped(self):
+        # Без постоянных соединений запросы идут в одном потоке; с ними — не больше чем в двух потоках пула
+        queries = {i: threading.get_ident for i in range(6)}
+        with patch.object(async_views, 'executor', None):
+            with patch.dict(connection.settings_dict, CONN_MAX_AGE=0):
+                self.assertEqual(len(set(async_to_sync(run_concurrently)(queries).values())), 1)
+            threads = set(async_to_sync(run_concurrently)(queries).values())
+            async_views.executor.shutdown()
+        self.assertLessEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+
+
+@override_settings(LOGISTICS_METRICS_FLUSH_SECONDS=0, LOGISTICS_METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_staff()
+
+    def setUp(self):
+        django_cache.clear()
+
+    def test_requests_and_tasks_are_exported(self):
+        self.client.force_login(self.user)
+        for _ in range(2):
+            self.assertEqual(self.client.get('/warehouses/occupancy/').status_code, 200)
+        reconcile_warehouse_occupancy.apply()
+
+        text = self.client.get('/metrics').content.decode()
+        labels = 'view="warehouse_occupancy",method="GET",status="2xx"'
+        self.assertIn(f'logistics_request_seconds_count{{{labels}}} 2', text)
+        self.assertIn(f'logistics_request_queries_bucket{{{labels},le="+Inf"}} 2', text)
+        self.assertIn('logistics_task_seconds_count{task="logistics.tasks.reconcile_warehouse_occupancy",'
+                      'state="SUCCESS"} 1', text)
+
+    def test_flush_waits_for_request_finished(self):
+        # Наблюдение только копится в памяти; в кэш оно уходит после того, как ответ отдан
+        with metrics.collect() as collector:
+            pass
+        metrics.record('request', {'view': 'test'}, 0.01, collector)
+        self.assertTrue(metrics.pending)
+        self.client.get('/missing/')
+        self.assertFalse(metrics.pending)
+
+    def test_token_access(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    @override_settings(LOGISTICS_SLOW_SECONDS=0)
+    def test_slow_request_log_shows_repeated_sql(self):
+        client = make_client('Acme')
+        cars = Car.objects.bulk_create([
+            Car(vin=f'VIN{i}', make='Toyota', client=client, storage_status='in_port') for i in range(3)
+        ])
+        with metrics.collect() as collector:
+            for car in cars:
+                Car.objects.get(pk=car.pk).client.name
+        self.assertEqual(collector.queries, 6)
+        self.assertEqual([count for count, _ in collector.repeated()], [3, 3])
+
+        with self.assertLogs('logistics.metrics', 'WARNING') as logs:
+            metrics.record('request', {'view': 'test'}, 0.5, collector)
+        self.assertIn('запросов 6', logs.output[0])
+        self.assertIn('3×', logs.output[0])
+
+
+@plain_static_storage
+class ChangeTrackingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_admin()
+        cls.warehouse = Warehouse.objects.create(name='W1', location='-', capacity=10)
+        cls.client_obj = make_client('Acme')
+        cls.container = Container.objects.create(number='C1', arrival_date=date(2025, 3, 1), warehouse=cls.warehouse,
+                                                 status='stored', ths=Decimal('300'))
+        for i in range(3):
+            Car.objects.create(vin=f'VIN{i}', make='Toyota', client=cls.client_obj, container=cls.container,
+                               storage_status='in_port', ths=0, sklad=0, days_cost=0, prof=0)
+
+    def car_updates(self, queries):
+        return [q['sql'] for q in queries if q['sql'].startswith('UPDATE "logistics_car"')]
+
+    def test_unchanged_objects_are_not_written(self):
+        container = Container.objects.get(pk=self.container.pk)
+        car = Car.objects.get(vin='VIN0')
+        invoice = Invoice.objects.create(client=self.client_obj, due_date=date(2025, 4, 1))
+        payment = Payment.objects.create(car=car, amount_due=Decimal('100'), status='pending')
+        with self.assertNumQueries(0):
+            container.save()
+            car.save()
+            invoice.save()
+            payment.save()
+
+    def test_field_edits_write_only_changed_columns(self):
+        container = Container.objects.get(pk=self.container.pk)
+        container.arrival_date = date(2025, 3, 5)
+        with self.assertNumQueries(1):
+            container.save()
+
+        car = Car.objects.get(vin='VIN0')
+        car.date_stored = date(2025, 3, 6)
+        with CaptureQueriesContext(connection) as queries:
+            car.save()
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"date_stored"', queries[0]['sql'])
+        self.assertNotIn('"vin"', queries[0]['sql'])
+
+        payment = Payment.objects.create(car=car, amount_due=Decimal('100'), status='pending')
+        payment = Payment.objects.get(pk=payment.pk)
+        payment.status = 'overdue'
+        # UPDATE одного столбца и клиент машины для сброса кэша долгов; журнал расчётов не трогается
+        with self.assertNumQueries(2):
+            payment.save()
+
+    def test_explicit_update_fields_bump_updated_at(self):
+        car = Car.objects.get(vin='VIN0')
+        before = car.updated_at
+        car.make = 'Honda'
+        car.save(update_fields=['make'])
+        self.assertGreater(Car.objects.get(pk=car.pk).updated_at, before)
+        # Пустой update_fields по-прежнему ничего не пишет
+        with self.assertNumQueries(0):
+            car.save(update_fields=[])
+
+    def admin_post(self, **changes):
+        data = {
+            'number': 'C1', 'arrival_date': '2025-03-01', 'warehouse': self.warehouse.pk, 'status': 'stored',
+            'ths': '300.00', 'ths_strategy': 'even', 'cars-TOTAL_FORMS': '3', 'cars-INITIAL_FORMS': '3', 'cars-MIN_NUM_FORMS': '0',
+            'cars-MAX_NUM_FORMS': '1000', **changes,
+        }
+        for i, car in enumerate(Car.objects.order_by('vin')):
+            data.update({
+                f'cars-{i}-id': car.pk, f'cars-{i}-container': self.container.pk, f'cars-{i}-vin': car.vin,
+                f'cars-{i}-make': car.make, f'cars-{i}-storage_status': car.storage_status,
+                f'cars-{i}-client': car.client_id, f'cars-{i}-size_class': car.size_class,
+            })
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'/admin/logistics/container/{self.container.pk}/change/', data)
+        self.assertEqual(response.status_code, 302, response.context and response.context['errors'])
+        return queries
+
+    def test_admin_date_edit_skips_car_cascade(self):
+        queries = self.admin_post(arrival_date='2025-03-05')
+        self.assertEqual(self.car_updates(queries), [])
+        self.container.refresh_from_db()
+        self.assertEqual(self.container.arrival_date, date(2025, 3, 5))
+
+    def test_admin_status_edit_cascades_once(self):
+        queries = self.admin_post(status='unloaded')
+        self.assertEqual(len(self.car_updates(queries)), 1)
+        self.assertEqual(Car.objects.filter(storage_status='unloaded').count(), 3)
+        self.assertEqual(StatusEvent.objects.filter(object_type=StatusEvent.CONTAINER, status='unloaded').count(), 1)
+
+    def test_admin_inline_change_resplits_ths(self):
+        Container.objects.filter(pk=self.container.pk).update(status='arrived')
+        self.admin_post(status='arrived', **{'cars-TOTAL_FORMS': '4', 'cars-3-container': self.container.pk,
+                                            'cars-3-vin': 'VIN3', 'cars-3-make': 'Honda',
+                                            'cars-3-storage_status': 'in_port',
+                                            'cars-3-client': self.client_obj.pk, 'cars-3-size_class': 'sedan'})
+        self.assertEqual(set(Car.objects.values_list('ths', flat=True)), {Decimal('75.00')})
+
+
+@plain_static_storage
+class RevenueReportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_admin()
+        cls.w1 = Warehouse.objects.create(name='W1', location='-', capacity=10)
+        cls.w2 = Warehouse.objects.create(name='W2', location='-', capacity=10)
+        cls.acme = make_client('Acme', 'a@example.com')
+        cls.beta = make_client('Beta', 'b@example.com')
+        container = make_container('C1', warehouse=cls.w1)
+        costs = {'ths': Decimal('10'), 'sklad': Decimal('5'), 'days_cost': Decimal('2'), 'prof': Decimal('1')}
+        Car.objects.bulk_create([
+            Car(vin='VIN1', make='Toyota', client=cls.acme, warehouse=cls.w1, container=container,
+                storage_status='in_warehouse', date_stored=date(2025, 4, 10), **costs),
+            # Ещё не на складе: месяц прибытия контейнера
+            Car(vin='VIN2', make='Toyota', client=cls.beta, warehouse=cls.w1, container=container,
+                storage_status='in_port', procedure='import', **costs),
+            Car(vin='VIN3', make='Honda', client=cls.acme, warehouse=cls.w2,
+                storage_status='in_warehouse', date_stored=date(2025, 4, 20), **costs),
+            # Без даты и контейнера месяц не определить
+            Car(vin='VIN4', make='Honda', storage_status='sailing', **costs),
+        ])
+
+    def test_report_reads_only_rollups(self):
+        self.assertEqual(rollup_revenue(), 3)
+        self.assertEqual(rollup_revenue(), 3)
+
+        with self.assertNumQueries(2):
+            rows = revenue_report(date(2025, 1, 1), date(2025, 12, 31), ['warehouse_id', 'month'])
+        self.assertEqual(
+            [(row['labels'], row['cars'], row['total']) for row in rows],
+            [(['03.2025', 'W1'], 1, Decimal('18')), (['04.2025', 'W1'], 1, Decimal('18')),
+             (['04.2025', 'W2'], 1, Decimal('18'))],
+        )
+        rows = revenue_report(date(2025, 4, 15), date(2025, 4, 15), ['client_id'], procedure='transit')
+        self.assertEqual([(row['labels'], row['cars'], row['ths']) for row in rows], [(['Acme'], 2, Decimal('20'))])
+
+    def test_refresh_rebuilds_only_changed_months(self):
+        rollup_revenue()
+        march = RevenueRollup.objects.get(month=date(2025, 3, 1))
+        Car.objects.filter(vin='VIN1').update(sklad=Decimal('15'))
+
+        refresh_revenue_rollups()
+
+        self.assertEqual(RevenueRollup.objects.get(month=date(2025, 3, 1)).refreshed_at, march.refreshed_at)
+        april = RevenueRollup.objects.filter(month=date(2025, 4, 1)).order_by('warehouse_id')
+        self.assertEqual([rollup.total for rollup in april], [Decimal('28'), Decimal('18')])
+
+    def test_admin_page(self):
+        rollup_revenue()
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/reports/revenue/', {
+                'start': '2025-01-01', 'end': '2025-12-31', 'group_by': ['procedure'], 'warehouse': self.w1.pk,
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row['labels'], row['cars']) for row in response.context['rows']],
+                         [(['Импорт'], 1), (['Транзит'], 1)])
+        self.assertEqual(response.context['totals']['total'], Decimal('36'))
+        self.assertFalse([q for q in queries if 'FROM "logistics_car"' in q['sql']])
+
+        response = self.client.get('/admin/reports/revenue/', {'start': '2025-05-01', 'end': '2025-01-01'})
+        self.assertEqual(response.context['rows'], [])
+
+
+@plain_static_storage
+class ThsAllocationTests(TestCase):
+    def ths(self, container):
+        return list(container.cars.order_by('pk').values_list('ths', flat=True))
+
+    def test_distribute_keeps_every_cent(self):
+        self.assertEqual(distribute(Decimal('100'), [1, 1, 1]),
+                         [Decimal('33.34'), Decimal('33.33'), Decimal('33.33')])
+        self.assertEqual(distribute(Decimal('0.05'), [1, 2, 3]), [Decimal('0.01'), Decimal('0.02'), Decimal('0.02')])
+        self.assertEqual(distribute(Decimal('10'), [0, 0]), [Decimal('5'), Decimal('5')])
+        amounts = distribute(Decimal('1000.01'), [2, 3, 3, 4, 1, 2, 2])
+        self.assertEqual(sum(amounts), Decimal('1000.01'))
+
+    def test_strategies(self):
+        weighted = make_container('W', cars=3, ths=Decimal('100'), ths_strategy='weighted')
+        moto, suv = weighted.cars.order_by('pk')[:2]
+        Car.objects.filter(pk=moto.pk).update(size_class='moto')
+        Car.objects.filter(pk=suv.pk).update(size_class='suv')
+        fixed = make_container('F', cars=3, ths=Decimal('100'), ths_strategy='fixed')
+        Car.objects.filter(pk=fixed.cars.order_by('pk').first().pk).update(ths_fixed=Decimal('40'))
+        # Фиксированные суммы больше THS: THS делится пропорционально им
+        overdrawn = make_container('O', cars=2, ths=Decimal('30'), ths_strategy='fixed')
+        Car.objects.filter(container=overdrawn).update(ths_fixed=Decimal('20'))
+
+        with self.assertNumQueries(1):
+            allocations = allocate([weighted, fixed, overdrawn])
+        self.assertEqual([amount for _, amount in allocations[weighted.pk]],
+                         [Decimal('16.67'), Decimal('50'), Decimal('33.33')])
+        self.assertEqual([amount for _, amount in allocations[fixed.pk]], [Decimal('40'), Decimal('30'), Decimal('30')])
+        self.assertEqual([amount for _, amount in allocations[overdrawn.pk]], [Decimal('15'), Decimal('15')])
+
+    def test_split_writes_changed_cars_in_one_update(self):
+        containers = [make_container(f'C{i}', cars=3, ths=Decimal('100')) for i in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(split_container_ths(containers), 9)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE "logistics_car"')]), 2)
+        self.assertEqual(self.ths(containers[0]), [Decimal('33.34'), Decimal('33.33'), Decimal('33.33')])
+        self.assertEqual(split_container_ths(containers), 0)
+
+    def test_admin_preview_writes_nothing_until_applied(self):
+        user = make_admin()
+        container = make_container('C1', cars=3, ths=Decimal('100'))
+        Container.objects.filter(pk=container.pk).update(status='arrived')
+        sailing = make_container('C2', cars=2, ths=Decimal('100'))
+        self.client.force_login(user)
+        data = {'action': 'preview_ths', '_selected_action': [container.pk, sailing.pk]}
+
+        response = self.client.post('/admin/logistics/container/', data)
+        self.assertContains(response, '33.34')
+        self.assertContains(response, 'пропущены: C2')
+        self.assertEqual(self.ths(container), [Decimal('0')] * 3)
+
+        response = self.client.post('/admin/logistics/container/', {**data, 'apply': '1'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.ths(container), [Decimal('33.34'), Decimal('33.33'), Decimal('33.33')])
+        # Контейнер в пути не трогаем: THS ляжет на машины при прибытии
+        self.assertEqual(self.ths(sailing), [Decimal('0')] * 2)
+
+
+class ReadScopeTests(TestCase):
+    def test_write_pins_scope_to_primary(self):
+        self.assertEqual(routers.read_alias(), 'default')
+        with routers.scope() as state:
+            Car.objects.count()
+            with transaction.atomic():
+                Car.objects.exists()
+            self.assertFalse(state.wrote)
+            make_client('Acme', 'a@example.com')
+            self.assertTrue(state.pinned)
+            self.assertEqual(routers.read_alias(), 'default')
+
+
+class ReadOnlyTransactionTests(TransactionTestCase):
+    # Вне TestCase: atomic() открывает настоящую транзакцию (BEGIN), а не точку сохранения
+    def test_read_only_atomic_request_is_not_pinned(self):
+        states = []
+
+        def view(request):
+            with transaction.atomic():
+                Car.objects.exists()
+            states.append(routers.current.get())
+            return HttpResponse()
+
+        response = ReplicaMiddleware(view)(RequestFactory().get('/'))
+        self.assertFalse(states[0].wrote)
+        self.assertNotIn(ReplicaMiddleware.cookie_name, response.cookies)
+
+
+@skipUnless(routers.replica_configured(), "Реплика не настроена (REPLICA_DATABASE_URL)")
+class ReplicaRoutingTests(TransactionTestCase):
+    # Реплика в тестах — зеркало default; вне TestCase, потому что внутри транзакции чтение идёт на основную базу
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = make_admin()
+        self.client.force_login(self.user)
+        self.container = make_container('C1', cars=2, ths=Decimal('100'))
+        # admin_interface при первом показе админки создаёт тему — это запись, она закрепила бы клиента
+        self.client.get('/admin/')
+        self.client.cookies.pop('logistics_primary', None)
+
+    def request(self, method, url, data=None):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(self.client, method)(url, data or {})
+        return response, primary, replica
+
+    def test_reads_go_to_replica(self):
+        response, primary, replica = self.request('get', '/admin/logistics/car/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in primary if 'logistics_car' in q['sql']])
+        self.assertTrue([q for q in replica if 'logistics_car' in q['sql']])
+        self.assertNotIn('logistics_primary', response.cookies)
+
+        response, primary, replica = self.request('get', '/admin/logistics/car/export/csv/')
+        b''.join(response.streaming_content)
+        self.assertFalse([q for q in primary if 'logistics_car' in q['sql']])
+
+    def test_write_pins_request_and_next_requests(self):
+        response, primary, replica = self.request('post', f'/admin/logistics/container/{self.container.pk}/change/', {
+            'number': 'C1', 'arrival_date': '2025-03-05', 'status': 'sailing', 'ths': '100.00',
+            'ths_strategy': 'even', 'cars-TOTAL_FORMS': '0', 'cars-INITIAL_FORMS': '0',
+            'cars-MIN_NUM_FORMS': '0', 'cars-MAX_NUM_FORMS': '1000',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('logistics_primary', response.cookies)
+        self.assertFalse([q for q in replica if 'logistics_' in q['sql']])
+
+        response, primary, replica = self.request('get', '/admin/logistics/container/')
+        self.assertFalse(replica)
+        self.assertContains(response, 'C1')
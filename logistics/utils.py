@@ -1,24 +1,12 @@
 from io import BytesIO
-from django.http import HttpResponse
-from reportlab.pdfgen import canvas
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
+from .pdf import invoice_documents, render_invoice_pdf
 
 
 def generate_invoice_pdf(invoice):
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer)
-    p.drawString(100, 800, f"Счет #{invoice.id}")
-    p.drawString(100, 780, f"Клиент: {invoice.client.name}")
-    p.drawString(100, 760, f"Сумма: {invoice.amount} USD")
-    p.drawString(100, 740, f"Дата выставления: {invoice.issue_date}")
-    p.drawString(100, 720, f"Срок оплаты: {invoice.due_date}")
-    p.drawString(100, 700, f"Статус: {invoice.status}")
-    p.showPage()
-    p.save()
-
-    buffer.seek(0)
-    return buffer
+    document = next(invoice_documents([invoice.pk]))
+    return BytesIO(render_invoice_pdf(document))
 
 
 def send_invoice_email(invoice):
@@ -1,4 +1,7 @@
 # logistics/views.py
+import hmac
+from datetime import date, datetime, time, timedelta
+
 from django.http import HttpResponse
 
 
@@ -6,8 +9,14 @@ def index(request):
     return HttpResponse("Hello, this is the logistics app!")
 
 
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render
 from django.http import JsonResponse
+from django.utils import timezone
+from django.shortcuts import get_object_or_404
+from logistics import cache, ledger, metrics
+from logistics.models import Car, Client, Container, Warehouse
 from logistics.tasks import send_payment_reminder
 
 def send_reminder_view(request):
@@ -15,4 +24,60 @@ def send_reminder_view(request):
     return JsonResponse({"status": "success", "message": "Reminder sent!"})
 # Create your views here.
 def home(request):
-    return render(request, 'logistics/home.html')
\ No newline at end of file
+    context = {}
+    if request.user.is_staff:
+        counts = cache.car_status_counts()
+        context['car_status_counts'] = [(label, counts[status]) for status, label in Car.STATUS_CHOICES]
+    return render(request, 'logistics/home.html', context)
+
+
+@staff_member_required
+def warehouse_occupancy(request):
+    # Читаем готовые счётчики, без подсчёта машин
+    warehouses = Warehouse.objects.order_by('name').values('id', 'name', 'capacity', 'occupied')
+    return JsonResponse({
+        'warehouses': [{**warehouse, 'free': warehouse['capacity'] - warehouse['occupied']} for warehouse in warehouses]
+    })
+
+
+@staff_member_required
+def container_cars(request, pk):
+    container = get_object_or_404(Container.objects.only('number'), pk=pk)
+    return JsonResponse({'container': container.number, 'cars': cache.container_cars(pk)})
+
+
+@staff_member_required
+def cache_stats(request):
+    return JsonResponse({'stats': cache.cache_stats()})
+
+
+def metrics_view(request):
+    # Prometheus ходит без сессии, поэтому кроме сотрудников пускаем по токену
+    token = settings.LOGISTICS_METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not (request.user.is_active and request.user.is_staff) and not (
+        token and hmac.compare_digest(authorization, f'Bearer {token}')
+    ):
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+def client_balance(request, pk):
+    # Материализованный остаток — без агрегатов по счетам и платежам
+    client = get_object_or_404(Client.objects.only('name', 'balance'), pk=pk)
+    return JsonResponse({'client': client.name, 'balance': client.balance})
+
+
+@staff_member_required
+def client_statement(request, pk):
+    # Выписка за период [start, end): остатки на границах и записи между ними по индексу
+    client = get_object_or_404(Client.objects.only('name'), pk=pk)
+    today = timezone.localdate()
+    try:
+        start = date.fromisoformat(request.GET.get('start') or today.replace(day=1).isoformat())
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else today + timedelta(days=1)
+    except ValueError:
+        return JsonResponse({'error': "Даты указываются в формате ГГГГ-ММ-ДД"}, status=400)
+    start, end = (timezone.make_aware(datetime.combine(day, time.min)) for day in (start, end))
+    return JsonResponse({'client': client.name, **ledger.statement(client.pk, start, end)})